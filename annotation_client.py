@@ -0,0 +1,77 @@
+"""
+Client for annotation_server.py, used by the Qt annotator's --server mode.
+Qt-free; keeps one HTTP/1.1 connection open to the server.
+"""
+import json
+import http.client
+from urllib.parse import urlsplit
+
+
+class ServerError(Exception):
+    def __init__(self, status, message):
+        super().__init__(f"{status}: {message}")
+        self.status = status
+
+
+class AnnotationClient:
+    def __init__(self, base_url, annotator, timeout=30):
+        url = urlsplit(base_url if "://" in base_url else f"http://{base_url}")
+        self.host = url.hostname
+        self.port = url.port or 80
+        self.annotator = annotator
+        self.timeout = timeout
+        self.conn = None
+
+    def request(self, method, path, body=None):
+        """
+        Return (status, body bytes), reconnecting once if the server closed
+        the kept-alive connection.
+        """
+        headers = {"Content-Type": "application/json"} if body is not None else {}
+        for attempt in range(2):
+            if self.conn is None:
+                self.conn = http.client.HTTPConnection(self.host, self.port, timeout=self.timeout)
+            try:
+                self.conn.request(method, path, body=body, headers=headers)
+                response = self.conn.getresponse()
+                return response.status, response.read()
+            except (ConnectionError, http.client.HTTPException):
+                self.close()
+                if attempt:
+                    raise
+
+    def call(self, method, path, data=None):
+        body = json.dumps(data).encode("utf-8") if data is not None else None
+        status, payload = self.request(method, path, body)
+        result = json.loads(payload or b"{}")
+        if status != 200:
+            raise ServerError(status, result.get("error", "request failed"))
+        return result
+
+    def lease(self, count, width, height):
+        """
+        Return up to count leases: dicts with "lease", "image", "prompt",
+        "expires" and the "a"/"b" image URLs.
+        """
+        data = {"annotator": self.annotator, "count": count, "width": width, "height": height}
+        return self.call("POST", "/api/lease", data)["leases"]
+
+    def vote(self, lease, preference):
+        return self.call("POST", "/api/vote", {"lease": lease, "preference": preference, "annotator": self.annotator})
+
+    def release(self, lease):
+        return self.call("POST", "/api/release", {"lease": lease})
+
+    def status(self):
+        return self.call("GET", "/api/status")
+
+    def fetch(self, path):
+        status, payload = self.request("GET", path)
+        if status != 200:
+            raise ServerError(status, f"failed to fetch {path}")
+        return payload
+
+    def close(self):
+        if self.conn is not None:
+            self.conn.close()
+            self.conn = None
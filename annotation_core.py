@@ -0,0 +1,130 @@
+"""
+Qt-free core of the annotator: pair discovery, prompt joining and annotation
+loading (range selection lives in pair_index.py). Used by the GUI in
+image_preference.py and by the headless CLI in annotator_cli.py; it must
+never import PyQt5.
+"""
+import os
+
+from annotation_journal import AnnotationJournal, atomic_write_json
+from annotation_store import AnnotationStore, is_store_path
+from pairing import pair_order
+from prompt_store import PromptIndex, load_prompts_for, open_fresh_index
+
+
+# Valid preferences: Folder A, Folder B, or tie / no preference
+PREFERENCES = ("A", "B", "T")
+
+
+def find_pairs(index_a, index_b):
+    """
+    Return the lowercase names (join keys, for indexes wrapped by a pairing
+    rule) present in both indexes: numeric ids in numeric order, then the
+    other names in natural order of the Folder A filenames.
+    """
+    common_images_lower = index_a.lower_names().intersection(index_b.lower_names())
+    a_mapping = index_a.by_lower
+    return sorted(common_images_lower, key=lambda x: pair_order(x, a_mapping[x]))
+
+
+def read_annotations(path):
+    """
+    Read an annotations.json file (plus its journal, if a session crashed)
+    and validate that it maps strings to strings. A SQLite store returns the
+    latest vote per image; its schema already guarantees valid entries.
+    """
+    if is_store_path(path):
+        store = AnnotationStore(path, readonly=True)
+        try:
+            return store.load()
+        finally:
+            store.close()
+    annotations = AnnotationJournal(path).load()
+    for key, value in annotations.items():
+        if not isinstance(key, str) or not isinstance(value, str):
+            raise ValueError("All keys and values in annotations must be strings.")
+    return annotations
+
+
+def normalize_annotations(annotations, index_a=None):
+    """
+    Drop invalid preferences and match keys case-insensitively. With a Folder A
+    index, keys use the actual filename casing (matched through the index's
+    pairing rule); images not in the folder (and all keys without an index)
+    are kept lowercased so saving never loses them.
+    """
+    normalized = {}
+    for key, pref in annotations.items():
+        # Ensure preference is one of "A", "B", or "T"
+        if pref not in PREFERENCES:
+            continue
+        img_lower = key.lower()
+        if index_a is not None:
+            normalized[index_a.by_lower.get(index_a.key_of(key), img_lower)] = pref
+        else:
+            normalized[img_lower] = pref
+    return normalized
+
+
+def save_annotations(path, annotations):
+    atomic_write_json(path, annotations)
+
+
+def annotation_stats(annotations):
+    """
+    Count preferences: { "A": n, "B": n, "T": n, "total": n }.
+    """
+    counts = {pref: 0 for pref in PREFERENCES}
+    for pref in annotations.values():
+        if pref in counts:
+            counts[pref] += 1
+    counts["total"] = sum(counts[pref] for pref in PREFERENCES)
+    return counts
+
+
+def read_prompts(path, image_names):
+    """
+    Return { lowercase name: prompt } for image_names, using the SQLite index
+    when it is up to date and streaming the prompt file otherwise. path may
+    also be a prompt index or annotation store itself.
+    """
+    wanted = set(image_names)
+    if is_store_path(path):
+        if not os.path.exists(path):
+            raise FileNotFoundError(path)
+        index = PromptIndex(path)
+    else:
+        index = open_fresh_index(path)
+    if index is None:
+        return load_prompts_for(path, wanted)
+    try:
+        return index.get_many(wanted)
+    finally:
+        index.close()
+
+
+def read_pair_prompts(path, image_names, index_a):
+    """
+    Return { pair name: prompt } for image_names. Prompt files are keyed by
+    Folder A filename, which differs from the pair name when pairs are
+    joined by a pairing rule.
+    """
+    by_filename = {index_a.by_lower.get(img_lower, img_lower).lower(): img_lower for img_lower in image_names}
+    return {by_filename[name]: prompt for name, prompt in read_prompts(path, by_filename).items()}
+
+
+def iter_pair_records(folder_a, folder_b, image_names, index_a, index_b, prompts=None):
+    """
+    Yield one dict per pair with the actual paths in both folders and the
+    prompt, if any.
+    """
+    prompts = prompts or {}
+    for img_lower in image_names:
+        record = {
+            "image": index_a.by_lower[img_lower],
+            "a": index_a.path_of(index_a.by_lower[img_lower]),
+            "b": index_b.path_of(index_b.by_lower[img_lower]),
+        }
+        if img_lower in prompts:
+            record["prompt"] = prompts[img_lower]
+        yield record
@@ -0,0 +1,181 @@
+import os
+import json
+import time
+
+
+def atomic_write_json(path, data, indent=4):
+    """
+    Write data as JSON (same layout as annotations.json, or compact with
+    indent=None) via a temporary file and rename, so readers never see a
+    half-written file.
+    """
+    directory = os.path.dirname(os.path.abspath(path))
+    tmp_path = f"{path}.{os.getpid()}.tmp"
+    try:
+        with open(tmp_path, 'w', encoding='utf-8') as f:
+            json.dump(data, f, ensure_ascii=False, indent=indent)
+            f.flush()
+            os.fsync(f.fileno())
+        os.replace(tmp_path, path)
+    except BaseException:
+        try:
+            os.remove(tmp_path)
+        except OSError:
+            pass
+        raise
+    _fsync_dir(directory)
+
+
+def _fsync_dir(directory):
+    # Make the rename itself durable; not supported on every platform
+    try:
+        fd = os.open(directory, os.O_RDONLY)
+    except OSError:
+        return
+    try:
+        os.fsync(fd)
+    except OSError:
+        pass
+    finally:
+        os.close(fd)
+
+
+class AnnotationJournal:
+    """
+    Append-only journal next to an annotations.json snapshot.
+
+    Every preference is appended as one JSON line to `<snapshot>.journal` and
+    flushed to the OS immediately; fsync is batched every `fsync_every`
+    records or `fsync_interval` seconds. `compact()` rewrites the snapshot
+    atomically and truncates the journal. `load()` replays snapshot plus
+    journal, ignoring a torn last line left by a crash.
+    """
+
+    def __init__(self, snapshot_path, fsync_every=16, fsync_interval=2.0, compact_every=1000):
+        self.snapshot_path = snapshot_path
+        self.journal_path = snapshot_path + ".journal"
+        self.fsync_every = fsync_every
+        self.fsync_interval = fsync_interval
+        self.compact_every = compact_every
+
+        self.file = None
+        self.records = 0  # records in the journal since the last compaction
+        self.unsynced = 0
+        self.last_sync = time.monotonic()
+
+    def load(self):
+        """
+        Return the annotations in the snapshot with the journal applied on top.
+        """
+        annotations = {}
+        if os.path.exists(self.snapshot_path):
+            with open(self.snapshot_path, 'r', encoding='utf-8') as f:
+                annotations = json.load(f)
+            if not isinstance(annotations, dict):
+                raise ValueError("Annotations file must contain a dictionary.")
+
+        self.records = 0
+        if os.path.exists(self.journal_path):
+            skipped = 0
+            with open(self.journal_path, 'r', encoding='utf-8') as f:
+                for line in f:
+                    try:
+                        record = json.loads(line)
+                    except ValueError:
+                        # Torn write from a crash, only possible on the last line
+                        continue
+                    # Anything else that is not a record is skipped too, so one
+                    # bad line never makes the annotations unloadable
+                    if not isinstance(record, dict) or not isinstance(record.get("image"), str) \
+                            or "preference" not in record:
+                        skipped += 1
+                        continue
+                    annotations[record["image"]] = record["preference"]
+                    self.records += 1
+            if self.records:
+                print(f"Recovered {self.records} annotations from {self.journal_path}")
+            if skipped:
+                print(f"Skipped {skipped} invalid records in {self.journal_path}")
+        return annotations
+
+    def repair_tail(self):
+        """
+        Make the journal end with a newline before appending to it. A torn
+        last record is cut off (load() skips it anyway); otherwise the next
+        record would be written onto the same line and lost with it.
+        """
+        try:
+            f = open(self.journal_path, 'rb+')
+        except FileNotFoundError:
+            return
+        with f:
+            size = f.seek(0, os.SEEK_END)
+            if size == 0:
+                return
+            f.seek(size - 1)
+            if f.read(1) == b"\n":
+                return
+            # Find the start of the unterminated last line
+            start = size
+            while start > 0:
+                chunk_start = max(0, start - 4096)
+                f.seek(chunk_start)
+                newline = f.read(start - chunk_start).rfind(b"\n")
+                if newline >= 0:
+                    start = chunk_start + newline + 1
+                    break
+                start = chunk_start
+            f.seek(start)
+            tail = f.read()
+            try:
+                json.loads(tail)
+            except ValueError:
+                print(f"Dropping a torn record at the end of {self.journal_path}")
+                f.truncate(start)
+            else:
+                f.write(b"\n")
+            f.flush()
+            os.fsync(f.fileno())
+
+    def append(self, image, preference, annotator=None):
+        if self.file is None:
+            self.repair_tail()
+            self.file = open(self.journal_path, 'a', encoding='utf-8')
+        record = {"image": image, "preference": preference, "time": time.time()}
+        if annotator:
+            record["annotator"] = annotator
+        self.file.write(json.dumps(record, ensure_ascii=False) + "\n")
+        self.file.flush()
+        self.records += 1
+        self.unsynced += 1
+        if self.unsynced >= self.fsync_every or time.monotonic() - self.last_sync >= self.fsync_interval:
+            self.sync()
+
+    def sync(self):
+        if self.file is not None and self.unsynced:
+            os.fsync(self.file.fileno())
+        self.unsynced = 0
+        self.last_sync = time.monotonic()
+
+    def needs_compaction(self):
+        return self.records >= self.compact_every
+
+    def compact(self, annotations):
+        """
+        Write annotations as the new snapshot and empty the journal. A crash
+        between the two steps only replays records already in the snapshot.
+        """
+        self.sync()
+        atomic_write_json(self.snapshot_path, annotations)
+        if self.file is not None:
+            self.file.close()
+            self.file = None
+        if os.path.exists(self.journal_path):
+            os.remove(self.journal_path)
+        self.records = 0
+
+    def close(self):
+        self.sync()
+        if self.file is not None:
+            self.file.close()
+            self.file = None
@@ -0,0 +1,178 @@
+"""
+Merge many annotators' annotations.json files into one consolidated result.
+
+Files are read in parallel and their records spilled into shard files by a
+stable hash of the lowercase image name; each shard is then reduced on its
+own, so memory is bounded by the largest input file and the largest shard
+rather than by the total number of records.
+"""
+import os
+import json
+import zlib
+import tempfile
+from concurrent.futures import ProcessPoolExecutor
+
+from annotation_core import PREFERENCES, read_annotations, normalize_annotations
+
+
+def shard_of(key, shards):
+    # crc32 is stable across processes, unlike hash()
+    return zlib.crc32(key.encode("utf-8")) % shards
+
+
+def _spill_file(job):
+    """
+    Worker: read one annotation file and append its records to the shard files.
+    Returns the number of records written.
+    """
+    file_index, path, annotator, tmp_dir, shards = job
+    annotations = normalize_annotations(read_annotations(path))
+
+    buckets = [[] for _ in range(shards)]
+    for key, pref in annotations.items():
+        buckets[shard_of(key, shards)].append(json.dumps([key, pref, annotator], ensure_ascii=False))
+
+    for shard, lines in enumerate(buckets):
+        if not lines:
+            continue
+        # One file per (shard, input) so workers never share a file handle
+        shard_dir = os.path.join(tmp_dir, f"shard_{shard}")
+        os.makedirs(shard_dir, exist_ok=True)
+        with open(os.path.join(shard_dir, f"{file_index}.jsonl"), 'w', encoding='utf-8') as f:
+            f.write("\n".join(lines) + "\n")
+    return len(annotations)
+
+
+def resolve(votes, tie="T"):
+    """
+    Majority vote over { "A": n, "B": n, "T": n }. When the top counts are
+    tied the result is `tie` ("T" for no preference, or None to leave the
+    image out of the consolidated annotations).
+    """
+    best = max(votes.values())
+    winners = [pref for pref in PREFERENCES if votes[pref] == best]
+    return winners[0] if len(winners) == 1 else tie
+
+
+def _reduce_shard(job):
+    """
+    Worker: group one shard's records by image and write one result per image.
+    Returns summary counts for the shard.
+    """
+    shard_dir, out_path, tie = job
+    grouped = {}
+    if os.path.isdir(shard_dir):
+        for name in os.listdir(shard_dir):
+            with open(os.path.join(shard_dir, name), 'r', encoding='utf-8') as f:
+                for line in f:
+                    key, pref, annotator = json.loads(line)
+                    grouped.setdefault(key, []).append((annotator, pref))
+
+    summary = {"images": 0, "records": 0, "agreed": 0, "conflicts": 0, "single": 0, "unresolved": 0}
+    with open(out_path, 'w', encoding='utf-8') as out:
+        for key in sorted(grouped):
+            records = grouped[key]
+            votes = {pref: 0 for pref in PREFERENCES}
+            for _, pref in records:
+                votes[pref] += 1
+            preference = resolve(votes, tie)
+
+            summary["images"] += 1
+            summary["records"] += len(records)
+            if len(records) == 1:
+                summary["single"] += 1
+            elif max(votes.values()) == len(records):
+                summary["agreed"] += 1
+            else:
+                summary["conflicts"] += 1
+            if preference is None:
+                summary["unresolved"] += 1
+
+            result = {
+                "image": key,
+                "preference": preference,
+                "votes": votes,
+                "annotators": len(records),
+                "agreement": max(votes.values()) / len(records),
+            }
+            if len(set(pref for _, pref in records)) > 1:
+                result["by_annotator"] = {annotator: pref for annotator, pref in sorted(records)}
+            out.write(json.dumps(result, ensure_ascii=False) + "\n")
+    return summary
+
+
+def annotator_names(paths):
+    # Use the file name, or the full path when two annotators share a file name
+    names = [os.path.basename(path) for path in paths]
+    if len(set(names)) != len(names):
+        names = list(paths)
+    return names
+
+
+def merge_files(paths, output, report=None, workers=None, shards=None, tie="T", tmp_dir=None):
+    """
+    Merge annotation files by majority vote.
+
+    Writes the consolidated { image: preference } to output in the
+    annotations.json format and, if report is given, one JSON line per image
+    with its vote counts, agreement and (for conflicts) each annotator's vote.
+    Returns summary counts.
+    """
+    workers = workers or os.cpu_count()
+    # Aim for shards of roughly a million records when sizes are unknown
+    if shards is None:
+        total_bytes = sum(os.path.getsize(path) for path in paths)
+        shards = max(workers, total_bytes // (32 * 1024 * 1024) + 1)
+
+    with tempfile.TemporaryDirectory(dir=tmp_dir) as tmp, ProcessPoolExecutor(max_workers=workers) as executor:
+        spill_jobs = [
+            (i, path, annotator, tmp, shards)
+            for i, (path, annotator) in enumerate(zip(paths, annotator_names(paths)))
+        ]
+        records_read = sum(executor.map(_spill_file, spill_jobs))
+
+        result_paths = [os.path.join(tmp, f"result_{shard}.jsonl") for shard in range(shards)]
+        reduce_jobs = [
+            (os.path.join(tmp, f"shard_{shard}"), result_paths[shard], tie)
+            for shard in range(shards)
+        ]
+        summary = {"files": len(paths), "records_read": records_read}
+        for shard_summary in executor.map(_reduce_shard, reduce_jobs):
+            for key, value in shard_summary.items():
+                summary[key] = summary.get(key, 0) + value
+
+        _write_outputs(result_paths, output, report)
+    return summary
+
+
+def _write_outputs(result_paths, output, report):
+    """
+    Stream the shard results into the consolidated annotations file (written
+    to a temporary name and renamed) and the optional JSONL report.
+    """
+    tmp_output = f"{output}.{os.getpid()}.tmp"
+    report_file = open(report, 'w', encoding='utf-8') if report else None
+    try:
+        with open(tmp_output, 'w', encoding='utf-8') as out:
+            # Same layout as json.dump(..., indent=4), without holding the dict
+            out.write("{")
+            first = True
+            for result_path in result_paths:
+                with open(result_path, 'r', encoding='utf-8') as f:
+                    for line in f:
+                        if report_file is not None:
+                            report_file.write(line)
+                        result = json.loads(line)
+                        if result["preference"] is None:
+                            continue
+                        out.write("\n" if first else ",\n")
+                        out.write(f"    {json.dumps(result['image'], ensure_ascii=False)}: "
+                                  f"{json.dumps(result['preference'])}")
+                        first = False
+            out.write("}" if first else "\n}")
+        os.replace(tmp_output, output)
+    finally:
+        if report_file is not None:
+            report_file.close()
+        if os.path.exists(tmp_output):
+            os.remove(tmp_output)
@@ -0,0 +1,642 @@
+"""
+Multi-annotator server: one asyncio HTTP service hands out image pairs to
+many annotators through a shared work queue. Qt-free; needs Pillow.
+
+Pairs are leased for a limited time; a lease that is not voted on before it
+expires goes back to the front of the queue. Images are served pre-scaled
+(through the thumbnail store and an in-memory cache) and votes are written
+to one central annotations.json with its journal (or a SQLite store), plus
+a votes log that records who voted what.
+
+    python annotation_server.py FOLDER_A FOLDER_B -o annotations.json --prompts imgName2prompt.json
+
+Annotators open http://HOST:PORT/ in a browser, or run
+`python image_preference.py --server http://HOST:PORT --annotator NAME`.
+
+API (JSON bodies):
+    POST /api/lease    {"annotator", "count", "width", "height"} -> {"leases": [...]}
+    POST /api/vote     {"lease", "preference", "annotator"}
+    POST /api/release  {"lease"}
+    GET  /api/status
+    GET  /image/a/NAME?w=W&h=H, /image/b/NAME?w=W&h=H
+    GET  /metrics      latency histograms in the Prometheus text format
+"""
+import io
+import sys
+import json
+import time
+import heapq
+import signal
+import asyncio
+import argparse
+import itertools
+from collections import deque
+from urllib.parse import urlsplit, parse_qs, quote, unquote
+from concurrent.futures import ThreadPoolExecutor
+
+import archive_source
+from archive_source import open_image_source
+from annotation_core import PREFERENCES, find_pairs, normalize_annotations, read_pair_prompts
+from pairing import PAIR_KEYS, PairingRule, keyed_source, pairing_report, format_pairing_report
+from annotation_store import open_annotation_log
+from image_cache import ImageCache
+from latency import recorder
+from pair_index import PairIndex, parse_ranges
+from thumbnail_store import ThumbnailStore
+
+
+# Served image sizes are rounded to this step and clamped, like the GUI display size
+SIZE_STEP = 100
+MIN_SIZE = 100
+MAX_SIZE = 2000
+MAX_BODY = 64 * 1024
+MAX_LEASE_COUNT = 64
+
+REASONS = {
+    200: "OK",
+    400: "Bad Request",
+    404: "Not Found",
+    405: "Method Not Allowed",
+    409: "Conflict",
+    413: "Payload Too Large",
+    500: "Internal Server Error",
+}
+
+
+class HTTPError(Exception):
+    def __init__(self, status, message):
+        super().__init__(message)
+        self.status = status
+
+
+class LeaseError(Exception):
+    pass
+
+
+class WorkQueue:
+    """
+    Pairs waiting to be annotated, handed out with expiring leases.
+
+    A lease stays valid after it expires until its pair is leased again, so
+    a slow annotator's vote still counts if nobody else took the pair.
+    """
+
+    def __init__(self, names, lease_seconds=300):
+        self.lease_seconds = lease_seconds
+        self.pending = deque(names)
+        self.total = len(self.pending)
+        # { lease id: [name, annotator, expires] }
+        self.leases = {}
+        # { name: lease id } of the latest lease of each leased pair
+        self.current = {}
+        # (expires, lease id), lazily cleaned
+        self.expiry = []
+        self.done = set()
+        self.ids = itertools.count(1)
+
+    def expire(self, now):
+        while self.expiry and self.expiry[0][0] <= now:
+            expires, lease_id = heapq.heappop(self.expiry)
+            lease = self.leases.get(lease_id)
+            if lease is None or lease[2] != expires or lease[0] in self.done:
+                continue
+            # Expired pairs are served again first
+            self.pending.appendleft(lease[0])
+
+    def lease(self, annotator, count, now=None):
+        """
+        Return up to count (lease id, name, expires) tuples.
+        """
+        now = time.time() if now is None else now
+        self.expire(now)
+        leased = []
+        while self.pending and len(leased) < count:
+            name = self.pending.popleft()
+            if name in self.done:
+                continue
+            previous = self.current.get(name)
+            if previous is not None:
+                lease = self.leases.get(previous)
+                if lease is not None and lease[2] > now:
+                    # Still held by someone (e.g. released and requeued twice)
+                    continue
+                self.leases.pop(previous, None)
+            lease_id = f"{next(self.ids)}"
+            expires = now + self.lease_seconds
+            self.leases[lease_id] = [name, annotator, expires]
+            self.current[name] = lease_id
+            heapq.heappush(self.expiry, (expires, lease_id))
+            leased.append((lease_id, name, expires))
+        return leased
+
+    def complete(self, lease_id):
+        """
+        Close a lease after its vote. Returns the pair name.
+        """
+        lease = self.leases.pop(lease_id, None)
+        if lease is None:
+            raise LeaseError("Unknown or expired lease.")
+        name = lease[0]
+        if name in self.done:
+            raise LeaseError("Pair already annotated.")
+        self.done.add(name)
+        if self.current.get(name) == lease_id:
+            del self.current[name]
+        return name
+
+    def reopen(self, lease_id, lease):
+        """
+        Undo complete() when the vote could not be stored, so the same lease
+        can vote again.
+        """
+        name = lease[0]
+        self.done.discard(name)
+        self.leases[lease_id] = lease
+        self.current.setdefault(name, lease_id)
+
+    def release(self, lease_id):
+        lease = self.leases.pop(lease_id, None)
+        if lease is None or lease[0] in self.done:
+            return
+        if self.current.get(lease[0]) == lease_id:
+            del self.current[lease[0]]
+        self.pending.appendleft(lease[0])
+
+    def stats(self, now=None):
+        now = time.time() if now is None else now
+        active = sum(1 for lease in self.leases.values() if lease[2] > now)
+        return {
+            "total": self.total,
+            "done": len(self.done),
+            "leased": active,
+            "remaining": self.total - len(self.done),
+        }
+
+
+def render_scaled(path, size, thumbnails=None):
+    """
+    Return (bytes, content type) of path scaled to fit size, using and
+    filling the thumbnail store when one is given. Runs in worker threads.
+    """
+    from PIL import Image
+
+    if thumbnails is not None:
+        thumb_path = thumbnails.find(path, size)
+        if thumb_path:
+            with open(thumb_path, "rb") as f:
+                return f.read(), "image/png" if thumb_path.endswith(".png") else "image/jpeg"
+
+    source = path
+    if archive_source.split_member(path) is not None:
+        source = io.BytesIO(archive_source.read_member(path))
+    with Image.open(source) as im:
+        im.draft("RGB", size)
+        has_alpha = im.mode in ("RGBA", "LA", "PA") or (im.mode == "P" and "transparency" in im.info)
+        im = im.convert("RGBA" if has_alpha else "RGB")
+        im.thumbnail(size, Image.LANCZOS)
+        out = io.BytesIO()
+        if has_alpha:
+            im.save(out, "PNG")
+        else:
+            im.save(out, "JPEG", quality=90)
+    data = out.getvalue()
+
+    if thumbnails is not None:
+        def writer(tmp_path):
+            with open(tmp_path, "wb") as f:
+                f.write(data)
+            return True
+        thumbnails.write(path, size, has_alpha, writer)
+    return data, "image/png" if has_alpha else "image/jpeg"
+
+
+class AnnotationServer:
+    def __init__(self, folder_a, folder_b, output, ranges=None, prompts_file=None, lease_seconds=300,
+                 thumbnails=True, thumbnail_dir=None, workers=4, cache_mb=256, pair_key="name", pair_key_b=None):
+        # Pairs are served under their join keys (see pairing.py)
+        self.index_a = keyed_source(open_image_source(folder_a), PairingRule(pair_key))
+        self.index_b = keyed_source(open_image_source(folder_b), PairingRule(pair_key_b or pair_key))
+        names = find_pairs(self.index_a, self.index_b)
+        for line in format_pairing_report(pairing_report(self.index_a, self.index_b, names)):
+            print(line)
+        if ranges is not None:
+            names = list(PairIndex(names, self.index_a).select(ranges))
+        self.names = set(names)
+
+        self.prompts = read_pair_prompts(prompts_file, names, self.index_a) if prompts_file else {}
+
+        # Central store: annotations.json plus journal, or a SQLite store, resumed on restart.
+        # One writer thread owns it, so fsyncs and inserts never block the event loop
+        # (and the SQLite connection stays in the thread that opened it).
+        self.output = output
+        self.writer = ThreadPoolExecutor(max_workers=1)
+        self.journal = self.writer.submit(open_annotation_log, output, compact_every=50000).result()
+        self.annotations = normalize_annotations(self.writer.submit(self.journal.load).result(), self.index_a)
+        annotated = {self.index_a.key_of(key) for key in self.annotations}
+        self.queue = WorkQueue([name for name in names if name not in annotated], lease_seconds)
+        self.votes_log = open(output + ".votes.jsonl", "a", encoding="utf-8")
+        self.votes_by_annotator = {}
+
+        self.thumbnails = ThumbnailStore(thumbnail_dir) if thumbnails else None
+        self.executor = ThreadPoolExecutor(max_workers=workers)
+        # Encoded images by (path, mtime, size)
+        self.image_cache = ImageCache(max_bytes=cache_mb * 1024 * 1024)
+        # { cache key: Future } so concurrent requests for one image render it once
+        self.rendering = {}
+        self.server = None
+        print(f"Serving {len(names)} pairs, {self.queue.total} left to annotate")
+
+    # -- HTTP --------------------------------------------------------------
+
+    async def start(self, host="127.0.0.1", port=8765):
+        self.server = await asyncio.start_server(self.handle_connection, host, port, backlog=1024)
+        return self.server.sockets[0].getsockname()[1]
+
+    async def handle_connection(self, reader, writer):
+        try:
+            while True:
+                request_line = await reader.readline()
+                if not request_line:
+                    break
+                method, target, version = request_line.decode("latin-1").split()
+                headers = {}
+                while True:
+                    line = await reader.readline()
+                    if line in (b"\r\n", b"\n", b""):
+                        break
+                    key, _, value = line.decode("latin-1").partition(":")
+                    headers[key.strip().lower()] = value.strip()
+
+                length = int(headers.get("content-length") or 0)
+                if length > MAX_BODY:
+                    status, content_type, payload = self.error(413, "Request body too large.")
+                    keep_alive = False
+                else:
+                    body = await reader.readexactly(length) if length else b""
+                    status, content_type, payload = await self.dispatch(method, target, body)
+                    keep_alive = version == "HTTP/1.1" and headers.get("connection", "").lower() != "close"
+
+                writer.write(
+                    f"HTTP/1.1 {status} {REASONS.get(status, '')}\r\n"
+                    f"Content-Type: {content_type}\r\n"
+                    f"Content-Length: {len(payload)}\r\n"
+                    f"Connection: {'keep-alive' if keep_alive else 'close'}\r\n\r\n".encode("latin-1") + payload
+                )
+                await writer.drain()
+                if not keep_alive:
+                    break
+        except (ConnectionError, asyncio.IncompleteReadError, ValueError):
+            pass
+        finally:
+            writer.close()
+
+    def error(self, status, message):
+        return status, "application/json", json.dumps({"error": message}).encode("utf-8")
+
+    async def dispatch(self, method, target, body):
+        url = urlsplit(target)
+        path = url.path
+        query = parse_qs(url.query)
+        route = path.split("/")[2] if path.startswith(("/api/", "/image/")) else path.strip("/") or "page"
+        with recorder.time(f"http_{route}"):
+            try:
+                if path.startswith("/image/"):
+                    if method != "GET":
+                        raise HTTPError(405, "Use GET.")
+                    return await self.serve_image(path, query)
+                if path.startswith("/api/"):
+                    data = json.loads(body or b"{}") if method == "POST" else {}
+                    if not isinstance(data, dict):
+                        raise HTTPError(400, "Expected a JSON object.")
+                    result = await self.api(method, path, data)
+                    return 200, "application/json", json.dumps(result, ensure_ascii=False).encode("utf-8")
+                if path == "/" and method == "GET":
+                    return 200, "text/html; charset=utf-8", PAGE.encode("utf-8")
+                if path == "/metrics" and method == "GET":
+                    return 200, "text/plain; version=0.0.4", recorder.to_prometheus().encode("utf-8")
+                raise HTTPError(404, "Not found.")
+            except HTTPError as e:
+                return self.error(e.status, str(e))
+            except LeaseError as e:
+                return self.error(409, str(e))
+            except ValueError as e:
+                return self.error(400, str(e))
+            except Exception as e:
+                print(f"Error handling {method} {target}: {e}")
+                return self.error(500, "Internal error.")
+
+    # -- API ---------------------------------------------------------------
+
+    async def api(self, method, path, data):
+        if path == "/api/status" and method == "GET":
+            return {**self.queue.stats(), "annotators": self.votes_by_annotator}
+        if method != "POST":
+            raise HTTPError(405, "Use POST.")
+        if path == "/api/lease":
+            return self.lease(data)
+        if path == "/api/vote":
+            return await self.vote(data)
+        if path == "/api/release":
+            self.queue.release(str(data.get("lease")))
+            return {"released": True}
+        raise HTTPError(404, "Unknown API call.")
+
+    def lease(self, data):
+        annotator = str(data.get("annotator") or "anonymous")
+        count = max(1, min(MAX_LEASE_COUNT, int_field(data, "count", 1)))
+        width, height = clamp_size(int_field(data, "width", 400), int_field(data, "height", 400))
+        leases = []
+        for lease_id, name, expires in self.queue.lease(annotator, count):
+            actual = self.index_a.by_lower.get(name, name)
+            query = f"?w={width}&h={height}"
+            leases.append({
+                "lease": lease_id,
+                "image": actual,
+                "expires": expires,
+                "prompt": self.prompts.get(name),
+                "a": f"/image/a/{quote(name)}{query}",
+                "b": f"/image/b/{quote(name)}{query}",
+            })
+        return {"leases": leases, "remaining": self.queue.total - len(self.queue.done)}
+
+    async def vote(self, data):
+        preference = data.get("preference")
+        if preference not in PREFERENCES:
+            raise ValueError(f"Preference must be one of {', '.join(PREFERENCES)}.")
+        lease_id = str(data.get("lease"))
+        lease = self.queue.leases.get(lease_id)
+        annotator = lease[1] if lease else str(data.get("annotator") or "anonymous")
+        # Completed before the write so a second vote on the lease meanwhile is a 409
+        name = self.queue.complete(lease_id)
+
+        actual = self.index_a.by_lower.get(name, name)
+        previous = self.annotations.get(actual)
+        # Before the write, so a compaction in the writer includes this vote
+        self.annotations[actual] = preference
+        record = {"image": actual, "preference": preference, "annotator": annotator, "time": time.time()}
+        # The response waits for the write, so a 200 means the vote is stored
+        try:
+            await asyncio.get_running_loop().run_in_executor(self.writer, self.write_vote, record)
+        except Exception:
+            # Not stored: the lease is open again and the client can retry
+            self.queue.reopen(lease_id, lease)
+            if previous is None:
+                self.annotations.pop(actual, None)
+            else:
+                self.annotations[actual] = previous
+            raise
+        self.votes_by_annotator[annotator] = self.votes_by_annotator.get(annotator, 0) + 1
+        return {"image": actual, "preference": preference}
+
+    def write_vote(self, record):
+        """
+        Writer thread: append a vote to the store and the votes log.
+        """
+        self.journal.append(record["image"], record["preference"], record["annotator"])
+        if self.journal.needs_compaction():
+            # A copy, since the event loop keeps adding votes
+            self.journal.compact(dict(self.annotations))
+        self.votes_log.write(json.dumps(record, ensure_ascii=False) + "\n")
+        self.votes_log.flush()
+
+    # -- Images ------------------------------------------------------------
+
+    async def serve_image(self, path, query):
+        parts = path.split("/", 3)
+        if len(parts) != 4 or parts[2] not in ("a", "b"):
+            raise HTTPError(404, "Not found.")
+        name = unquote(parts[3]).lower()
+        # Only pairs being annotated are served, never arbitrary paths
+        if name not in self.names:
+            raise HTTPError(404, "Unknown image.")
+        index = self.index_a if parts[2] == "a" else self.index_b
+        source = index.path_of(index.by_lower[name])
+        size = clamp_size(query.get("w", [400])[0], query.get("h", [400])[0])
+
+        key = ImageCache.make_key(source, size)
+        if key is None:
+            raise HTTPError(404, "Image is missing.")
+        cached = self.image_cache.get(key)
+        if cached is not None:
+            data, content_type = cached
+            return 200, content_type, data
+        try:
+            data, content_type = await asyncio.shield(self.render(key, source, size))
+        except Exception as e:
+            raise HTTPError(404, f"Failed to load image: {e}")
+        return 200, content_type, data
+
+    def render(self, key, source, size):
+        """
+        Return a future of (bytes, content type) for source at size. Concurrent
+        requests for one image share a future; results go into the image cache.
+        """
+        future = self.rendering.get(key)
+        if future is None:
+            future = asyncio.get_running_loop().run_in_executor(
+                self.executor, render_scaled, source, size, self.thumbnails
+            )
+            self.rendering[key] = future
+
+            def done(future):
+                self.rendering.pop(key, None)
+                if not future.cancelled() and future.exception() is None:
+                    data, content_type = future.result()
+                    self.image_cache.put(key, (data, content_type), len(data))
+            future.add_done_callback(done)
+        return future
+
+    def close(self):
+        if self.server is not None:
+            self.server.close()
+        self.executor.shutdown(wait=False)
+        # After the votes still queued for the writer
+        self.writer.submit(self.close_store).result()
+        self.writer.shutdown()
+
+    def close_store(self):
+        self.journal.compact(self.annotations)
+        self.journal.close()
+        self.votes_log.close()
+
+
+def int_field(data, key, default):
+    """
+    An integer field of a JSON request; anything else is a 400.
+    """
+    value = data.get(key, default)
+    try:
+        return int(value)
+    except (TypeError, ValueError):
+        raise HTTPError(400, f"{key} must be an integer, not {json.dumps(value)}.")
+
+
+def clamp_size(width, height):
+    width = max(MIN_SIZE, min(MAX_SIZE, int(width) // SIZE_STEP * SIZE_STEP))
+    height = max(MIN_SIZE, min(MAX_SIZE, int(height) // SIZE_STEP * SIZE_STEP))
+    return width, height
+
+
+PAGE = """<!DOCTYPE html>
+<html>
+<head>
+<meta charset="utf-8">
+<title>Image Comparer</title>
+<style>
+  body { font-family: sans-serif; margin: 1em; }
+  #images { display: flex; gap: 1em; }
+  #images img { width: 48vw; height: 60vh; object-fit: contain; background: #eee; }
+  #prompt { margin: 1em 0; min-height: 3em; white-space: pre-wrap; }
+  #error { color: #b00; min-height: 1.2em; }
+  button { font-size: 1.2em; padding: 0.4em 1.5em; }
+</style>
+</head>
+<body>
+<div>Annotator: <input id="annotator"> <span id="progress"></span></div>
+<div id="images"><img id="a"><img id="b"></div>
+<div id="prompt"></div>
+<div id="error"></div>
+<div>
+  <button onclick="vote('A')">Left (1)</button>
+  <button onclick="vote('T')">No Preference (2)</button>
+  <button onclick="vote('B')">Right (3)</button>
+</div>
+<script>
+const name = document.getElementById("annotator");
+name.value = localStorage.getItem("annotator") || "";
+name.onchange = () => localStorage.setItem("annotator", name.value);
+let queue = [];
+let current = null;
+
+async function post(path, body) {
+  const response = await fetch(path, {method: "POST", body: JSON.stringify(body)});
+  const result = await response.json().catch(() => ({}));
+  if (!response.ok) {
+    const error = new Error(result.error || response.statusText);
+    error.status = response.status;
+    throw error;
+  }
+  return result;
+}
+
+function showError(message) {
+  document.getElementById("error").textContent = message;
+}
+
+async function refill() {
+  if (queue.length > 2) return;
+  const size = {width: Math.round(window.innerWidth / 2), height: Math.round(window.innerHeight * 0.6)};
+  const result = await post("/api/lease", {annotator: name.value, count: 8, ...size});
+  for (const lease of result.leases) {
+    // Start downloading ahead of time
+    new Image().src = lease.a;
+    new Image().src = lease.b;
+    queue.push(lease);
+  }
+  document.getElementById("progress").textContent = result.remaining + " left to annotate";
+}
+
+async function next() {
+  try {
+    await refill();
+  } catch (error) {
+    showError("Could not get new pairs: " + error.message);
+  }
+  current = queue.shift() || null;
+  document.getElementById("a").src = current ? current.a : "";
+  document.getElementById("b").src = current ? current.b : "";
+  document.getElementById("prompt").textContent = current ? (current.prompt || "No prompt available.") : "Nothing left to annotate.";
+}
+
+async function vote(preference) {
+  if (!current) return;
+  const pair = current;
+  current = null;
+  try {
+    await post("/api/vote", {lease: pair.lease, preference: preference, annotator: name.value});
+    showError("");
+  } catch (error) {
+    // An expired lease (409) went back to the queue; otherwise keep the pair so the vote can be retried
+    showError("Vote not saved: " + error.message);
+    if (error.status !== 409) {
+      current = pair;
+      return;
+    }
+  }
+  await next();
+}
+
+document.addEventListener("keydown", (event) => {
+  if (event.target === name) return;
+  const preference = {"1": "A", "ArrowLeft": "A", "2": "T", "ArrowDown": "T", "3": "B", "ArrowRight": "B"}[event.key];
+  if (preference) vote(preference);
+});
+window.addEventListener("pagehide", () => {
+  for (const lease of queue.concat(current ? [current] : [])) {
+    navigator.sendBeacon("/api/release", JSON.stringify({lease: lease.lease}));
+  }
+});
+next();
+</script>
+</body>
+</html>
+"""
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Serve image pairs to many annotators from one work queue.")
+    parser.add_argument("folder_a", help="Folder, tar/zip archive or directory of shards.")
+    parser.add_argument("folder_b", help="Folder, tar/zip archive or directory of shards.")
+    parser.add_argument("-o", "--output", default="annotations.json", help="Central annotations file, or a .sqlite annotation store.")
+    parser.add_argument("--ranges", help='Only serve these id ranges, e.g. "0-999,5000-5999".')
+    parser.add_argument("--prompts", help="Prompt file (JSON or JSONL).")
+    parser.add_argument("--pair-key", default="name",
+                        help=f"Join key of a file: {', '.join(PAIR_KEYS)} or a regular expression (see pairing.py).")
+    parser.add_argument("--pair-key-b", default=None, help="Join key rule for Folder B, if different.")
+    parser.add_argument("--host", default="127.0.0.1", help="Address to listen on (default: localhost only).")
+    parser.add_argument("--port", type=int, default=8765)
+    parser.add_argument("--lease-seconds", type=float, default=300, help="How long a pair stays assigned.")
+    parser.add_argument("--workers", type=int, default=4, help="Threads scaling images.")
+    parser.add_argument("--cache-mb", type=int, default=256, help="Memory budget for encoded images.")
+    parser.add_argument("--thumbnail-dir", default=None, help="Shared thumbnail directory.")
+    parser.add_argument("--no-thumbnails", action="store_true", help="Do not use the on-disk thumbnail store.")
+    args = parser.parse_args(argv)
+
+    server = AnnotationServer(
+        args.folder_a,
+        args.folder_b,
+        args.output,
+        ranges=parse_ranges(args.ranges) if args.ranges else None,
+        prompts_file=args.prompts,
+        lease_seconds=args.lease_seconds,
+        thumbnails=not args.no_thumbnails,
+        thumbnail_dir=args.thumbnail_dir,
+        workers=args.workers,
+        cache_mb=args.cache_mb,
+        pair_key=args.pair_key,
+        pair_key_b=args.pair_key_b,
+    )
+
+    async def run():
+        port = await server.start(args.host, args.port)
+        print(f"Listening on http://{args.host}:{port}/", flush=True)
+        # Stop cleanly on SIGTERM too, so the annotations are compacted
+        stop = asyncio.Event()
+        try:
+            asyncio.get_running_loop().add_signal_handler(signal.SIGTERM, stop.set)
+        except (NotImplementedError, AttributeError):
+            pass
+        await stop.wait()
+
+    try:
+        asyncio.run(run())
+    except KeyboardInterrupt:
+        pass
+    finally:
+        server.close()
+        print(f"Saved {len(server.annotations)} annotations to {args.output}")
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,224 @@
+"""
+SQLite annotation store, an alternative to annotations.json for sessions that
+share one file between several annotator processes.
+
+The database runs in WAL mode: readers never block the writer, and each
+preference is one autocommitted INSERT, so concurrent writers only queue on
+SQLite's write lock for the microseconds an insert takes (busy_timeout makes
+them wait instead of failing). Annotations are append-only rows with the
+annotator and a timestamp; the current preference for an image is its latest
+row, so no write ever overwrites another process's vote.
+
+Tables:
+    pairs        (name, image_id, image, a, b)   lowercase name, paths of both sides
+    prompts      (name, prompt)                   same layout as a prompt index
+    annotations  (id, name, image, image_id, preference, annotator, time)
+
+AnnotationStore has the interface of AnnotationJournal, so the GUI and the
+server use either through open_annotation_log(). Stores are recognised by
+their extension (.sqlite, .sqlite3, .db).
+
+    python annotator_cli.py import annotations.sqlite alice.json bob.json
+    python annotator_cli.py export annotations.sqlite -o annotations.json
+"""
+import os
+import time
+import sqlite3
+import pathlib
+
+from annotation_journal import AnnotationJournal, atomic_write_json
+# Same ids as the pair list and the GUI
+from pairing import image_id_of
+
+
+STORE_EXTENSIONS = (".sqlite", ".sqlite3", ".db")
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS pairs (
+    name TEXT PRIMARY KEY,
+    image_id INTEGER,
+    image TEXT NOT NULL,
+    a TEXT,
+    b TEXT
+);
+CREATE INDEX IF NOT EXISTS pairs_image_id ON pairs (image_id);
+CREATE TABLE IF NOT EXISTS prompts (
+    name TEXT PRIMARY KEY,
+    prompt TEXT NOT NULL
+);
+CREATE TABLE IF NOT EXISTS annotations (
+    id INTEGER PRIMARY KEY,
+    name TEXT NOT NULL,
+    image TEXT NOT NULL,
+    image_id INTEGER,
+    preference TEXT NOT NULL CHECK (preference IN ('A', 'B', 'T')),
+    annotator TEXT NOT NULL DEFAULT '',
+    time REAL NOT NULL
+);
+CREATE INDEX IF NOT EXISTS annotations_name ON annotations (name);
+CREATE INDEX IF NOT EXISTS annotations_image_id ON annotations (image_id);
+CREATE INDEX IF NOT EXISTS annotations_annotator ON annotations (annotator, name);
+"""
+
+
+def is_store_path(path):
+    return path.lower().endswith(STORE_EXTENSIONS)
+
+
+class AnnotationStore:
+    """
+    One process's connection to a SQLite annotation store. Votes appended
+    through it are attributed to annotator.
+    """
+
+    def __init__(self, path, annotator=None, readonly=False, timeout=30.0):
+        self.snapshot_path = path
+        self.annotator = annotator or ""
+        if readonly:
+            if not os.path.exists(path):
+                raise FileNotFoundError(path)
+            uri = pathlib.Path(os.path.abspath(path)).as_uri() + "?mode=ro"
+            self.conn = sqlite3.connect(uri, uri=True, timeout=timeout, isolation_level=None)
+        else:
+            # Autocommit: every statement outside an explicit BEGIN is its own transaction
+            self.conn = sqlite3.connect(path, timeout=timeout, isolation_level=None)
+            self.conn.execute("PRAGMA journal_mode = WAL")
+            # Durable at checkpoints; a power loss can drop the last votes but never corrupts
+            self.conn.execute("PRAGMA synchronous = NORMAL")
+            self.conn.executescript(SCHEMA)
+
+    # -- AnnotationJournal interface ----------------------------------------
+
+    def load(self, annotator=None):
+        """
+        Return { image: preference } with the latest vote per image, over all
+        annotators or only annotator's.
+        """
+        if annotator is None:
+            rows = self.conn.execute(
+                "SELECT image, preference FROM annotations WHERE id IN "
+                "(SELECT MAX(id) FROM annotations GROUP BY name) ORDER BY id"
+            )
+        else:
+            rows = self.conn.execute(
+                "SELECT image, preference FROM annotations WHERE id IN "
+                "(SELECT MAX(id) FROM annotations WHERE annotator = ? GROUP BY name) ORDER BY id",
+                (annotator,),
+            )
+        return dict(rows)
+
+    def append(self, image, preference, annotator=None):
+        self.conn.execute(
+            "INSERT INTO annotations (name, image, image_id, preference, annotator, time) VALUES (?, ?, ?, ?, ?, ?)",
+            (image.lower(), image, image_id_of(image), preference, annotator or self.annotator, time.time()),
+        )
+
+    def sync(self):
+        pass
+
+    def needs_compaction(self):
+        return False
+
+    def compact(self, annotations):
+        """
+        Record the entries of annotations that differ from the store's latest
+        votes (e.g. after saving a session under a new name) and checkpoint the WAL.
+        """
+        current = {image.lower(): preference for image, preference in self.load().items()}
+        changed = [(image, preference) for image, preference in annotations.items()
+                   if current.get(image.lower()) != preference]
+        if changed:
+            self.append_many(changed)
+        self.conn.execute("PRAGMA wal_checkpoint(PASSIVE)")
+
+    def close(self):
+        self.conn.close()
+
+    # -- Bulk access -----------------------------------------------------------
+
+    def append_many(self, items, annotator=None, timestamp=None):
+        """
+        Insert (image, preference) pairs in one transaction.
+        """
+        annotator = annotator or self.annotator
+        timestamp = timestamp or time.time()
+        with self.conn:
+            self.conn.execute("BEGIN IMMEDIATE")
+            self.conn.executemany(
+                "INSERT INTO annotations (name, image, image_id, preference, annotator, time) VALUES (?, ?, ?, ?, ?, ?)",
+                ((image.lower(), image, image_id_of(image), preference, annotator, timestamp)
+                 for image, preference in items),
+            )
+
+    def add_pairs(self, records):
+        """
+        Insert or update pair records as yielded by iter_pair_records().
+        """
+        with self.conn:
+            self.conn.execute("BEGIN IMMEDIATE")
+            self.conn.executemany(
+                "INSERT OR REPLACE INTO pairs (name, image_id, image, a, b) VALUES (?, ?, ?, ?, ?)",
+                ((r["image"].lower(), image_id_of(r["image"]), r["image"], r["a"], r["b"]) for r in records),
+            )
+
+    def add_prompts(self, prompts):
+        """
+        Insert or update prompts from { name: prompt }.
+        """
+        with self.conn:
+            self.conn.execute("BEGIN IMMEDIATE")
+            self.conn.executemany(
+                "INSERT OR REPLACE INTO prompts (name, prompt) VALUES (?, ?)",
+                ((name.lower(), prompt) for name, prompt in prompts.items()),
+            )
+
+    def annotators(self):
+        """
+        Return { annotator: number of votes }.
+        """
+        return dict(self.conn.execute("SELECT annotator, COUNT(*) FROM annotations GROUP BY annotator"))
+
+    def votes_for(self, image_id):
+        """
+        Return [(annotator, preference, time)] for one image id, oldest first.
+        """
+        return self.conn.execute(
+            "SELECT annotator, preference, time FROM annotations WHERE image_id = ? ORDER BY id", (image_id,)
+        ).fetchall()
+
+    def import_json(self, path, annotator=None):
+        """
+        Append the annotations of an annotations.json file (with its journal).
+        Entries the table would reject (a preference other than A/B/T, or a
+        key that is not a string) are skipped and reported. Returns the
+        number of votes imported.
+        """
+        # Imported here: annotation_core imports this module
+        from annotation_core import PREFERENCES
+
+        annotations = AnnotationJournal(path).load()
+        valid = [(image, preference) for image, preference in annotations.items()
+                 if isinstance(image, str) and preference in PREFERENCES]
+        if len(valid) < len(annotations):
+            print(f"Skipped {len(annotations) - len(valid)} invalid annotations in {path}")
+        self.append_many(valid, annotator=annotator)
+        return len(valid)
+
+    def export_json(self, path, annotator=None):
+        """
+        Write the latest votes in the annotations.json format and return how
+        many were written.
+        """
+        annotations = self.load(annotator)
+        atomic_write_json(path, annotations)
+        return len(annotations)
+
+
+def open_annotation_log(path, annotator=None, compact_every=1000):
+    """
+    Return where a session appends its votes: an AnnotationStore for a SQLite
+    path, otherwise the AnnotationJournal of an annotations.json file.
+    """
+    if is_store_path(path):
+        return AnnotationStore(path, annotator)
+    return AnnotationJournal(path, compact_every=compact_every)
@@ -0,0 +1,312 @@
+"""
+Headless command line for the annotator. Does not import PyQt5.
+
+    python annotator_cli.py pairs FOLDER_A FOLDER_B --range 0 999 --prompts imgName2prompt.json
+    python annotator_cli.py pairs FOLDER_A FOLDER_B --pair-key number --unmatched unmatched.jsonl
+    python annotator_cli.py merge annotators/*.json -o annotations.json --report report.jsonl
+    python annotator_cli.py stats annotations.json
+    python annotator_cli.py check FOLDER_A FOLDER_B --ranges 0-999 -o problems.jsonl
+    python annotator_cli.py dedupe FOLDER_A FOLDER_B --threshold 6 -o similar.jsonl --ties ties.json
+    python annotator_cli.py import annotations.sqlite annotators/*.json
+    python annotator_cli.py export annotations.sqlite -o annotations.json
+    python annotator_cli.py scores --pair model1 model2 annotations.json --pair model2 model3 other.json
+"""
+import sys
+import json
+import argparse
+
+from archive_source import open_image_source
+from annotation_core import (
+    find_pairs,
+    iter_pair_records,
+    read_pair_prompts,
+    read_annotations,
+    normalize_annotations,
+    annotation_stats,
+    save_annotations,
+)
+from image_check import check_pairs
+from annotation_merge import merge_files, annotator_names
+from annotation_store import AnnotationStore, is_store_path
+from pair_index import PairIndex, parse_ranges
+from pairing import PAIR_KEYS, PairingRule, keyed_source, pairing_report, format_pairing_report
+
+
+def open_pairs(args):
+    """
+    Index both sources through their pairing rules and join them. Returns
+    (index_a, index_b, pair names, pairing report); the report summary goes
+    to stderr.
+    """
+    try:
+        rule_a = PairingRule(args.pair_key)
+        rule_b = PairingRule(args.pair_key_b or args.pair_key)
+    except ValueError as e:
+        raise SystemExit(str(e))
+    index_a = keyed_source(open_image_source(args.folder_a, args.recursive, args.scan_workers, verbose=False), rule_a)
+    index_b = keyed_source(open_image_source(args.folder_b, args.recursive, args.scan_workers, verbose=False), rule_b)
+    image_names = find_pairs(index_a, index_b)
+    report = pairing_report(index_a, index_b, image_names)
+    for line in format_pairing_report(report):
+        print(line, file=sys.stderr)
+    return index_a, index_b, image_names, report
+
+
+def cmd_pairs(args):
+    index_a, index_b, image_names, report = open_pairs(args)
+    if args.unmatched:
+        with open(args.unmatched, 'w', encoding='utf-8') as f:
+            for side in ("a", "b"):
+                for name in report[f"unmatched_{side}"]:
+                    f.write(json.dumps({"folder": side.upper(), "image": name, "problem": "unmatched"}) + "\n")
+                for name in report[f"duplicates_{side}"]:
+                    f.write(json.dumps({"folder": side.upper(), "image": name, "problem": "duplicate key"}) + "\n")
+    if args.range or args.ranges:
+        ranges = parse_ranges(args.ranges) if args.ranges else [tuple(args.range)]
+        image_names = list(PairIndex(image_names, index_a).select(ranges))
+    prompts = read_pair_prompts(args.prompts, image_names, index_a) if args.prompts else None
+
+    if args.output and is_store_path(args.output):
+        store = AnnotationStore(args.output)
+        try:
+            store.add_pairs(iter_pair_records(args.folder_a, args.folder_b, image_names, index_a, index_b))
+            if prompts:
+                # The store keys prompts by Folder A filename
+                store.add_prompts({index_a.by_lower[name]: prompt for name, prompt in prompts.items()})
+        finally:
+            store.close()
+        print(f"{len(image_names)} pairs", file=sys.stderr)
+        return 0
+
+    out = open(args.output, 'w', encoding='utf-8') if args.output else sys.stdout
+    try:
+        for record in iter_pair_records(args.folder_a, args.folder_b, image_names, index_a, index_b, prompts):
+            if args.format == "jsonl":
+                out.write(json.dumps(record, ensure_ascii=False) + "\n")
+            else:
+                out.write(f"{record['a']}\t{record['b']}\n")
+    finally:
+        if out is not sys.stdout:
+            out.close()
+    print(f"{len(image_names)} pairs", file=sys.stderr)
+    return 0
+
+
+def cmd_merge(args):
+    summary = merge_files(
+        args.files,
+        args.output,
+        report=args.report,
+        workers=args.workers,
+        shards=args.shards,
+        tie=None if args.tie == "skip" else "T",
+        tmp_dir=args.tmp_dir,
+    )
+    print(
+        f"Merged {summary['records_read']} annotations from {summary['files']} files into {args.output}: "
+        f"{summary['images']} images, {summary['agreed']} agreed, {summary['conflicts']} conflicts, "
+        f"{summary['single']} with a single annotator, {summary['unresolved']} unresolved ties",
+        file=sys.stderr,
+    )
+    return 0
+
+
+def cmd_stats(args):
+    for path in args.files:
+        counts = annotation_stats(normalize_annotations(read_annotations(path)))
+        if args.json:
+            print(json.dumps({"file": path, **counts}))
+        else:
+            print(f"{path}: {counts['total']} annotations, A={counts['A']} B={counts['B']} T={counts['T']}")
+    return 0
+
+
+def cmd_check(args):
+    index_a, index_b, image_names, _ = open_pairs(args)
+    if args.ranges:
+        image_names = list(PairIndex(image_names, index_a).select(parse_ranges(args.ranges)))
+    bad, warnings = check_pairs(index_a, index_b, image_names, args.thumbnail_dir, args.workers)
+
+    out = open(args.output, 'w', encoding='utf-8') if args.output else sys.stdout
+    try:
+        for excluded, records in ((True, bad), (False, warnings)):
+            for record in records:
+                out.write(json.dumps({**record, "excluded": excluded}, ensure_ascii=False) + "\n")
+    finally:
+        if out is not sys.stdout:
+            out.close()
+    print(f"Checked {len(image_names)} pairs: {len(bad)} broken, {len(warnings)} with A and B of different sizes",
+          file=sys.stderr)
+    return 1 if bad else 0
+
+
+def cmd_dedupe(args):
+    # Imported here so the other commands do not need NumPy
+    from image_hash import find_similar_pairs
+
+    index_a, index_b, image_names, _ = open_pairs(args)
+    if args.ranges:
+        image_names = list(PairIndex(image_names, index_a).select(parse_ranges(args.ranges)))
+    similar = find_similar_pairs(index_a, index_b, image_names, args.threshold, args.thumbnail_dir, args.workers)
+
+    out = open(args.output, 'w', encoding='utf-8') if args.output else sys.stdout
+    try:
+        for name, distance, identical, tie in similar:
+            record = {"image": index_a.by_lower[name], "distance": distance, "identical": identical, "tie": tie}
+            out.write(json.dumps(record, ensure_ascii=False) + "\n")
+    finally:
+        if out is not sys.stdout:
+            out.close()
+    if args.ties:
+        # Only the pairs whose colours agree too; see image_hash
+        save_annotations(args.ties, {index_a.by_lower[name]: "T" for name, _, _, tie in similar if tie})
+    identical = sum(1 for _, _, same, _ in similar if same)
+    print(f"{identical} identical and {len(similar) - identical} near-identical pairs among {len(image_names)}",
+          file=sys.stderr)
+    return 0
+
+
+def cmd_import(args):
+    store = AnnotationStore(args.store)
+    try:
+        names = [args.annotator] * len(args.files) if args.annotator else annotator_names(args.files)
+        for path, annotator in zip(args.files, names):
+            count = store.import_json(path, annotator)
+            print(f"Imported {count} annotations from {path} as {annotator}", file=sys.stderr)
+    finally:
+        store.close()
+    return 0
+
+
+def cmd_export(args):
+    store = AnnotationStore(args.store, readonly=True)
+    try:
+        count = store.export_json(args.output, args.annotator)
+    finally:
+        store.close()
+    print(f"Exported {count} annotations to {args.output}", file=sys.stderr)
+    return 0
+
+
+def cmd_scores(args):
+    # Imported here so the other commands do not need NumPy
+    from preference_stats import build_comparisons, summarize, format_summary
+
+    sources = [("A", "B", path) for path in args.files] + [tuple(pair) for pair in args.pair or ()]
+    if not sources:
+        print("No annotation files given.", file=sys.stderr)
+        return 1
+    comparisons = build_comparisons(
+        (model_a, model_b, normalize_annotations(read_annotations(path))) for model_a, model_b, path in sources
+    )
+    results = summarize(comparisons, bootstrap=args.bootstrap, confidence=args.confidence, seed=args.seed)
+    if args.json:
+        print(json.dumps(results, indent=4))
+    else:
+        print(format_summary(results))
+    return 0
+
+
+def build_parser():
+    parser = argparse.ArgumentParser(description="Headless tools for image preference annotations.")
+    subparsers = parser.add_subparsers(dest="command", required=True)
+
+    pairs = subparsers.add_parser("pairs", help="List the image pairs shared by two folders.")
+    pairs.add_argument("folder_a", help="Folder, tar/zip archive or directory of shards.")
+    pairs.add_argument("folder_b", help="Folder, tar/zip archive or directory of shards.")
+    pairs.add_argument("--range", type=int, nargs=2, metavar=("START", "END"),
+                       help="Only pairs whose numeric filename is in [START, END].")
+    pairs.add_argument("--ranges", help='Several ranges, e.g. "0-999,5000-5999".')
+    pairs.add_argument("--prompts", help="Prompt file to join onto the pairs.")
+    pairs.add_argument("--recursive", action="store_true", help="Include images in nested subdirectories.")
+    pairs.add_argument("--scan-workers", type=int, default=1, help="Threads listing subdirectories.")
+    pairs.add_argument("--pair-key", default="name",
+                       help=f"Join key of a file: {', '.join(PAIR_KEYS)} or a regular expression (see pairing.py).")
+    pairs.add_argument("--pair-key-b", default=None, help="Join key rule for Folder B, if different.")
+    pairs.add_argument("--format", choices=("tsv", "jsonl"), default="jsonl")
+    pairs.add_argument("--unmatched", help="JSONL of the files left without a partner or with a duplicate key.")
+    pairs.add_argument("-o", "--output", help="Output file (default: stdout); a .sqlite path fills an annotation store.")
+    pairs.set_defaults(func=cmd_pairs)
+
+    merge = subparsers.add_parser("merge", help="Merge annotators' files by majority vote.")
+    merge.add_argument("files", nargs="+")
+    merge.add_argument("-o", "--output", required=True, help="Consolidated annotations.json.")
+    merge.add_argument("--report", help="JSONL report with vote counts and conflicts per image.")
+    merge.add_argument("--workers", type=int, default=None, help="Worker processes (default: all cores).")
+    merge.add_argument("--shards", type=int, default=None, help="Number of key shards (default: by input size).")
+    merge.add_argument("--tie", choices=("T", "skip"), default="T",
+                       help="Result when the top votes are tied: T (no preference) or leave the image out.")
+    merge.add_argument("--tmp-dir", default=None, help="Directory for shard files.")
+    merge.set_defaults(func=cmd_merge)
+
+    stats = subparsers.add_parser("stats", help="Count A/B/T preferences per annotation file.")
+    stats.add_argument("files", nargs="+")
+    stats.add_argument("--json", action="store_true", help="One JSON object per file.")
+    stats.set_defaults(func=cmd_stats)
+
+    check = subparsers.add_parser("check", help="Find pairs with missing, empty, unreadable or truncated images.")
+    check.add_argument("folder_a", help="Folder, tar/zip archive or directory of shards.")
+    check.add_argument("folder_b", help="Folder, tar/zip archive or directory of shards.")
+    check.add_argument("--ranges", help='Only pairs in these id ranges, e.g. "0-999,5000-5999".')
+    check.add_argument("--recursive", action="store_true", help="Include images in nested subdirectories.")
+    check.add_argument("--scan-workers", type=int, default=1, help="Threads listing subdirectories.")
+    check.add_argument("--pair-key", default="name",
+                       help=f"Join key of a file: {', '.join(PAIR_KEYS)} or a regular expression (see pairing.py).")
+    check.add_argument("--pair-key-b", default=None, help="Join key rule for Folder B, if different.")
+    check.add_argument("--workers", type=int, default=None, help="Checking processes (default: all cores).")
+    check.add_argument("--thumbnail-dir", default=None,
+                       help="Where the check cache lives (default: the .thumbnails folder of each image folder).")
+    check.add_argument("-o", "--output", help="JSONL of the pairs with problems (default: stdout).")
+    check.set_defaults(func=cmd_check)
+
+    dedupe = subparsers.add_parser("dedupe", help="Find pairs whose two images are identical or nearly so.")
+    dedupe.add_argument("folder_a", help="Folder, tar/zip archive or directory of shards.")
+    dedupe.add_argument("folder_b", help="Folder, tar/zip archive or directory of shards.")
+    dedupe.add_argument("--ranges", help='Only pairs in these id ranges, e.g. "0-999,5000-5999".')
+    dedupe.add_argument("--threshold", type=int, default=6,
+                        help="Largest pHash/dHash distance (of 64 bits) counted as near-identical.")
+    dedupe.add_argument("--recursive", action="store_true", help="Include images in nested subdirectories.")
+    dedupe.add_argument("--scan-workers", type=int, default=1, help="Threads listing subdirectories.")
+    dedupe.add_argument("--pair-key", default="name",
+                        help=f"Join key of a file: {', '.join(PAIR_KEYS)} or a regular expression (see pairing.py).")
+    dedupe.add_argument("--pair-key-b", default=None, help="Join key rule for Folder B, if different.")
+    dedupe.add_argument("--workers", type=int, default=None, help="Hashing processes (default: all cores).")
+    dedupe.add_argument("--thumbnail-dir", default=None,
+                        help="Where the hash cache lives (default: the .thumbnails folder of each image folder).")
+    dedupe.add_argument("-o", "--output", help="JSONL of the similar pairs (default: stdout).")
+    dedupe.add_argument("--ties", help="Also write the pairs whose colours agree too as no-preference annotations "
+                             "to this JSON file.")
+    dedupe.set_defaults(func=cmd_dedupe)
+
+    import_ = subparsers.add_parser("import", help="Add annotations.json files to a SQLite annotation store.")
+    import_.add_argument("store", help="Store to create or extend (.sqlite, .sqlite3 or .db).")
+    import_.add_argument("files", nargs="+")
+    import_.add_argument("--annotator", help="Annotator of all files (default: each file's name).")
+    import_.set_defaults(func=cmd_import)
+
+    export = subparsers.add_parser("export", help="Write a SQLite store's latest votes as annotations.json.")
+    export.add_argument("store")
+    export.add_argument("-o", "--output", required=True)
+    export.add_argument("--annotator", help="Only this annotator's votes (default: the latest vote per image).")
+    export.set_defaults(func=cmd_export)
+
+    scores = subparsers.add_parser("scores", help="Win rates and Bradley-Terry/Elo ratings per model.")
+    scores.add_argument("files", nargs="*", help="Annotation files comparing model A (Folder A) with model B.")
+    scores.add_argument("--pair", nargs=3, action="append", metavar=("MODEL_A", "MODEL_B", "FILE"),
+                        help="Annotation file comparing MODEL_A (Folder A) with MODEL_B; repeatable.")
+    scores.add_argument("--bootstrap", type=int, default=1000, help="Bootstrap resamples (0 to skip).")
+    scores.add_argument("--confidence", type=float, default=0.95, help="Confidence level of the intervals.")
+    scores.add_argument("--seed", type=int, default=0)
+    scores.add_argument("--json", action="store_true", help="Print the results as JSON.")
+    scores.set_defaults(func=cmd_scores)
+
+    return parser
+
+
+def main(argv=None):
+    args = build_parser().parse_args(argv)
+    return args.func(args)
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,415 @@
+"""
+Image pairs read straight from tar/zip archives and WebDataset shards.
+
+An ArchiveIndex stands in for a FolderIndex: its location is one archive or
+a directory of shards, and its images are the archive members. Each archive
+is indexed once into a member-offset table (cached next to it as
+<archive>.index.json and rebuilt when the archive changes), and members are
+read by slicing a shared mmap of the archive, so nothing is extracted and no
+file is opened per image.
+
+Members are addressed by virtual paths "<archive path>/<member name>", which
+read_member(), stat() and split_member() understand, so prefetching, the
+image cache and the thumbnail store work on them like on plain files.
+"""
+import os
+import json
+import mmap
+import time
+import zlib
+import struct
+import tarfile
+import zipfile
+import threading
+
+from folder_index import FolderIndex, IMAGE_EXTENSIONS, add_id, remove_id, shared_ids_message
+
+
+ARCHIVE_EXTENSIONS = (".tar", ".zip")
+
+# Version of the cached member tables; older tables are rebuilt
+TABLE_VERSION = 2
+
+# Zip local file header: signature ... file name length, extra field length
+_ZIP_LOCAL_HEADER = struct.Struct("<4sHHHHHIIIHH")
+
+# { archive path: ArchiveReader } of every archive opened in this process
+_readers = {}
+_readers_lock = threading.Lock()
+
+
+def is_archive(path):
+    return path.lower().endswith(ARCHIVE_EXTENSIONS) and os.path.isfile(path)
+
+
+def list_shards(folder):
+    """
+    Return the archives in folder, sorted, if folder holds archives but no
+    images (a WebDataset-style shard directory); otherwise an empty list.
+    """
+    shards = []
+    with os.scandir(folder) as entries:
+        for entry in entries:
+            name = entry.name.lower()
+            if name.endswith(IMAGE_EXTENSIONS):
+                return []
+            if name.endswith(ARCHIVE_EXTENSIONS) and entry.is_file():
+                shards.append(entry.path)
+    return sorted(shards)
+
+
+def index_path_for(archive_path):
+    return archive_path + ".index.json"
+
+
+def normalize_members(members):
+    """
+    Strip what the archiver added in front of the member names: a leading
+    "./" or "/" (tar cf x.tar -C dir .) and a top-level directory shared by
+    every member (tar cf x.tar dir, zip -r x.zip dir), so archives made
+    either way pair up with a folder of the same images. Deeper directories
+    are kept, like relative paths of a recursive folder scan.
+    """
+    members = {name.lstrip("/").removeprefix("./").lstrip("/"): entry for name, entry in members.items()}
+    while members and all("/" in name for name in members):
+        top = {name.split("/", 1)[0] for name in members}
+        if len(top) != 1:
+            break
+        members = {name.split("/", 1)[1]: entry for name, entry in members.items()}
+    return members
+
+
+class MemberStat:
+    """
+    The st_size/st_mtime_ns pair of os.stat() for an archive member; the
+    mtime is the archive's.
+    """
+
+    def __init__(self, st_size, st_mtime_ns):
+        self.st_size = st_size
+        self.st_mtime_ns = st_mtime_ns
+
+
+class ArchiveReader:
+    """
+    Member-offset table and mmap of one uncompressed tar or zip archive.
+    """
+
+    def __init__(self, path):
+        self.path = path
+        st = os.stat(path)
+        self.size = st.st_size
+        self.mtime_ns = st.st_mtime_ns
+        self.is_zip = path.lower().endswith(".zip")
+        # { member name: (offset, size, method) }; for zip the offset is the
+        # local header and the method the zip compression method
+        self.members = self._load_table()
+
+        self.mmap = None
+        if self.size:
+            with open(path, "rb") as f:
+                self.mmap = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+
+    def _load_table(self):
+        index_path = index_path_for(self.path)
+        try:
+            with open(index_path, "r", encoding="utf-8") as f:
+                table = json.load(f)
+            if (table.get("version") == TABLE_VERSION and table["size"] == self.size
+                    and table["mtime_ns"] == self.mtime_ns):
+                return {name: tuple(entry) for name, entry in table["members"].items()}
+        except (OSError, ValueError, KeyError):
+            pass
+
+        members = normalize_members(self._scan_zip() if self.is_zip else self._scan_tar())
+
+        # Cache the table next to the archive; a read-only dataset just rescans next time
+        tmp_path = f"{index_path}.{os.getpid()}.tmp"
+        try:
+            with open(tmp_path, "w", encoding="utf-8") as f:
+                json.dump({"version": TABLE_VERSION, "size": self.size, "mtime_ns": self.mtime_ns,
+                           "members": members}, f)
+            os.replace(tmp_path, index_path)
+        except OSError:
+            try:
+                os.remove(tmp_path)
+            except OSError:
+                pass
+        return {name: tuple(entry) for name, entry in members.items()}
+
+    def _scan_tar(self):
+        members = {}
+        try:
+            archive = tarfile.open(self.path, "r:")
+        except tarfile.ReadError:
+            raise ValueError(f"{self.path} is not an uncompressed tar archive; compressed shards cannot be read in place.")
+        with archive:
+            while True:
+                info = archive.next()
+                if info is None:
+                    break
+                if info.isfile() and info.name.lower().endswith(IMAGE_EXTENSIONS):
+                    members[info.name] = [info.offset_data, info.size, 0]
+                # Do not keep millions of TarInfo objects around
+                archive.members = []
+        return members
+
+    def _scan_zip(self):
+        members = {}
+        with zipfile.ZipFile(self.path) as archive:
+            for info in archive.infolist():
+                if info.is_dir() or not info.filename.lower().endswith(IMAGE_EXTENSIONS):
+                    continue
+                if info.compress_type not in (zipfile.ZIP_STORED, zipfile.ZIP_DEFLATED):
+                    print(f"Skipping {info.filename} in {self.path}: unsupported compression")
+                    continue
+                members[info.filename] = [info.header_offset, info.compress_size, info.compress_type]
+        return members
+
+    def read(self, name):
+        """
+        Return the bytes of member name. Safe to call from several threads.
+        """
+        offset, size, method = self.members[name]
+        if not self.is_zip:
+            return self.mmap[offset:offset + size]
+        header = _ZIP_LOCAL_HEADER.unpack_from(self.mmap, offset)
+        start = offset + _ZIP_LOCAL_HEADER.size + header[9] + header[10]
+        data = self.mmap[start:start + size]
+        if method == zipfile.ZIP_DEFLATED:
+            return zlib.decompress(data, -15)
+        return data
+
+    def member_size(self, name):
+        return self.members[name][1]
+
+    def close(self):
+        if self.mmap is not None:
+            self.mmap.close()
+            self.mmap = None
+
+
+def open_archive(path):
+    """
+    Return the shared ArchiveReader of path, reopening it if the archive changed.
+    """
+    path = os.path.abspath(path)
+    with _readers_lock:
+        reader = _readers.get(path)
+        if reader is not None:
+            st = os.stat(path)
+            if (st.st_size, st.st_mtime_ns) == (reader.size, reader.mtime_ns):
+                return reader
+            # Rewritten since it was opened. The old mapping is not closed here,
+            # since worker threads may still be reading from it; it is released
+            # with the last reference to the old reader.
+        reader = ArchiveReader(path)
+        _readers[path] = reader
+        return reader
+
+
+def split_member(path):
+    """
+    Return (archive path, member name) if path points inside an opened
+    archive, otherwise None.
+    """
+    if not _readers:
+        return None
+    parent = path
+    while True:
+        child, parent = parent, os.path.dirname(parent)
+        if parent == child:
+            return None
+        if parent in _readers:
+            return parent, path[len(parent) + 1:].replace(os.sep, "/")
+
+
+def read_member(path):
+    archive_path, name = split_member(path)
+    return _readers[archive_path].read(name)
+
+
+def stat(path):
+    """
+    os.stat() that also understands archive member paths.
+    """
+    member = split_member(path)
+    if member is None:
+        return os.stat(path)
+    archive_path, name = member
+    reader = _readers[archive_path]
+    try:
+        return MemberStat(reader.member_size(name), reader.mtime_ns)
+    except KeyError:
+        raise FileNotFoundError(path)
+
+
+class ArchiveIndex:
+    """
+    FolderIndex counterpart for an archive or a directory of shards. Names are
+    the member names, and path_of() turns one into the member's virtual path.
+    update() re-indexes shards whose size or mtime changed and picks up new ones.
+    """
+
+    def __init__(self, location, verbose=True):
+        self.folder = location
+        self.verbose = verbose
+        self.by_lower = {}
+        self.by_id = {}
+        # Ids shared by several members, e.g. in two shards (see folder_index.add_id)
+        self.shared_ids = {}
+        # { member name: archive path }
+        self.archive_of = {}
+        # { archive path: (size, mtime_ns) }
+        self.shards = {}
+        self.scan_seconds = 0.0
+        self.pending_added = []
+        self.refresh()
+
+    def _list_shards(self):
+        if os.path.isdir(self.folder):
+            return [os.path.abspath(path) for path in list_shards(self.folder)]
+        return [os.path.abspath(self.folder)]
+
+    def refresh(self):
+        started = time.perf_counter()
+        self.by_lower = {}
+        self.by_id = {}
+        self.shared_ids = {}
+        self.archive_of = {}
+        self.shards = {}
+        self.pending_added = []
+        for shard in self._list_shards():
+            self._add_shard(shard)
+        self.scan_seconds = time.perf_counter() - started
+        if self.verbose:
+            print(f"Indexed {len(self.by_lower)} images in {len(self.shards)} archives at {self.folder} "
+                  f"({self.scan_seconds:.3f}s)")
+            if self.shared_ids:
+                print(shared_ids_message(self.shared_ids))
+        return self.scan_seconds
+
+    def update(self):
+        added, removed = [], []
+        current = set(self._list_shards())
+        for shard in list(self.shards):
+            if shard not in current:
+                removed.extend(self._drop_shard(shard))
+        for shard in sorted(current):
+            try:
+                st = os.stat(shard)
+            except OSError:
+                continue
+            if self.shards.get(shard) == (st.st_size, st.st_mtime_ns):
+                continue
+            old = set(self._drop_shard(shard))
+            new = set(self._add_shard(shard))
+            added.extend(new - old)
+            removed.extend(old - new)
+        self.pending_added.extend(added)
+        if self.verbose and (added or removed):
+            print(f"Updated index of {self.folder}: {len(added)} added, {len(removed)} removed")
+        return added, removed
+
+    def state(self):
+        """
+        Fingerprint of the archives (size and mtime of every shard); the
+        member tables themselves are cached next to each archive.
+        """
+        return {"folder": self.folder, "shards": self.shards}
+
+    @classmethod
+    def from_state(cls, state, verbose=True):
+        """
+        Reopen the archives of state(). Returns None if a shard was added,
+        removed or rewritten since.
+        """
+        index = cls(state["folder"], verbose=verbose)
+        if {shard: list(signature) for shard, signature in index.shards.items()} != state["shards"]:
+            return None
+        return index
+
+    def take_added(self):
+        added, self.pending_added = self.pending_added, []
+        return added
+
+    def is_stale(self):
+        for shard, signature in self.shards.items():
+            try:
+                st = os.stat(shard)
+            except OSError:
+                return True
+            if (st.st_size, st.st_mtime_ns) != signature:
+                return True
+        return False
+
+    def ensure_fresh(self, force=False):
+        # Archives are not rewritten while annotating; update() runs on request
+        return False
+
+    def actual_name(self, lowercase_filename):
+        return self.by_lower.get(lowercase_filename)
+
+    def name_for_id(self, image_id):
+        return self.by_id.get(image_id)
+
+    def key_of(self, name):
+        """
+        Key of a filename (e.g. an annotation key) in by_lower.
+        """
+        return name.lower()
+
+    def lower_names(self):
+        return set(self.by_lower)
+
+    def path_of(self, actual_name):
+        # Unknown names get a path that fails to load, like a missing file
+        return f"{self.archive_of.get(actual_name, os.path.abspath(self.folder))}/{actual_name}"
+
+    def directories(self):
+        """
+        Directories to watch for new or rewritten shards.
+        """
+        if os.path.isdir(self.folder):
+            return [os.path.abspath(self.folder)]
+        return [os.path.dirname(os.path.abspath(self.folder))]
+
+    def __len__(self):
+        return len(self.by_lower)
+
+    def __contains__(self, lowercase_filename):
+        return lowercase_filename in self.by_lower
+
+    def _add_shard(self, shard):
+        reader = open_archive(shard)
+        self.shards[shard] = (reader.size, reader.mtime_ns)
+        names = []
+        for name in reader.members:
+            self.by_lower[name.lower()] = name
+            self.archive_of[name] = shard
+            add_id(self.by_id, self.shared_ids, name)
+            names.append(name.lower())
+        return names
+
+    def _drop_shard(self, shard):
+        if self.shards.pop(shard, None) is None:
+            return []
+        names = []
+        for name, archive in list(self.archive_of.items()):
+            if archive != shard:
+                continue
+            del self.archive_of[name]
+            self.by_lower.pop(name.lower(), None)
+            remove_id(self.by_id, self.shared_ids, name)
+            names.append(name.lower())
+        return names
+
+
+def open_image_source(location, recursive=False, workers=1, verbose=True):
+    """
+    Return an index of the images at location: an ArchiveIndex for an archive
+    or a directory of shards, otherwise a FolderIndex.
+    """
+    if is_archive(location) or (os.path.isdir(location) and list_shards(location)):
+        return ArchiveIndex(location, verbose=verbose)
+    return FolderIndex(location, verbose=verbose, recursive=recursive, workers=workers)
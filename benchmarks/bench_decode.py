@@ -0,0 +1,164 @@
+"""
+Decode benchmark: full decode + scale vs reduced-resolution decode.
+
+Generates synthetic A/B image pairs (or uses existing folders) and reports
+decode time and peak RSS per pair for each mode. Every mode runs in its own
+process so peak RSS is not shared between them.
+
+    python benchmarks/bench_decode.py --pairs 20 --width 3840 --height 2160
+    python benchmarks/bench_decode.py --folder-a path/to/A --folder-b path/to/B
+"""
+import os
+import sys
+import json
+import time
+import argparse
+import resource
+import tempfile
+import subprocess
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from folder_index import IMAGE_EXTENSIONS  # noqa: E402
+
+
+MODES = ("full", "reduced")
+
+
+def make_pairs(folder, pairs, width, height, fmt):
+    from PIL import Image
+
+    paths = []
+    for sub in ("A", "B"):
+        os.makedirs(os.path.join(folder, sub), exist_ok=True)
+    for i in range(pairs):
+        # Noise keeps the encoder from producing unrealistically small files
+        im = Image.effect_noise((width, height), 64).convert("RGB")
+        pair = []
+        for sub in ("A", "B"):
+            path = os.path.join(folder, sub, f"{i}.{fmt}")
+            im.save(path)
+            pair.append(path)
+        paths.append(tuple(pair))
+    return paths
+
+
+def list_pairs(folder_a, folder_b):
+    b_names = {f.lower(): f for f in os.listdir(folder_b)}
+    paths = []
+    for f in sorted(os.listdir(folder_a)):
+        if f.lower().endswith(IMAGE_EXTENSIONS) and f.lower() in b_names:
+            paths.append((os.path.join(folder_a, f), os.path.join(folder_b, b_names[f.lower()])))
+    return paths
+
+
+def max_rss_mb():
+    # VmHWM is per address space; ru_maxrss on Linux also keeps the parent's
+    # peak across fork/exec, which would hide the difference between modes
+    try:
+        with open("/proc/self/status", "r") as f:
+            for line in f:
+                if line.startswith("VmHWM:"):
+                    return int(line.split()[1]) / 1024
+    except OSError:
+        pass
+    # ru_maxrss is in KB on Linux and bytes on macOS
+    rss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    return rss / (1024 * 1024) if sys.platform == "darwin" else rss / 1024
+
+
+def run_mode(mode, paths, width, height):
+    from PyQt5.QtGui import QGuiApplication, QImage
+    from PyQt5.QtCore import Qt
+    from prefetch import read_scaled
+
+    app = QGuiApplication([sys.argv[0], "-platform", "offscreen"])  # noqa: F841
+    rss_before = max_rss_mb()
+
+    timings = []
+    for a_path, b_path in paths:
+        started = time.perf_counter()
+        for path in (a_path, b_path):
+            if mode == "full":
+                # Previous behaviour: decode every pixel, then scale for display
+                image = QImage(path).scaled(width, height, Qt.KeepAspectRatio)
+            else:
+                image = read_scaled(path, width, height)
+            if image.isNull():
+                raise RuntimeError(f"Failed to load image: {path}")
+        timings.append(time.perf_counter() - started)
+
+    timings.sort()
+    return {
+        "mode": mode,
+        "pairs": len(paths),
+        "mean_ms": 1000 * sum(timings) / len(timings),
+        "p50_ms": 1000 * timings[len(timings) // 2],
+        "max_ms": 1000 * timings[-1],
+        "peak_rss_mb": max_rss_mb(),
+        "rss_growth_mb": max_rss_mb() - rss_before,
+    }
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--folder-a", help="Existing Folder A (default: generate synthetic pairs).")
+    parser.add_argument("--folder-b", help="Existing Folder B.")
+    parser.add_argument("--pairs", type=int, default=20, help="Number of synthetic pairs.")
+    parser.add_argument("--width", type=int, default=3840, help="Synthetic image width.")
+    parser.add_argument("--height", type=int, default=2160, help="Synthetic image height.")
+    parser.add_argument("--format", default="jpg", help="Synthetic image format (jpg, png, webp...).")
+    parser.add_argument("--display", type=int, nargs=2, default=(400, 400), metavar=("WIDTH", "HEIGHT"),
+                        help="Target display size.")
+    parser.add_argument("--json", help="Also write the results to this JSON file.")
+    parser.add_argument("--run-mode", choices=MODES, help=argparse.SUPPRESS)
+    parser.add_argument("--paths-file", help=argparse.SUPPRESS)
+    args = parser.parse_args(argv)
+
+    width, height = args.display
+
+    # Child process: run one mode and print its result
+    if args.run_mode:
+        with open(args.paths_file, "r", encoding="utf-8") as f:
+            paths = json.load(f)
+        print(json.dumps(run_mode(args.run_mode, paths, width, height)))
+        return 0
+
+    with tempfile.TemporaryDirectory() as tmp:
+        if args.folder_a and args.folder_b:
+            paths = list_pairs(args.folder_a, args.folder_b)
+        else:
+            print(f"Generating {args.pairs} pairs of {args.width}x{args.height} {args.format} images...")
+            paths = make_pairs(tmp, args.pairs, args.width, args.height, args.format)
+        if not paths:
+            print("No image pairs found.")
+            return 1
+
+        paths_file = os.path.join(tmp, "paths.json")
+        with open(paths_file, "w", encoding="utf-8") as f:
+            json.dump(paths, f)
+
+        results = []
+        for mode in MODES:
+            output = subprocess.run(
+                [sys.executable, os.path.abspath(__file__), "--run-mode", mode, "--paths-file", paths_file,
+                 "--display", str(width), str(height)],
+                check=True,
+                capture_output=True,
+                text=True,
+            ).stdout
+            results.append(json.loads(output.strip().splitlines()[-1]))
+
+    print(f"{'mode':<8} {'pairs':>6} {'mean ms':>9} {'p50 ms':>9} {'max ms':>9} {'peak RSS MB':>12}")
+    for r in results:
+        print(f"{r['mode']:<8} {r['pairs']:>6} {r['mean_ms']:>9.1f} {r['p50_ms']:>9.1f} {r['max_ms']:>9.1f} "
+              f"{r['peak_rss_mb']:>12.1f}")
+
+    if args.json:
+        with open(args.json, "w", encoding="utf-8") as f:
+            json.dump(results, f, indent=4)
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
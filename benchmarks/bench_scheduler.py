@@ -0,0 +1,124 @@
+"""
+Scheduler simulation: how many votes each pair schedule needs before the
+Folder A win rate is known to within --target (half-width of the 95%
+confidence interval), on a synthetic population of prompt strata with
+different true win rates. No images are involved.
+
+Pairs are numbered stratum by stratum, as datasets generated prompt by prompt
+usually are, so sequential order sees one stratum at a time. Reports the
+median number of votes over --runs populations and how often the interval at
+that point contains the true win rate.
+
+    python benchmarks/bench_scheduler.py --pairs 20000 --strata 32 --target 0.02
+"""
+import os
+import sys
+import json
+import random
+import argparse
+import statistics
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from pair_scheduler import StratifiedScheduler, make_scheduler  # noqa: E402
+
+
+SCHEDULES = ("sequential", "random", "stratified", "uncertainty")
+
+
+def make_population(pairs, strata, tie_rate, rng):
+    """
+    Return (names, { name: stratum }, { name: vote }) with stratum sizes and
+    win rates drawn at random; some strata are one-sided, some contested.
+    """
+    weights = [rng.paretovariate(1.5) for _ in range(strata)]
+    total = sum(weights)
+    names, stratum_of, votes = [], {}, {}
+    for h in range(strata):
+        size = max(1, round(pairs * weights[h] / total))
+        p_win = rng.choice((0.05, 0.2, 0.5, 0.8, 0.95)) if h % 2 else rng.uniform(0.3, 0.7)
+        for _ in range(size):
+            name = f"{len(names)}.png"
+            names.append(name)
+            stratum_of[name] = h
+            u = rng.random()
+            votes[name] = "T" if u < tie_rate else ("A" if u < tie_rate + (1 - tie_rate) * p_win else "B")
+    return names, stratum_of, votes
+
+
+def truth(votes):
+    return sum({"A": 1.0, "B": 0.0, "T": 0.5}[v] for v in votes.values()) / len(votes)
+
+
+def votes_needed(schedule, names, stratum_of, votes, target, seed):
+    """
+    Return (votes until the half-width is below target, estimate, half-width).
+    """
+    if schedule in ("sequential", "random"):
+        # One stratum: the plain sample mean with its interval
+        estimator = StratifiedScheduler(names, lambda name: 0, seed=seed)
+        order = list(names)
+        if schedule == "random":
+            random.Random(seed).shuffle(order)
+        for n, name in enumerate(order, 1):
+            estimator.record(name, votes[name])
+            mean, half_width = estimator.estimate()
+            if half_width <= target:
+                return n, mean, half_width
+        return len(names), mean, half_width
+
+    scheduler = make_scheduler(schedule, names, stratum_of.get, seed=seed)
+    n = 0
+    while True:
+        name = scheduler.pick()
+        if name is None:
+            break
+        n += 1
+        scheduler.record(name, votes[name])
+        mean, half_width = scheduler.estimate()
+        if half_width <= target:
+            break
+    return n, mean, half_width
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--pairs", type=int, default=20000)
+    parser.add_argument("--strata", type=int, default=32, help="Prompt clusters in the population.")
+    parser.add_argument("--ties", type=float, default=0.1, help="Share of ties.")
+    parser.add_argument("--target", type=float, default=0.02, help="Target half-width of the 95%% interval.")
+    parser.add_argument("--runs", type=int, default=20, help="Populations to simulate.")
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--json", help="Also write the results to this JSON file.")
+    args = parser.parse_args(argv)
+
+    results = {schedule: {"votes": [], "covered": 0, "errors": []} for schedule in SCHEDULES}
+    for run in range(args.runs):
+        rng = random.Random(args.seed * 1000 + run)
+        names, stratum_of, votes = make_population(args.pairs, args.strata, args.ties, rng)
+        true_rate = truth(votes)
+        for schedule in SCHEDULES:
+            n, mean, half_width = votes_needed(schedule, names, stratum_of, votes, args.target, run)
+            results[schedule]["votes"].append(n / len(names))
+            results[schedule]["covered"] += abs(mean - true_rate) <= half_width
+            results[schedule]["errors"].append(abs(mean - true_rate))
+
+    summary = {}
+    print(f"{'schedule':<12} {'votes':>8} {'of pairs':>9} {'coverage':>9} {'mean |error|':>13}")
+    for schedule, r in results.items():
+        share = statistics.median(r["votes"])
+        summary[schedule] = {
+            "median_share_of_pairs": share,
+            "coverage": r["covered"] / args.runs,
+            "mean_abs_error": statistics.mean(r["errors"]),
+        }
+        print(f"{schedule:<12} {share * args.pairs:>8.0f} {share:>9.1%} {r['covered'] / args.runs:>9.0%} "
+              f"{statistics.mean(r['errors']):>13.4f}")
+    if args.json:
+        with open(args.json, "w", encoding="utf-8") as f:
+            json.dump(summary, f, indent=4)
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
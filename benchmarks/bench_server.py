@@ -0,0 +1,180 @@
+"""
+Server load test: many simulated annotators against annotation_server.py on
+localhost.
+
+Starts the server in a subprocess on a synthetic dataset (see
+bench_session.py), then runs --annotators concurrent clients on one asyncio
+loop. Each leases a few pairs, downloads both images and votes, over a
+kept-alive connection, until --seconds have passed or nothing is left.
+Reports votes per second and request latency percentiles.
+
+    python benchmarks/bench_server.py --pairs 10000 --annotators 300 --seconds 20
+"""
+import os
+import sys
+import json
+import time
+import random
+import asyncio
+import argparse
+import tempfile
+import subprocess
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+
+from bench_session import make_dataset  # noqa: E402
+from latency import LatencyRecorder  # noqa: E402
+
+
+class Connection:
+    """
+    Minimal kept-alive HTTP/1.1 client on asyncio streams.
+    """
+
+    def __init__(self, host, port):
+        self.host = host
+        self.port = port
+        self.reader = None
+        self.writer = None
+
+    async def request(self, method, path, data=None):
+        if self.writer is None:
+            self.reader, self.writer = await asyncio.open_connection(self.host, self.port)
+        body = json.dumps(data).encode("utf-8") if data is not None else b""
+        self.writer.write(
+            f"{method} {path} HTTP/1.1\r\nHost: {self.host}\r\nContent-Length: {len(body)}\r\n\r\n".encode("latin-1")
+            + body
+        )
+        await self.writer.drain()
+        status = int((await self.reader.readline()).split()[1])
+        length = 0
+        while True:
+            line = await self.reader.readline()
+            if line in (b"\r\n", b""):
+                break
+            key, _, value = line.decode("latin-1").partition(":")
+            if key.strip().lower() == "content-length":
+                length = int(value)
+        payload = await self.reader.readexactly(length)
+        return status, payload
+
+    def close(self):
+        if self.writer is not None:
+            self.writer.close()
+
+
+async def annotator(name, host, port, deadline, latency, counts, think_seconds):
+    conn = Connection(host, port)
+    rng = random.Random(name)
+    try:
+        while time.monotonic() < deadline:
+            with latency.time("lease"):
+                status, payload = await conn.request("POST", "/api/lease", {"annotator": name, "count": 4})
+            leases = json.loads(payload)["leases"]
+            if not leases:
+                break
+            for lease in leases:
+                for side in ("a", "b"):
+                    with latency.time("image"):
+                        status, _ = await conn.request("GET", lease[side])
+                    counts["images"] += 1
+                    counts["errors"] += status != 200
+                if think_seconds:
+                    await asyncio.sleep(rng.uniform(0, 2 * think_seconds))
+                with latency.time("vote"):
+                    status, _ = await conn.request("POST", "/api/vote",
+                                                   {"lease": lease["lease"], "preference": rng.choice("ABT")})
+                counts["votes"] += status == 200
+                counts["errors"] += status != 200
+                if time.monotonic() >= deadline:
+                    break
+    finally:
+        conn.close()
+
+
+async def run_load(host, port, annotators, seconds, think_seconds):
+    latency = LatencyRecorder()
+    counts = {"votes": 0, "images": 0, "errors": 0}
+    started = time.monotonic()
+    deadline = started + seconds
+    await asyncio.gather(*(
+        annotator(f"annotator{i}", host, port, deadline, latency, counts, think_seconds)
+        for i in range(annotators)
+    ))
+    elapsed = time.monotonic() - started
+    return {
+        "annotators": annotators,
+        "seconds": elapsed,
+        "votes": counts["votes"],
+        "images": counts["images"],
+        "errors": counts["errors"],
+        "votes_per_second": counts["votes"] / elapsed,
+        "latency": latency.summary(),
+    }
+
+
+def wait_for_port(process):
+    """
+    Return the port the server reports once it is listening.
+    """
+    for line in process.stdout:
+        if line.startswith("Listening on "):
+            return int(line.rstrip().rstrip("/").rsplit(":", 1)[1])
+    raise RuntimeError("Server exited during startup.")
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--pairs", type=int, default=10000, help="Synthetic pairs.")
+    parser.add_argument("--width", type=int, default=1024, help="Synthetic image width.")
+    parser.add_argument("--height", type=int, default=1024, help="Synthetic image height.")
+    parser.add_argument("--annotators", type=int, default=200, help="Concurrent simulated annotators.")
+    parser.add_argument("--seconds", type=float, default=15, help="Test duration.")
+    parser.add_argument("--think", type=float, default=0.0,
+                        help="Mean seconds each annotator looks at a pair before voting.")
+    parser.add_argument("--port", type=int, default=0, help="Server port (default: any free port).")
+    parser.add_argument("--server-workers", type=int, default=4, help="Image scaling threads in the server.")
+    parser.add_argument("--data-dir", default=os.path.join(tempfile.gettempdir(), "annotator_bench"),
+                        help="Where synthetic datasets are generated and cached.")
+    parser.add_argument("--thumbnail-dir", default=None,
+                        help="Thumbnail store for the server, e.g. one pre-built with thumbnail_store.py "
+                             "(default: an empty temporary one).")
+    parser.add_argument("--json", help="Also write the results to this JSON file.")
+    args = parser.parse_args(argv)
+
+    params = {"pairs": args.pairs, "width": args.width, "height": args.height, "format": "jpg",
+              "casing": "mixed", "annotated": 0.0, "seed": 0}
+    root = os.path.join(args.data_dir, f"server_{args.pairs}_{args.width}x{args.height}")
+    make_dataset(root, params)
+
+    host = "127.0.0.1"
+    with tempfile.TemporaryDirectory() as tmp:
+        server = subprocess.Popen(
+            [sys.executable, os.path.join(ROOT, "annotation_server.py"), os.path.join(root, "A"),
+             os.path.join(root, "B"), "-o", os.path.join(tmp, "annotations.json"), "--port", str(args.port),
+             "--workers", str(args.server_workers), "--thumbnail-dir", args.thumbnail_dir or os.path.join(tmp, "thumbs"),
+             "--prompts", os.path.join(root, "prompts.json")],
+            stdout=subprocess.PIPE,
+            text=True,
+        )
+        try:
+            port = wait_for_port(server)
+            result = asyncio.run(run_load(host, port, args.annotators, args.seconds, args.think))
+        finally:
+            server.terminate()
+            server.wait()
+
+    print(f"{result['annotators']} annotators, {result['seconds']:.1f}s: {result['votes']} votes "
+          f"({result['votes_per_second']:.0f}/s), {result['images']} images, {result['errors']} errors")
+    print(f"{'request':<8} {'n':>8} {'p50 ms':>8} {'p95 ms':>8} {'p99 ms':>8}")
+    for name, s in result["latency"].items():
+        print(f"{name:<8} {s['count']:>8} {s['p50_ms']:>8.1f} {s['p95_ms']:>8.1f} {s['p99_ms']:>8.1f}")
+    if args.json:
+        with open(args.json, "w", encoding="utf-8") as f:
+            json.dump(result, f, indent=4)
+    return 1 if result["errors"] else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
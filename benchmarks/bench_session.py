@@ -0,0 +1,336 @@
+"""
+Session benchmark: drives the annotator headlessly over synthetic datasets.
+
+Generates Folder A/B pairs (hard links to a few encoded images, so a million
+pairs fit on disk), a matching prompt JSON and a partial annotations file,
+then runs check_folders_selected, filter_images_by_range, load_prompts,
+load_annotations, show_image_pair, save_annotations, save_session and
+resume_session (in a second window) on the offscreen Qt platform. Each
+scale runs in its own process and reports wall time, throughput and peak
+RSS per step. Datasets are cached in --data-dir and reused when the
+parameters match.
+
+Timings depend on the machine, so no baseline is shipped: record one with
+--update-baseline before a change, then compare against it afterwards.
+
+    python benchmarks/bench_session.py --scales 1k,100k --output results.json
+    python benchmarks/bench_session.py --scales 1k --baseline baseline.json --update-baseline
+    python benchmarks/bench_session.py --scales 1k --baseline baseline.json
+"""
+import os
+import sys
+import json
+import time
+import random
+import shutil
+import argparse
+import platform
+import tempfile
+import subprocess
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+
+from bench_decode import max_rss_mb  # noqa: E402
+
+
+SCALES = {"1k": 1000, "10k": 10000, "100k": 100000, "1m": 1000000}
+STEPS = (
+    "check_folders_selected",
+    "filter_images_by_range",
+    "load_prompts",
+    "load_annotations",
+    "show_image_pair",
+    "save_annotations",
+    "save_session",
+    "resume_session",
+)
+# Distinct encoded images per folder; every pair is a hard link to one of them
+SOURCE_IMAGES = 16
+# Steps faster than this are too noisy to flag as regressions
+NOISE_FLOOR_SECONDS = 0.05
+
+
+def parse_scale(text):
+    text = text.strip().lower()
+    return SCALES[text] if text in SCALES else int(text)
+
+
+def dataset_params(args, pairs):
+    return {
+        "pairs": pairs,
+        "width": args.width,
+        "height": args.height,
+        "format": args.format,
+        "casing": args.casing,
+        "annotated": args.annotated,
+        "seed": args.seed,
+    }
+
+
+def b_name(i, fmt, casing):
+    # Folder B differs from Folder A only in the casing of the extension
+    if casing == "upper" or (casing == "mixed" and i % 2):
+        return f"{i}.{fmt.upper()}"
+    return f"{i}.{fmt}"
+
+
+def link_or_copy(source, path):
+    try:
+        os.link(source, path)
+    except OSError:
+        shutil.copyfile(source, path)
+
+
+def make_dataset(root, params):
+    """
+    Create root/A, root/B, root/prompts.json and root/annotations.json for
+    params, unless root already holds a dataset made with the same params.
+    """
+    marker = os.path.join(root, "dataset.json")
+    if os.path.exists(marker):
+        with open(marker, "r", encoding="utf-8") as f:
+            if json.load(f) == params:
+                return
+        shutil.rmtree(root)
+
+    from PIL import Image
+
+    pairs, fmt = params["pairs"], params["format"]
+    rng = random.Random(params["seed"])
+    print(f"Generating {pairs} pairs of {params['width']}x{params['height']} {fmt} images in {root}...",
+          file=sys.stderr)
+    for sub in ("A", "B", "src"):
+        os.makedirs(os.path.join(root, sub), exist_ok=True)
+
+    sources = []
+    for k in range(SOURCE_IMAGES):
+        source = os.path.join(root, "src", f"{k}.{fmt}")
+        # Noise keeps the encoder from producing unrealistically small files
+        Image.effect_noise((params["width"], params["height"]), 32 + k).convert("RGB").save(source)
+        sources.append(source)
+
+    for i in range(pairs):
+        link_or_copy(sources[i % SOURCE_IMAGES], os.path.join(root, "A", f"{i}.{fmt}"))
+        link_or_copy(sources[(i + 1) % SOURCE_IMAGES], os.path.join(root, "B", b_name(i, fmt, params["casing"])))
+
+    # Prompts for every pair, written entry by entry to keep memory flat
+    with open(os.path.join(root, "prompts.json"), "w", encoding="utf-8") as f:
+        f.write("{")
+        for i in range(pairs):
+            prompt = f"synthetic prompt {i}: " + " ".join(rng.choice(("a", "photo", "of", "cat", "red", "tree"))
+                                                          for _ in range(12))
+            f.write(("," if i else "") + f"\n    {json.dumps(f'{i}.{fmt}')}: {json.dumps(prompt)}")
+        f.write("\n}")
+
+    annotations = {
+        f"{i}.{fmt}": rng.choice("ABT")
+        for i in range(pairs)
+        if rng.random() < params["annotated"]
+    }
+    with open(os.path.join(root, "annotations.json"), "w", encoding="utf-8") as f:
+        json.dump(annotations, f, indent=4)
+
+    with open(marker, "w", encoding="utf-8") as f:
+        json.dump(params, f)
+
+
+def run_session(root, pairs, show_count, thumbnails):
+    """
+    Child process: drive one ImageComparer over the dataset in root and
+    return the per-step results.
+    """
+    os.environ.setdefault("QT_QPA_PLATFORM", "offscreen")
+    from PyQt5.QtWidgets import QApplication, QMessageBox, QFileDialog
+
+    app = QApplication([sys.argv[0]])
+
+    # Answer every dialog without user interaction
+    dialog_answers = {}
+    QMessageBox.information = staticmethod(lambda *a, **k: QMessageBox.Ok)
+    QMessageBox.warning = staticmethod(lambda *a, **k: QMessageBox.Ok)
+    QMessageBox.critical = staticmethod(lambda *a, **k: print(f"Error: {a[2]}", file=sys.stderr))
+    QMessageBox.question = staticmethod(lambda *a, **k: QMessageBox.No)
+    QFileDialog.getOpenFileName = staticmethod(lambda parent, title, *a, **k: (dialog_answers[title], ""))
+
+    import image_preference
+
+    work = tempfile.mkdtemp(prefix="bench_session_")
+    # The journal and saved annotations go to a scratch copy
+    annotations_path = os.path.join(work, "annotations.json")
+    shutil.copyfile(os.path.join(root, "annotations.json"), annotations_path)
+    dialog_answers["Load Prompt File"] = os.path.join(root, "prompts.json")
+    dialog_answers["Load Annotations"] = annotations_path
+
+    session_path = os.path.join(work, "session.json")
+    comparer = image_preference.ImageComparer(thumbnails=thumbnails, thumbnail_dir=os.path.join(work, "thumbs"),
+                                              session=session_path)
+    results = {}
+
+    def step(name, items, func):
+        started = time.perf_counter()
+        func()
+        app.processEvents()
+        seconds = time.perf_counter() - started
+        results[name] = {
+            "seconds": seconds,
+            "items": items,
+            "per_second": items / seconds if seconds > 0 else None,
+            "peak_rss_mb": max_rss_mb(),
+        }
+
+    def select_folders():
+        comparer.folder_a = os.path.join(root, "A")
+        comparer.folder_b = os.path.join(root, "B")
+        comparer.check_folders_selected()
+
+    def filter_range():
+        comparer.ranges = [(0, pairs - 1)]
+        comparer.start_index, comparer.end_index, comparer.range_set = 0, pairs - 1, True
+        comparer.filter_images_by_range()
+
+    def show_pairs():
+        for _ in range(show_count):
+            comparer.go_next()
+            # Let finished background decodes reach the cache, as the event loop would
+            app.processEvents()
+
+    step("check_folders_selected", pairs, select_folders)
+    step("filter_images_by_range", pairs, filter_range)
+    step("load_prompts", pairs, comparer.load_prompts)
+    step("load_annotations", pairs, comparer.load_annotations)
+    step("show_image_pair", show_count, show_pairs)
+    step("save_annotations", len(comparer.annotations), comparer.save_annotations)
+    step("save_session", pairs, comparer.save_session)
+
+    resumed = image_preference.ImageComparer(thumbnails=thumbnails, thumbnail_dir=os.path.join(work, "thumbs"),
+                                             session=session_path)
+    step("resume_session", pairs, resumed.resume_session)
+
+    for window in (comparer, resumed):
+        window.prefetcher.shutdown()
+        if window.journal is not None:
+            window.journal.close()
+    shutil.rmtree(work, ignore_errors=True)
+    return {
+        "pairs": pairs,
+        "shown": show_count,
+        "steps": results,
+        "peak_rss_mb": max_rss_mb(),
+        # Per-operation percentiles recorded by the annotator itself
+        "latency": image_preference.recorder.summary(),
+    }
+
+
+def environment():
+    from PyQt5.QtCore import QT_VERSION_STR
+
+    return {
+        "python": platform.python_version(),
+        "qt": QT_VERSION_STR,
+        "platform": platform.platform(),
+        "machine": platform.machine(),
+        "cpus": os.cpu_count(),
+    }
+
+
+def compare(results, baseline, tolerance):
+    """
+    Print the time ratio of each step against the baseline. Returns the
+    number of steps slower than tolerance times their baseline.
+    """
+    regressions = 0
+    for scale, result in results.items():
+        old = baseline.get("results", {}).get(scale)
+        if old is None:
+            print(f"{scale}: not in baseline")
+            continue
+        for name, new_step in result["steps"].items():
+            old_step = old["steps"].get(name)
+            if old_step is None:
+                continue
+            ratio = new_step["seconds"] / max(old_step["seconds"], 1e-9)
+            slower = ratio > tolerance and new_step["seconds"] > NOISE_FLOOR_SECONDS
+            regressions += slower
+            print(f"{scale:>5} {name:<24} {old_step['seconds']:>9.3f}s -> {new_step['seconds']:>9.3f}s "
+                  f"x{ratio:.2f}{'  REGRESSION' if slower else ''}")
+    return regressions
+
+
+def print_results(results):
+    print(f"{'scale':>5} {'step':<24} {'seconds':>9} {'items/s':>12} {'peak RSS MB':>12}")
+    for scale, result in results.items():
+        for name in STEPS:
+            r = result["steps"][name]
+            per_second = f"{r['per_second']:.0f}" if r["per_second"] else "-"
+            print(f"{scale:>5} {name:<24} {r['seconds']:>9.3f} {per_second:>12} {r['peak_rss_mb']:>12.1f}")
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--scales", default="1k", help="Comma separated pair counts, e.g. 1k,100k,1m.")
+    parser.add_argument("--width", type=int, default=1024, help="Synthetic image width.")
+    parser.add_argument("--height", type=int, default=1024, help="Synthetic image height.")
+    parser.add_argument("--format", default="jpg", help="Synthetic image format (jpg, png, webp...).")
+    parser.add_argument("--casing", choices=("lower", "upper", "mixed"), default="mixed",
+                        help="Casing of Folder B extensions relative to Folder A.")
+    parser.add_argument("--annotated", type=float, default=0.1,
+                        help="Fraction of pairs already in the annotations file.")
+    parser.add_argument("--show", type=int, default=200, help="Number of pairs to step through.")
+    parser.add_argument("--thumbnails", action="store_true", help="Use a (fresh) thumbnail store.")
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--data-dir", default=os.path.join(tempfile.gettempdir(), "annotator_bench"),
+                        help="Where synthetic datasets are generated and cached.")
+    parser.add_argument("--output", help="Write the results to this JSON file.")
+    parser.add_argument("--baseline", help="Baseline JSON file to compare against.")
+    parser.add_argument("--update-baseline", action="store_true", help="Write the results to --baseline.")
+    parser.add_argument("--tolerance", type=float, default=1.5,
+                        help="Flag steps slower than this many times the baseline.")
+    parser.add_argument("--run-session", help=argparse.SUPPRESS)
+    parser.add_argument("--pairs", type=int, help=argparse.SUPPRESS)
+    args = parser.parse_args(argv)
+
+    # Child process: run one session and print its result
+    if args.run_session:
+        print(json.dumps(run_session(args.run_session, args.pairs, args.show, args.thumbnails)))
+        return 0
+
+    results = {}
+    for scale in args.scales.split(","):
+        pairs = parse_scale(scale)
+        params = dataset_params(args, pairs)
+        root = os.path.join(args.data_dir, f"{pairs}_{args.width}x{args.height}_{args.format}_{args.casing}")
+        make_dataset(root, params)
+
+        command = [sys.executable, os.path.abspath(__file__), "--run-session", root, "--pairs", str(pairs),
+                   "--show", str(min(args.show, pairs - 1))]
+        if args.thumbnails:
+            command.append("--thumbnails")
+        output = subprocess.run(command, check=True, capture_output=True, text=True).stdout
+        result = json.loads(output.strip().splitlines()[-1])
+        result["dataset"] = params
+        results[scale.strip().lower()] = result
+
+    print_results(results)
+    report = {"created": time.strftime("%Y-%m-%dT%H:%M:%S"), "environment": environment(), "results": results}
+
+    if args.output:
+        with open(args.output, "w", encoding="utf-8") as f:
+            json.dump(report, f, indent=4)
+
+    regressions = 0
+    if args.baseline and not args.update_baseline:
+        if os.path.exists(args.baseline):
+            with open(args.baseline, "r", encoding="utf-8") as f:
+                regressions = compare(results, json.load(f), args.tolerance)
+        else:
+            print(f"No baseline at {args.baseline}; record one with --update-baseline")
+    if args.baseline and args.update_baseline:
+        with open(args.baseline, "w", encoding="utf-8") as f:
+            json.dump(report, f, indent=4)
+        print(f"Baseline written to {args.baseline}")
+    return 1 if regressions else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,217 @@
+"""
+Zoom benchmark: tile pyramid build time and frame times of panning a very
+large pair in the zoom window.
+
+Generates a synthetic A/B pair (or uses two given images), builds the
+overview and the full-resolution levels in a worker process (reporting its
+peak RSS), then pans both views across the pair at each zoom level on an
+offscreen display. Frames are paced at 60 fps; tile reads land between
+frames, as they would on screen. Reports paint time per frame, the frames
+that still showed a coarser stand-in for some tile, and the peak RSS of the
+viewer process, which the tile cache budget bounds.
+
+    python benchmarks/bench_zoom.py --size 16384 16384
+    python benchmarks/bench_zoom.py --image-a a.png --image-b b.png --zoom 1,0.5
+"""
+import os
+import sys
+import json
+import time
+import argparse
+import resource
+import tempfile
+import subprocess
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+
+FRAME_SECONDS = 1 / 60
+
+
+def max_rss_mb():
+    # VmHWM is per address space; see bench_decode.py
+    try:
+        with open("/proc/self/status", "r") as f:
+            for line in f:
+                if line.startswith("VmHWM:"):
+                    return int(line.split()[1]) / 1024
+    except OSError:
+        pass
+    rss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    return rss / (1024 * 1024) if sys.platform == "darwin" else rss / 1024
+
+
+def make_pair(folder, width, height, fmt):
+    from PIL import Image, ImageFilter
+
+    Image.MAX_IMAGE_PIXELS = None
+    paths = []
+    for i, sub in enumerate(("A", "B")):
+        os.makedirs(os.path.join(folder, sub), exist_ok=True)
+        # Upscaled noise: detail at every zoom level without a huge file
+        base = Image.effect_noise((max(1, width // 8), max(1, height // 8)), 48 + 16 * i).convert("RGB")
+        im = base.filter(ImageFilter.SMOOTH).resize((width, height), Image.BICUBIC)
+        path = os.path.join(folder, sub, f"0.{fmt}")
+        if fmt in ("jpg", "jpeg"):
+            im.save(path, quality=90)
+        else:
+            im.save(path)
+        del im
+        paths.append(path)
+    return paths
+
+
+def run_build(paths, thumbnail_dir):
+    """
+    Child process: build every level of both images, overview first.
+    """
+    from thumbnail_store import ThumbnailStore
+    from tile_pyramid import open_pyramid, build_levels
+
+    store = ThumbnailStore(thumbnail_dir)
+    result = {"overview_s": 0.0, "full_s": 0.0}
+    for path in paths:
+        pyramid = open_pyramid(store, path)
+        started = time.perf_counter()
+        build_levels(pyramid, path, pyramid.levels - 1)
+        result["overview_s"] += time.perf_counter() - started
+        started = time.perf_counter()
+        build_levels(pyramid, path, 0)
+        result["full_s"] += time.perf_counter() - started
+        result["levels"] = pyramid.levels
+        result["width"], result["height"] = pyramid.width, pyramid.height
+    result["peak_rss_mb"] = max_rss_mb()
+    return result
+
+
+def run_pan(paths, thumbnail_dir, zooms, frames, speed, cache_mb):
+    """
+    Child process: pan the zoom window across the pair at each zoom level.
+    """
+    from PyQt5.QtWidgets import QApplication
+    from thumbnail_store import ThumbnailStore
+    from zoom_view import TileSource, ZoomWindow
+
+    app = QApplication([sys.argv[0], "-platform", "offscreen"])
+    source = TileSource(ThumbnailStore(thumbnail_dir), max_bytes=cache_mb * 1024 * 1024)
+    window = ZoomWindow(source)
+    window.resize(1600, 900)
+    window.show()
+    window.show_pair(*paths)
+    app.processEvents()
+    rss_before = max_rss_mb()
+    pyramid = window.view_a.pyramid
+
+    results = []
+    for zoom in zooms:
+        # Start at the left edge of the middle row, then settle the first view
+        span = window.view_a.width() / (2 * pyramid.width * zoom)
+        cx = min(0.5, span)
+        window.state.set(zoom, (cx, 0.5))
+        deadline = time.perf_counter() + 30
+        while (source.pending or source.builds) and time.perf_counter() < deadline:
+            app.processEvents()
+            time.sleep(0.001)
+
+        timings = []
+        incomplete = 0
+        for frame in range(frames):
+            started = time.perf_counter()
+            window.state.set(zoom, (cx + frame * speed / (pyramid.width * zoom), 0.5))
+            window.view_a.repaint()
+            window.view_b.repaint()
+            timings.append(time.perf_counter() - started)
+            if source.wanted:
+                incomplete += 1
+            # Let tile reads land until the next frame is due
+            while time.perf_counter() < started + FRAME_SECONDS:
+                app.processEvents()
+                time.sleep(0.0005)
+        timings.sort()
+        results.append({
+            "zoom": zoom,
+            "level": pyramid.level_for_scale(zoom),
+            "frames": frames,
+            "p50_ms": 1000 * timings[len(timings) // 2],
+            "p95_ms": 1000 * timings[int(len(timings) * 0.95)],
+            "max_ms": 1000 * timings[-1],
+            "incomplete_frames": incomplete,
+        })
+
+    stats = source.cache.stats()
+    source.shutdown()
+    return {
+        "pans": results,
+        "tile_cache_mb": stats["bytes"] / (1024 * 1024),
+        "peak_rss_mb": max_rss_mb(),
+        "rss_growth_mb": max_rss_mb() - rss_before,
+        "full_pixmaps_mb": 2 * pyramid.width * pyramid.height * 4 / (1024 * 1024),
+    }
+
+
+def child(args, *extra):
+    output = subprocess.run(
+        [sys.executable, os.path.abspath(__file__), *extra, "--thumbnail-dir", args.thumbnail_dir,
+         "--image-a", args.image_a, "--image-b", args.image_b, "--zoom", args.zoom, "--frames", str(args.frames),
+         "--speed", str(args.speed), "--tile-cache-mb", str(args.tile_cache_mb)],
+        check=True,
+        capture_output=True,
+        text=True,
+    ).stdout
+    return json.loads(output.strip().splitlines()[-1])
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--image-a", help="Existing Folder A image (default: generate a synthetic pair).")
+    parser.add_argument("--image-b", help="Existing Folder B image.")
+    parser.add_argument("--size", type=int, nargs=2, default=(16384, 16384), metavar=("WIDTH", "HEIGHT"),
+                        help="Synthetic image size.")
+    parser.add_argument("--format", default="jpg", help="Synthetic image format (jpg, png...).")
+    parser.add_argument("--zoom", default="1,0.25", help="Comma-separated zoom levels to pan at (1 = 100%%).")
+    parser.add_argument("--frames", type=int, default=300, help="Frames panned per zoom level.")
+    parser.add_argument("--speed", type=float, default=20, help="Pan speed in view pixels per frame.")
+    parser.add_argument("--tile-cache-mb", type=int, default=128, help="Tile cache budget of the viewer.")
+    parser.add_argument("--thumbnail-dir", help="Where the tiles go (default: a temporary directory).")
+    parser.add_argument("--json", help="Also write the results to this JSON file.")
+    parser.add_argument("--run", choices=("build", "pan"), help=argparse.SUPPRESS)
+    args = parser.parse_args(argv)
+
+    # Child process: run one step and print its result
+    if args.run == "build":
+        print(json.dumps(run_build([args.image_a, args.image_b], args.thumbnail_dir)))
+        return 0
+    if args.run == "pan":
+        zooms = [float(z) for z in args.zoom.split(",")]
+        print(json.dumps(run_pan([args.image_a, args.image_b], args.thumbnail_dir, zooms, args.frames,
+                                 args.speed, args.tile_cache_mb)))
+        return 0
+
+    with tempfile.TemporaryDirectory() as tmp:
+        if not (args.image_a and args.image_b):
+            width, height = args.size
+            print(f"Generating a {width}x{height} {args.format} pair...")
+            args.image_a, args.image_b = make_pair(tmp, width, height, args.format)
+        args.thumbnail_dir = args.thumbnail_dir or os.path.join(tmp, "thumbnails")
+
+        build = child(args, "--run", "build")
+        pan = child(args, "--run", "pan")
+
+    print(f"{build['width']}x{build['height']}, {build['levels']} levels: overview built in "
+          f"{build['overview_s']:.1f}s, all levels in {build['overview_s'] + build['full_s']:.1f}s "
+          f"(builder peak RSS {build['peak_rss_mb']:.0f} MB)")
+    print(f"{'zoom':>6} {'level':>6} {'frames':>7} {'p50 ms':>8} {'p95 ms':>8} {'max ms':>8} {'incomplete':>11}")
+    for r in pan["pans"]:
+        print(f"{r['zoom']:>6.2f} {r['level']:>6} {r['frames']:>7} {r['p50_ms']:>8.1f} {r['p95_ms']:>8.1f} "
+              f"{r['max_ms']:>8.1f} {r['incomplete_frames']:>11}")
+    print(f"Viewer peak RSS {pan['peak_rss_mb']:.0f} MB (tile cache {pan['tile_cache_mb']:.0f} MB); "
+          f"the pair as full-size pixmaps would need {pan['full_pixmaps_mb']:.0f} MB")
+
+    if args.json:
+        with open(args.json, "w", encoding="utf-8") as f:
+            json.dump({"build": build, "pan": pan}, f, indent=4)
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,345 @@
+import os
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+
+IMAGE_EXTENSIONS = (".png", ".jpg", ".jpeg", ".bmp", ".gif", ".tiff", ".webp")
+
+
+class FolderIndex:
+    """
+    One-scan index of an image folder.
+
+    Maps lowercase filenames to the actual filenames on disk and numeric ids
+    (e.g. 12 for "12.png") to filenames, so lookups never list the folder again.
+    With recursive=True nested subdirectories are indexed too (skipping hidden
+    ones such as the .thumbnails sidecar) and names are relative paths with "/"
+    separators, e.g. "batch1/12.png". Scanning uses os.scandir, optionally with
+    `workers` threads across subdirectories for network filesystems.
+
+    The id of a file is the integer of its stem, wherever it is nested. An id
+    shared by several files (e.g. "batch1/12.png" and "batch2/12.png", or
+    "12.png" and "12.jpg") is ambiguous and left out of by_id until only one
+    of them remains; those files are still in by_lower.
+
+    The index updates itself when a directory mtime changes, checked at most
+    once every `check_interval` seconds; only changed directories are listed
+    again. `refresh()` forces a full rescan. `state()` and `from_state()`
+    save and restore the listing, e.g. for a session snapshot.
+    """
+
+    def __init__(self, folder, check_interval=2.0, verbose=True, recursive=False, workers=1, dirs=None):
+        self.folder = folder
+        self.check_interval = check_interval
+        self.verbose = verbose
+        self.recursive = recursive
+        self.workers = max(1, workers)
+
+        # { "image1.png": "Image1.PNG", ... }
+        self.by_lower = {}
+        # { 1: "Image1.PNG", ... } for files whose stem is an integer
+        self.by_id = {}
+        # { id: {relative paths} } for ids shared by several files, kept out of by_id
+        self.shared_ids = {}
+        # { relative dir ("" for the folder itself): (mtime_ns, [file names], [subdirs]) }
+        self.dirs = {}
+
+        self.scan_seconds = 0.0
+        self.last_checked = 0.0
+
+        # Lowercase names added by update() since the last take_added()
+        self.pending_added = []
+
+        if dirs is None:
+            self.refresh()
+        else:
+            # A saved listing, not checked against the disk here
+            for rel_dir, result in dirs.items():
+                self._add_dir(rel_dir, result)
+            self.last_checked = time.monotonic()
+
+    def refresh(self):
+        """
+        Rescan the folder and rebuild both maps. Returns the scan time in seconds.
+        """
+        started = time.perf_counter()
+        # Raise like os.listdir would if the folder is missing
+        os.stat(self.folder)
+
+        self.by_lower = {}
+        self.by_id = {}
+        self.shared_ids = {}
+        self.dirs = {}
+        self.pending_added = []
+        for rel_dir, result in self._walk([""]).items():
+            self._add_dir(rel_dir, result)
+
+        self.last_checked = time.monotonic()
+        self.scan_seconds = time.perf_counter() - started
+        if self.verbose:
+            print(f"Indexed {len(self.by_lower)} images in {self.folder} ({self.scan_seconds:.3f}s)")
+            if self.shared_ids:
+                print(shared_ids_message(self.shared_ids))
+        return self.scan_seconds
+
+    def update(self):
+        """
+        Re-list only the directories whose mtime changed, and index any new
+        subdirectories. Returns (added, removed) lists of lowercase names.
+        """
+        changed = []
+        vanished = []
+        for rel_dir, (mtime, _, _) in self.dirs.items():
+            try:
+                if os.stat(self._path(rel_dir)).st_mtime_ns != mtime:
+                    changed.append(rel_dir)
+            except OSError:
+                vanished.append(rel_dir)
+
+        added, removed = [], []
+        for rel_dir in vanished:
+            removed.extend(self._drop_dir(rel_dir))
+
+        rescanned = self._map(self._scan_dir, changed)
+        for rel_dir, result in zip(changed, rescanned):
+            if result is None:
+                removed.extend(self._drop_dir(rel_dir))
+                continue
+            old_files = set(self.dirs[rel_dir][1])
+            new_files = set(result[1])
+            for rel_path in old_files - new_files:
+                self._remove_file(rel_path)
+                removed.append(rel_path.lower())
+            for rel_path in new_files - old_files:
+                self._add_file(rel_path)
+                added.append(rel_path.lower())
+            self.dirs[rel_dir] = result
+
+            # Index subdirectories created since the last scan
+            new_subdirs = [subdir for subdir in result[2] if subdir not in self.dirs]
+            for subdir, sub_result in self._walk(new_subdirs).items():
+                self._add_dir(subdir, sub_result)
+                added.extend(rel_path.lower() for rel_path in sub_result[1])
+
+        self.pending_added.extend(added)
+        self.last_checked = time.monotonic()
+        if self.verbose and (added or removed):
+            print(f"Updated index of {self.folder}: {len(added)} added, {len(removed)} removed")
+        return added, removed
+
+    def state(self):
+        """
+        JSON-serializable listing: every indexed directory with its mtime,
+        files and subdirectories. The mtimes are the index's fingerprint.
+        """
+        return {"folder": self.folder, "recursive": self.recursive, "dirs": self.dirs}
+
+    @classmethod
+    def from_state(cls, state, check_interval=2.0, verbose=True, workers=1):
+        """
+        Rebuild an index from state() without listing any directory. Returns
+        None if a directory changed or vanished since, so the caller rescans.
+        """
+        index = cls(state["folder"], check_interval, verbose, state["recursive"], workers, dirs=state["dirs"])
+        if index.is_stale():
+            return None
+        if verbose:
+            print(f"Restored the index of {len(index.by_lower)} images in {index.folder}")
+        return index
+
+    def take_added(self):
+        """
+        Return the names added by updates since the last call, including those
+        picked up by lookups through ensure_fresh().
+        """
+        added, self.pending_added = self.pending_added, []
+        return added
+
+    def is_stale(self):
+        for rel_dir, (mtime, _, _) in self.dirs.items():
+            try:
+                if os.stat(self._path(rel_dir)).st_mtime_ns != mtime:
+                    return True
+            except OSError:
+                return True
+        return False
+
+    def ensure_fresh(self, force=False):
+        """
+        Update the index if a directory changed since the last scan. The mtimes
+        are only checked once per `check_interval` unless `force` is set.
+        """
+        now = time.monotonic()
+        if not force and now - self.last_checked < self.check_interval:
+            return False
+        self.last_checked = now
+        added, removed = self.update()
+        return bool(added or removed)
+
+    def actual_name(self, lowercase_filename):
+        """
+        Return the filename with original casing, or None if it is not in the folder.
+        """
+        self.ensure_fresh()
+        return self.by_lower.get(lowercase_filename)
+
+    def name_for_id(self, image_id):
+        self.ensure_fresh()
+        return self.by_id.get(image_id)
+
+    def key_of(self, name):
+        """
+        Key of a filename (e.g. an annotation key) in by_lower.
+        """
+        return name.lower()
+
+    def lower_names(self):
+        return set(self.by_lower)
+
+    def path_of(self, actual_name):
+        return os.path.join(self.folder, actual_name)
+
+    def directories(self):
+        """
+        Absolute paths of every indexed directory, e.g. for a filesystem watcher.
+        """
+        return [self._path(rel_dir) for rel_dir in self.dirs]
+
+    def __len__(self):
+        return len(self.by_lower)
+
+    def __contains__(self, lowercase_filename):
+        return lowercase_filename in self.by_lower
+
+    def _path(self, rel_dir):
+        return os.path.join(self.folder, rel_dir) if rel_dir else self.folder
+
+    def _map(self, func, items):
+        if self.workers > 1 and len(items) > 1:
+            with ThreadPoolExecutor(max_workers=self.workers) as executor:
+                return list(executor.map(func, items))
+        return [func(item) for item in items]
+
+    def _scan_dir(self, rel_dir):
+        """
+        List one directory. Returns (mtime_ns, [image paths], [subdirs]) relative
+        to the folder, or None if it cannot be read.
+        """
+        path = self._path(rel_dir)
+        prefix = f"{rel_dir}/" if rel_dir else ""
+        files, subdirs = [], []
+        try:
+            # Stat before listing so a change during the scan is seen next time
+            mtime = os.stat(path).st_mtime_ns
+            with os.scandir(path) as entries:
+                for entry in entries:
+                    name = entry.name
+                    if name.lower().endswith(IMAGE_EXTENSIONS) and not entry.is_dir():
+                        files.append(prefix + name)
+                    elif self.recursive and not name.startswith(".") and entry.is_dir(follow_symlinks=False):
+                        subdirs.append(prefix + name)
+        except OSError:
+            return None
+        return mtime, files, subdirs
+
+    def _walk(self, roots):
+        """
+        Scan roots and, when recursive, everything below them, one directory
+        level at a time so each level can be listed in parallel.
+        """
+        results = {}
+        level = list(roots)
+        while level:
+            next_level = []
+            for rel_dir, result in zip(level, self._map(self._scan_dir, level)):
+                if result is None:
+                    continue
+                results[rel_dir] = result
+                next_level.extend(result[2])
+            level = next_level
+        return results
+
+    def _add_dir(self, rel_dir, result):
+        self.dirs[rel_dir] = result
+        # _add_file inlined: this runs once per file of every scan and restore
+        by_lower, by_id = self.by_lower, self.by_id
+        start = len(rel_dir) + 1 if rel_dir else 0
+        by_lower.update(zip(map(str.lower, result[1]), result[1]))
+        for rel_path in result[1]:
+            stem = rel_path[start:].rpartition(".")[0]
+            if stem.isdecimal():
+                image_id = int(stem)
+                if image_id in by_id or image_id in self.shared_ids:
+                    add_id(by_id, self.shared_ids, rel_path, image_id)
+                else:
+                    by_id[image_id] = rel_path
+
+    def _drop_dir(self, rel_dir):
+        entry = self.dirs.pop(rel_dir, None)
+        if entry is None:
+            return []
+        for rel_path in entry[1]:
+            self._remove_file(rel_path)
+        return [rel_path.lower() for rel_path in entry[1]]
+
+    def _add_file(self, rel_path):
+        self.by_lower[rel_path.lower()] = rel_path
+        add_id(self.by_id, self.shared_ids, rel_path)
+
+    def _remove_file(self, rel_path):
+        if self.by_lower.get(rel_path.lower()) == rel_path:
+            del self.by_lower[rel_path.lower()]
+        remove_id(self.by_id, self.shared_ids, rel_path)
+
+
+def image_id(name):
+    """
+    Numeric id of a file: its stem if that is a decimal number, else None.
+    """
+    stem = os.path.splitext(os.path.basename(name))[0]
+    return int(stem) if stem.isdecimal() else None
+
+
+def add_id(by_id, shared_ids, name, name_id=None):
+    """
+    Record name under its id in by_id, unless another name holds the id;
+    then the id is ambiguous and all its names go to shared_ids instead.
+    """
+    if name_id is None:
+        name_id = image_id(name)
+        # Skip files that do not have a numeric name
+        if name_id is None:
+            return
+    shared = shared_ids.get(name_id)
+    if shared is not None:
+        shared.add(name)
+        return
+    current = by_id.get(name_id)
+    if current is None or current == name:
+        by_id[name_id] = name
+    else:
+        del by_id[name_id]
+        shared_ids[name_id] = {current, name}
+
+
+def remove_id(by_id, shared_ids, name):
+    """
+    Undo add_id(); an id left with a single name is unambiguous again.
+    """
+    name_id = image_id(name)
+    if name_id is None:
+        return
+    shared = shared_ids.get(name_id)
+    if shared is not None:
+        shared.discard(name)
+        if len(shared) == 1:
+            by_id[name_id] = shared.pop()
+            del shared_ids[name_id]
+    elif by_id.get(name_id) == name:
+        del by_id[name_id]
+
+
+def shared_ids_message(shared_ids):
+    example = sorted(next(iter(shared_ids.values())))
+    return (f"Left {len(shared_ids)} ids shared by several files out of the id lookup "
+            f"(e.g. {', '.join(example)})")
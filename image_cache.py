@@ -0,0 +1,85 @@
+from collections import OrderedDict
+
+import archive_source
+
+
+class ImageCache:
+    """
+    LRU cache of downscaled images bounded by a byte budget.
+
+    Entries are keyed by (path, mtime, target size), so an edited file or a new
+    display size never returns a stale image. Only display-resolution images
+    should be stored; the caller passes each entry's size in bytes.
+    """
+
+    def __init__(self, max_bytes=256 * 1024 * 1024):
+        self.max_bytes = max_bytes
+        self.total_bytes = 0
+
+        # { key: (image, nbytes) }, least recently used first
+        self.entries = OrderedDict()
+
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+
+    @staticmethod
+    def make_key(path, size):
+        """
+        Return the cache key for path at the given (width, height), or None if
+        the file (or archive member) cannot be stat'ed.
+        """
+        try:
+            mtime = archive_source.stat(path).st_mtime_ns
+        except OSError:
+            return None
+        return (path, mtime, tuple(size))
+
+    def get(self, key):
+        entry = self.entries.get(key)
+        if entry is None:
+            self.misses += 1
+            return None
+        self.entries.move_to_end(key)
+        self.hits += 1
+        return entry[0]
+
+    def put(self, key, image, nbytes):
+        if key in self.entries:
+            self.total_bytes -= self.entries.pop(key)[1]
+        if nbytes > self.max_bytes:
+            # Never cache something that would evict everything else
+            return
+        self.entries[key] = (image, nbytes)
+        self.total_bytes += nbytes
+        self.evict()
+
+    def evict(self):
+        while self.total_bytes > self.max_bytes and self.entries:
+            _, (_, nbytes) = self.entries.popitem(last=False)
+            self.total_bytes -= nbytes
+            self.evictions += 1
+
+    def set_max_bytes(self, max_bytes):
+        self.max_bytes = max_bytes
+        self.evict()
+
+    def clear(self):
+        self.entries.clear()
+        self.total_bytes = 0
+
+    def stats(self):
+        return {
+            "entries": len(self.entries),
+            "bytes": self.total_bytes,
+            "max_bytes": self.max_bytes,
+            "hits": self.hits,
+            "misses": self.misses,
+            "evictions": self.evictions,
+        }
+
+    def __contains__(self, key):
+        return key in self.entries
+
+    def __len__(self):
+        return len(self.entries)
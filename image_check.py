@@ -0,0 +1,90 @@
+"""
+Pre-flight integrity check of image pairs, so broken files are found before
+an annotator hits them. Qt-free; needs Pillow.
+
+Every image is checked in a process pool: zero-byte file, header parse,
+full decode (JPEGs at reduced scale, which still reads every scan, so
+truncation is caught) and dimensions. Results are cached per folder in
+checks.sqlite next to the thumbnails, keyed by path, size and mtime, so a
+rerun only checks new or changed files. A pair is bad if either image is
+missing or fails a check; A and B with different dimensions are reported
+as a warning only.
+"""
+import io
+
+from thumbnail_store import map_cached, read_source
+
+
+# Images per worker task
+BATCH_SIZE = 32
+
+
+def _check_batch(jobs):
+    """
+    Worker: check a batch of (path, archive path or None) jobs. Returns
+    [error or None, width, height] per job.
+    """
+    from PIL import Image, UnidentifiedImageError
+
+    # Large outputs are expected here; the decode itself is the check
+    Image.MAX_IMAGE_PIXELS = None
+    results = []
+    for path, archive_path in jobs:
+        width = height = 0
+        try:
+            data = read_source(path, archive_path)
+            if not data:
+                results.append(["zero-byte file", 0, 0])
+                continue
+            with Image.open(io.BytesIO(data)) as im:
+                width, height = im.size
+                if width <= 0 or height <= 0:
+                    results.append([f"invalid dimensions {width}x{height}", width, height])
+                    continue
+                im.draft(im.mode, (max(1, width // 8), max(1, height // 8)))
+                im.load()
+            results.append([None, width, height])
+        except UnidentifiedImageError:
+            results.append(["not a readable image", width, height])
+        except Exception as e:
+            results.append([f"decode failed: {e}", width, height])
+    return results
+
+
+def check_images(index, names, thumbnail_dir=None, workers=None):
+    """
+    Return { lowercase name: [error or None, width, height] } for names in
+    an image source. Images that cannot be stat'ed are left out.
+    """
+    return map_cached(index, names, "checks.sqlite", _check_batch, thumbnail_dir, workers, BATCH_SIZE)
+
+
+def check_pairs(index_a, index_b, names, thumbnail_dir=None, workers=None):
+    """
+    Check both images of every pair. Returns (bad, warnings): lists of
+    { "image", "problems" } records for pairs to exclude and for pairs that
+    only differ in size, in the order of names.
+    """
+    names = list(names)
+    checks = (check_images(index_a, names, thumbnail_dir, workers),
+              check_images(index_b, names, thumbnail_dir, workers))
+    bad, warnings = [], []
+    for name in names:
+        problems = []
+        sizes = []
+        for side, index, results in (("A", index_a, checks[0]), ("B", index_b, checks[1])):
+            result = results.get(name)
+            if result is None:
+                problems.append(f"{side}: missing file {index.path_of(index.by_lower.get(name, name))}")
+                continue
+            error, width, height = result
+            if error:
+                problems.append(f"{side}: {error}")
+            sizes.append((width, height))
+        record = {"image": index_a.by_lower.get(name, name), "problems": problems}
+        if problems:
+            bad.append(record)
+        elif sizes[0] != sizes[1]:
+            record["problems"] = [f"size mismatch: A {sizes[0][0]}x{sizes[0][1]}, B {sizes[1][0]}x{sizes[1][1]}"]
+            warnings.append(record)
+    return bad, warnings
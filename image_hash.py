@@ -0,0 +1,148 @@
+"""
+Perceptual hashes of image pairs, to find pairs whose two sides are
+identical or nearly so before anyone has to annotate them. Qt-free; needs
+Pillow and NumPy.
+
+Every image gets a 64-bit pHash (sign of the low 8x8 DCT coefficients of a
+32x32 grayscale copy against their median) and a 64-bit dHash (horizontal
+gradient signs of a 9x8 copy), a 4x4 RGB copy as a colour signature, and
+a digest of the file bytes. Images are hashed in batches across a process
+pool, with the DCT done as one batched matrix product, and the results are
+cached per folder in hashes2.sqlite (next to the thumbnails), keyed by path,
+size and mtime.
+
+The distance of a pair is the larger of its pHash and dHash Hamming
+distances; pairs with equal digests are byte-identical. Both hashes only see
+grayscale structure, so two flat images of different colour or brightness
+are 0 bits apart. A pair is only safe to record as a tie when its bytes are
+identical or its colour signatures also agree within COLOUR_TOLERANCE.
+"""
+import io
+import hashlib
+
+import numpy as np
+
+from thumbnail_store import map_cached, read_source
+
+
+# Images per worker task
+BATCH_SIZE = 128
+
+HASH_SIZE = 8
+PHASH_SIZE = 32
+COLOUR_SIZE = 4
+# Largest difference of any colour signature channel (0-255) in a tie
+COLOUR_TOLERANCE = 12
+# hashes.sqlite held no colour signature
+CACHE_FILE = "hashes2.sqlite"
+
+
+def _dct_matrix(n):
+    k = np.arange(n)
+    matrix = np.cos(np.pi * (2 * k[None, :] + 1) * k[:, None] / (2 * n)) * np.sqrt(2 / n)
+    matrix[0] /= np.sqrt(2)
+    return matrix.astype(np.float32)
+
+
+_DCT = _dct_matrix(PHASH_SIZE)
+
+
+def _pack(bits):
+    """
+    Rows of 64 booleans -> Python ints.
+    """
+    packed = np.packbits(bits.astype(np.uint8), axis=1)
+    return [int(v) for v in packed.view(">u8")[:, 0]]
+
+
+def phash_batch(pixels):
+    """
+    pHashes of a (n, 32, 32) float32 array of grayscale images.
+    """
+    coefficients = _DCT @ pixels @ _DCT.T
+    low = coefficients[:, :HASH_SIZE, :HASH_SIZE].reshape(len(pixels), -1)
+    return _pack(low > np.median(low, axis=1)[:, None])
+
+
+def dhash_batch(pixels):
+    """
+    dHashes of a (n, 8, 9) array of grayscale images.
+    """
+    return _pack((pixels[:, :, 1:] > pixels[:, :, :-1]).reshape(len(pixels), -1))
+
+
+def _hash_batch(jobs):
+    """
+    Worker: hash a batch of (path, archive path or None) jobs. Returns
+    [(phash, dhash, digest, colour) or None] in job order.
+    """
+    from PIL import Image
+
+    results = [None] * len(jobs)
+    small, tiny, colours, ok = [], [], [], []
+    for i, (path, archive_path) in enumerate(jobs):
+        try:
+            data = read_source(path, archive_path)
+            with Image.open(io.BytesIO(data)) as im:
+                # JPEGs decode at reduced resolution
+                im.draft("RGB", (4 * PHASH_SIZE, 4 * PHASH_SIZE))
+                rgb = im.convert("RGB")
+                gray = rgb.convert("L")
+                small.append(np.asarray(gray.resize((PHASH_SIZE, PHASH_SIZE), Image.LANCZOS), dtype=np.float32))
+                tiny.append(np.asarray(gray.resize((HASH_SIZE + 1, HASH_SIZE), Image.LANCZOS), dtype=np.int16))
+                colour = rgb.resize((COLOUR_SIZE, COLOUR_SIZE), Image.BOX)
+            ok.append((i, hashlib.blake2b(data, digest_size=16).hexdigest(), list(colour.tobytes())))
+        except Exception as e:
+            print(f"Failed to hash image: {path}, Error: {e}")
+    if ok:
+        phashes = phash_batch(np.stack(small))
+        dhashes = dhash_batch(np.stack(tiny))
+        for (i, digest, colour), ph, dh in zip(ok, phashes, dhashes):
+            results[i] = (ph, dh, digest, colour)
+    return results
+
+
+def hash_images(index, names, thumbnail_dir=None, workers=None):
+    """
+    Return { lowercase name: [phash, dhash, digest, colour] } for names in an
+    image source, hashing the images that are not cached yet. Images that
+    cannot be read are left out.
+    """
+    return map_cached(index, names, CACHE_FILE, _hash_batch, thumbnail_dir, workers, BATCH_SIZE)
+
+
+def hamming(a, b):
+    """
+    Element-wise Hamming distances of two uint64 arrays.
+    """
+    return np.unpackbits((a ^ b).view(np.uint8).reshape(len(a), 8), axis=1).sum(axis=1)
+
+
+def find_similar_pairs(index_a, index_b, names, threshold=6, thumbnail_dir=None, workers=None):
+    """
+    Return [(lowercase name, distance, identical, tie)] for the pairs whose
+    two images are at most threshold bits apart, in the order of names. tie
+    is True for the pairs that are safe to record as no preference: identical
+    bytes, or colour signatures within COLOUR_TOLERANCE.
+    """
+    names = list(names)
+    hashes_a = hash_images(index_a, names, thumbnail_dir, workers)
+    hashes_b = hash_images(index_b, names, thumbnail_dir, workers)
+    both = [name for name in names if name in hashes_a and name in hashes_b]
+    if not both:
+        return []
+
+    def column(hashes, i):
+        return np.fromiter((hashes[name][i] for name in both), dtype=np.uint64, count=len(both))
+
+    distance = np.maximum(
+        hamming(column(hashes_a, 0), column(hashes_b, 0)),
+        hamming(column(hashes_a, 1), column(hashes_b, 1)),
+    )
+    similar = []
+    for i in np.flatnonzero(distance <= threshold):
+        name = both[i]
+        identical = hashes_a[name][2] == hashes_b[name][2]
+        colour = np.abs(np.subtract(hashes_a[name][3], hashes_b[name][3])).max()
+        similar.append((name, int(distance[i]), identical, bool(identical or colour <= COLOUR_TOLERANCE)))
+    return similar
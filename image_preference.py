@@ -1,6 +1,11 @@
 import sys
 import os
 import json
+import getpass
+import shutil
+import time
+import argparse
+import tempfile
 from PyQt5.QtWidgets import (
     QApplication,
     QWidget,
@@ -15,22 +20,73 @@ from PyQt5.QtWidgets import (
     QFormLayout,
     QDialog,
     QDialogButtonBox,
+    QSizePolicy,
+    QShortcut,
 )
-from PyQt5.QtGui import QPixmap
-from PyQt5.QtCore import Qt
+from PyQt5.QtGui import QPixmap, QKeySequence, QFont
+from PyQt5.QtCore import Qt, QTimer, QFileSystemWatcher
+
+from archive_source import open_image_source
+from prefetch import PrefetchEngine, decode_image
+from image_cache import ImageCache
+from thumbnail_store import ThumbnailStore
+from zoom_view import TileSource, ZoomWindow
+from annotation_store import open_annotation_log
+from annotation_core import (
+    find_pairs,
+    read_annotations,
+    normalize_annotations,
+    read_pair_prompts,
+)
+from pair_index import PairIndex, parse_ranges, format_ranges, in_ranges
+from pairing import PAIR_KEYS, PairingRule, keyed_source, pair_order, pairing_report, format_pairing_report
+from image_check import check_pairs
+from session_snapshot import (
+    DEFAULT_SESSION_PATH,
+    file_fingerprint,
+    load_session,
+    restore_source,
+    save_session,
+    source_state,
+)
+from pair_scheduler import SCHEDULES, ScheduledView, make_scheduler, prompt_cluster
+from latency import recorder, timed, MetricsServer, SessionProfiler
+from annotation_client import AnnotationClient, ServerError
+
+
+# Initial size of each image display area in pixels (width, height)
+DISPLAY_SIZE = (400, 400)
+# Smallest display size, and the step the display size is rounded down to when
+# the window is resized (keeps cache and thumbnail sizes to a few values)
+MIN_DISPLAY_SIZE = (200, 200)
+DISPLAY_STEP = 100
+# Server mode: pairs leased per request, and how few leased pairs ahead trigger a refill
+REMOTE_BATCH = 8
+REMOTE_LOW_WATER = 3
+# File dialog filter for annotations: JSON files or SQLite annotation stores
+ANNOTATION_FILTER = "Annotations (*.json *.sqlite *.sqlite3 *.db);;JSON Files (*.json);;All Files (*)"
 
 
 class RangeDialog(QDialog):
-    def __init__(self, parent=None):
+    def __init__(self, parent=None, unnumbered=()):
         super().__init__(parent)
         self.setWindowTitle("Set Annotation Range")
 
         self.start_input = QLineEdit()
         self.end_input = QLineEdit()
+        self.ranges_input = QLineEdit()
+        self.ranges_input.setPlaceholderText("e.g. 0-999,5000-5999 (overrides start/end; all empty: every pair)")
 
         form_layout = QFormLayout()
         form_layout.addRow("Start Index:", self.start_input)
         form_layout.addRow("End Index:", self.end_input)
+        form_layout.addRow("Or Ranges:", self.ranges_input)
+        if unnumbered:
+            # Ranges select by numeric id, which these pairs do not have
+            note = QLabel(f"{len(unnumbered)} pairs have no numeric id (e.g. {unnumbered[0]}) and are only "
+                          "included when all fields are left empty.")
+            note.setWordWrap(True)
+            form_layout.addRow(note)
 
         self.buttons = QDialogButtonBox(
             QDialogButtonBox.Ok | QDialogButtonBox.Cancel, parent=self
@@ -44,11 +100,16 @@ class RangeDialog(QDialog):
         self.setLayout(layout)
 
     def get_values(self):
-        return self.start_input.text(), self.end_input.text()
+        return self.start_input.text(), self.end_input.text(), self.ranges_input.text()
 
 
 class ImageComparer(QWidget):
-    def __init__(self):
+    def __init__(self, prefetch_ahead=4, prefetch_behind=2, prefetch_workers=2, cache_mb=256,
+                 thumbnails=True, thumbnail_dir=None, recursive=False, scan_workers=1, watch=False,
+                 hud=False, metrics_file=None, metrics_port=None, profile=None, server=None, annotator=None,
+                 schedule="sequential", target_ci=None, dedupe=None, dedupe_threshold=6,
+                 preflight=False, preflight_report=None, pair_key="name", pair_key_b=None, session=None,
+                 tile_cache_mb=128):
         super().__init__()
         self.setWindowTitle("Image Comparer")
 
@@ -56,28 +117,141 @@ class ImageComparer(QWidget):
         self.folder_a = ""
         self.folder_b = ""
 
-        # List of image filenames (lowercase for matching)
+        # Cached folder listings: { folder_path: FolderIndex }
+        self.folder_indexes = {}
+        self.recursive = recursive
+        self.scan_workers = scan_workers
+        # How files of Folder A and Folder B are matched into pairs (see pairing.py)
+        self.pair_rule_a = PairingRule(pair_key)
+        self.pair_rule_b = PairingRule(pair_key_b or pair_key)
+
+        # Picks up images written into the folders while annotating
+        self.watcher = None
+        if watch:
+            self.watcher = QFileSystemWatcher(self)
+            self.watch_timer = QTimer(self)
+            self.watch_timer.setSingleShot(True)
+            self.watch_timer.setInterval(500)
+            self.watcher.directoryChanged.connect(lambda _: self.watch_timer.start())
+            self.watch_timer.timeout.connect(self.pick_up_new_images)
+
+        # Sorted numeric ids of all pairs, built when both folders are selected
+        self.pair_index = None
+
+        # Image filenames in the selected range (lowercase for matching): a PairView
         self.image_names = []
 
         # Current index in the image list
         self.current_index = 0
 
+        # Order of the pairs: "sequential" (id order) or a pair_scheduler
+        # schedule, which wraps image_names in a ScheduledView
+        self.schedule = schedule
+        self.scheduler = None
+        # Half-width of the win-rate interval at which to tell the annotator
+        self.target_ci = target_ci
+        self.target_reached = False
+
+        # Integrity check of the pairs before annotating; bad pairs are left out
+        self.preflight = preflight
+        self.preflight_report = preflight_report
+        # Lowercase names of the pairs it left out
+        self.excluded = set()
+
+        # Perceptual-hash pre-pass: None, "tie" (record near-identical pairs
+        # as no preference) or "flag" (mark them while annotating)
+        self.dedupe = dedupe
+        self.dedupe_threshold = dedupe_threshold
+        # { lowercase name: (hash distance, byte-identical) } of flagged pairs
+        self.similar_pairs = {}
+
         # Annotations: { "image1.png": "A", "image2.png": "T", ... }
         self.annotations = {}
 
         # Path to the annotations JSON file
         self.annotations_file = ""
 
-        # Prompts: { "image1.png": "Prompt text...", ... }
+        # Append-only journal next to annotations_file (or the SQLite store
+        # itself), written on every click
+        self.journal = None
+        self.annotator = annotator or getpass.getuser()
+
+        # Prompts: { "image1.png": "Prompt text...", ... }, only for images in image_names
         self.prompts = {}
 
+        # Prompt file, re-read for the new images when the range changes
+        self.prompts_file = ""
+
+        # Session snapshot to resume from and save to (see session_snapshot.py), or None
+        self.session_path = session
+
         # Selected range
         self.range_set = False
         self.start_index = None
         self.end_index = None
+        # Inclusive (start, end) ranges, e.g. [(0, 999), (5000, 5999)]
+        self.ranges = None
+
+        # Display-resolution images, bounded by a memory budget
+        self.image_cache = ImageCache(max_bytes=cache_mb * 1024 * 1024)
+
+        # Display-size copies on disk, shared between sessions
+        self.thumbnail_store = ThumbnailStore(thumbnail_dir) if thumbnails else None
+        self.thumbnail_dir = thumbnail_dir
+
+        # Tiles of the zoom window, built next to the thumbnails (or in a scratch
+        # directory without a thumbnail store) and cached up to tile_cache_mb
+        tile_store = self.thumbnail_store
+        if tile_store is None:
+            tile_store = ThumbnailStore(os.path.join(tempfile.gettempdir(), "image_comparer_tiles"))
+        self.tile_source = TileSource(tile_store, max_bytes=tile_cache_mb * 1024 * 1024, parent=self)
+        self.zoom_window = None
+
+        # Background decoding of the pairs around the current one
+        self.prefetcher = PrefetchEngine(
+            lookahead=prefetch_ahead,
+            lookbehind=prefetch_behind,
+            workers=prefetch_workers,
+            size=DISPLAY_SIZE,
+            cache=self.image_cache,
+            thumbnails=self.thumbnail_store,
+            parent=self,
+        )
+
+        # Latency of the annotation loop, exported on exit and/or on localhost
+        self.latency = recorder
+        self.metrics_file = metrics_file
+        self.metrics_server = None
+        if metrics_port is not None:
+            try:
+                self.metrics_server = MetricsServer(recorder, metrics_port)
+                print(f"Serving metrics on http://127.0.0.1:{self.metrics_server.port}/metrics")
+            except OSError as e:
+                # Optional; e.g. the port is taken by another annotator's session
+                print(f"Not serving metrics: cannot listen on port {metrics_port}: {e}")
+
+        # cProfile + tracemalloc for the whole session, reported on exit
+        self.profiler = None
+        if profile:
+            self.profiler = SessionProfiler(profile)
+            self.profiler.start()
 
         # Initialize UI components
         self.init_ui()
+        self.hud.setVisible(hud)
+
+        # Server mode: pairs are leased from annotation_server.py and downloaded
+        # pre-scaled into a scratch Folder A/B, votes are sent back
+        self.remote = None
+        self.remote_dir = None
+        # { lowercase name: lease id } of downloaded pairs not voted on yet
+        self.leases = {}
+        if server:
+            self.remote = AnnotationClient(server, self.annotator)
+            for button in (self.btn_select_a, self.btn_select_b, self.btn_set_range, self.btn_rescan,
+                           self.btn_load_annotations, self.btn_load_prompts):
+                button.setEnabled(False)
+            QTimer.singleShot(0, self.start_remote)
 
     def init_ui(self):
         # Main layout
@@ -95,7 +269,10 @@ class ImageComparer(QWidget):
         range_layout = QHBoxLayout()
         self.btn_set_range = QPushButton("Set Annotation Range")
         self.btn_set_range.setEnabled(False)  # Enabled after folders are selected
+        self.btn_rescan = QPushButton("Rescan Folders")
+        self.btn_rescan.setEnabled(False)  # Enabled after folders are selected
         range_layout.addWidget(self.btn_set_range)
+        range_layout.addWidget(self.btn_rescan)
         main_layout.addLayout(range_layout)
 
         # Image display labels
@@ -104,9 +281,20 @@ class ImageComparer(QWidget):
         self.label_b = QLabel("Folder B Image")
         self.label_a.setAlignment(Qt.AlignCenter)
         self.label_b.setAlignment(Qt.AlignCenter)
+        # Let the labels follow the window size instead of the pixmap size
+        for label in (self.label_a, self.label_b):
+            label.setSizePolicy(QSizePolicy.Ignored, QSizePolicy.Ignored)
+            label.setMinimumSize(*MIN_DISPLAY_SIZE)
         images_layout.addWidget(self.label_a)
         images_layout.addWidget(self.label_b)
-        main_layout.addLayout(images_layout)
+        main_layout.addLayout(images_layout, 1)
+
+        # Shown on pairs flagged as near-identical by the hash pre-pass
+        self.label_similar = QLabel()
+        self.label_similar.setAlignment(Qt.AlignCenter)
+        self.label_similar.setStyleSheet("color: #b36b00; font-weight: bold;")
+        self.label_similar.setVisible(False)
+        main_layout.addWidget(self.label_similar)
 
         # Prompt display
         self.label_prompt = QLabel("Prompt:")
@@ -136,13 +324,16 @@ class ImageComparer(QWidget):
         # Navigation buttons layout
         navigation_layout = QHBoxLayout()
         self.btn_previous = QPushButton("Previous")
+        self.btn_zoom = QPushButton("Zoom")
         self.btn_next = QPushButton("Next")
 
         # Initially disable navigation buttons
         self.btn_previous.setEnabled(False)
+        self.btn_zoom.setEnabled(False)
         self.btn_next.setEnabled(False)
 
         navigation_layout.addWidget(self.btn_previous)
+        navigation_layout.addWidget(self.btn_zoom)
         navigation_layout.addWidget(self.btn_next)
         main_layout.addLayout(navigation_layout)
 
@@ -155,11 +346,31 @@ class ImageComparer(QWidget):
         main_layout.addLayout(load_buttons_layout)
 
         self.setLayout(main_layout)
+        self.resize(2 * DISPLAY_SIZE[0] + 50, DISPLAY_SIZE[1] + 350)
+
+        # Recompute the display size once resizing settles
+        self.resize_timer = QTimer(self)
+        self.resize_timer.setSingleShot(True)
+        self.resize_timer.setInterval(150)
+        self.resize_timer.timeout.connect(self.update_display_size)
+
+        # Latency overlay, toggled with F3
+        self.hud = QLabel(self)
+        self.hud.setFont(QFont("monospace", 8))
+        self.hud.setStyleSheet("background-color: rgba(0, 0, 0, 160); color: white; padding: 4px;")
+        self.hud.setAttribute(Qt.WA_TransparentForMouseEvents)
+        self.hud_timer = QTimer(self)
+        self.hud_timer.setInterval(1000)
+        self.hud_timer.timeout.connect(self.update_hud)
+        self.hud_timer.start()
+        QShortcut(QKeySequence(Qt.Key_F3), self, self.toggle_hud)
+        QShortcut(QKeySequence(Qt.Key_Z), self, self.open_zoom)
 
         # Connect signals to slots
         self.btn_select_a.clicked.connect(self.select_folder_a)
         self.btn_select_b.clicked.connect(self.select_folder_b)
         self.btn_set_range.clicked.connect(self.set_range)
+        self.btn_rescan.clicked.connect(self.rescan_folders)
         self.btn_choose_a.clicked.connect(lambda: self.record_preference("A"))
         self.btn_choose_b.clicked.connect(lambda: self.record_preference("B"))
         self.btn_no_preference.clicked.connect(lambda: self.record_preference("T"))
@@ -167,6 +378,7 @@ class ImageComparer(QWidget):
         self.btn_load_prompts.clicked.connect(self.load_prompts)
         self.btn_previous.clicked.connect(self.go_previous)
         self.btn_next.clicked.connect(self.go_next)
+        self.btn_zoom.clicked.connect(self.open_zoom)
 
     def select_folder_a(self):
         folder = QFileDialog.getExistingDirectory(self, "Select Folder A")
@@ -175,6 +387,151 @@ class ImageComparer(QWidget):
             self.btn_select_a.setText(os.path.basename(folder))
             self.check_folders_selected()
 
+    def open_folders(self, folder_a, folder_b):
+        """
+        Select both image sources at once, e.g. archives given on the command line.
+        """
+        self.folder_a = folder_a
+        self.folder_b = folder_b
+        self.btn_select_a.setText(os.path.basename(folder_a))
+        self.btn_select_b.setText(os.path.basename(folder_b))
+        self.check_folders_selected()
+
+    def resume_session(self, folder_a=None, folder_b=None):
+        """
+        Restore the session in the snapshot (folders, range, pair list,
+        prompts, annotations and current pair) without any dialog. Folder
+        listings are reused unless their fingerprint changed, and the pairs
+        are rebuilt if --pair-key, --pair-key-b or --recursive differ from
+        the snapshot's. Returns False if there is no usable snapshot, or it
+        is for other folders than the given ones.
+        """
+        if not self.session_path or self.remote is not None:
+            return False
+        session = load_session(self.session_path)
+        if session is None:
+            return False
+        if folder_a and folder_b and (folder_a, folder_b) != (session.get("folder_a"), session.get("folder_b")):
+            return False
+
+        started = time.perf_counter()
+        try:
+            # The command line wins; pairs made with other settings are rebuilt
+            same_rules = (session["pair_key"], session["pair_key_b"], session["recursive"]) == (
+                self.pair_rule_a.spec, self.pair_rule_b.spec, self.recursive)
+            if not same_rules:
+                print("Pairing settings changed since the session was saved; pairing the folders again")
+            index_a, fresh_a = restore_source(session["source_a"], self.recursive, self.scan_workers)
+            index_b, fresh_b = restore_source(session["source_b"], self.recursive, self.scan_workers)
+            ranges = [tuple(r) for r in session["ranges"]] if session["ranges"] else None
+            prompts_file = session.get("prompts_file") or ""
+            annotations_file = session.get("annotations_file") or ""
+            try:
+                annotations = read_annotations(annotations_file) if annotations_file else {}
+            except FileNotFoundError:
+                annotations = {}
+        except (OSError, ValueError, KeyError, TypeError) as e:
+            print(f"Could not resume the session from {self.session_path}: {e}")
+            return False
+
+        self.folder_a = session["folder_a"]
+        self.folder_b = session["folder_b"]
+        self.btn_select_a.setText(os.path.basename(self.folder_a))
+        self.btn_select_b.setText(os.path.basename(self.folder_b))
+        self.folder_indexes = {}
+        index_a = self.set_folder_index(self.folder_a, index_a)
+        index_b = self.set_folder_index(self.folder_b, index_b)
+        fresh = fresh_a and fresh_b and same_rules
+        if fresh:
+            self.pair_index = PairIndex.from_state(session["pairs"], index_a)
+        else:
+            self.pair_index = PairIndex(find_pairs(index_a, index_b), index_a)
+        self.ranges = ranges
+        self.start_index = ranges[0][0] if ranges else None
+        self.end_index = ranges[-1][1] if ranges else None
+        self.range_set = True
+        self.image_names = self.pair_index.select(ranges)
+        self.scheduler = None
+        self.watch_folders()
+
+        # The saved prompts are still those of the selected pairs unless a file changed
+        self.prompts_file = prompts_file
+        self.prompts = {}
+        if prompts_file:
+            if fresh and file_fingerprint(prompts_file) == session.get("prompts_fingerprint"):
+                self.prompts = session.get("prompts") or {}
+            else:
+                try:
+                    self.read_prompts(prompts_file)
+                except Exception as e:
+                    print(f"Failed to load prompts: {e}")
+
+        self.annotations = normalize_annotations(annotations, index_a)
+        self.annotations_file = annotations_file
+        self.set_journal(open_annotation_log(annotations_file, self.annotator) if annotations_file else None)
+        self.image_names.hide(index_a.key_of(key) for key in self.annotations)
+        if fresh:
+            self.excluded = set(session.get("excluded") or ())
+            self.image_names.hide(self.excluded)
+            self.similar_pairs = {name: tuple(value) for name, value in (session.get("similar_pairs") or {}).items()}
+        else:
+            # New or changed files: check and hash them like a new session would
+            self.preflight_pairs()
+            self.dedupe_pairs()
+        self.prefetcher.reset()
+
+        self.btn_set_range.setEnabled(False)
+        self.btn_rescan.setEnabled(True)
+        if not self.image_names:
+            QMessageBox.information(self, "All Annotated", "All image pairs have been annotated.")
+            return True
+        self.btn_choose_a.setEnabled(True)
+        self.btn_no_preference.setEnabled(True)
+        self.btn_choose_b.setEnabled(True)
+        self.apply_schedule()
+        self.current_index = 0
+        if self.scheduler is None and session.get("current"):
+            # The pair on screen when the session was saved, unless it is annotated now
+            self.current_index = self.image_names.index(session["current"]) or 0
+        self.show_image_pair()
+        print(f"Resumed the session from {self.session_path} in {time.perf_counter() - started:.3f}s "
+              f"({len(self.image_names)} pairs, {len(self.annotations)} annotations)")
+        return True
+
+    def save_session(self):
+        """
+        Write the session snapshot that resume_session() restores. Only once
+        a range is set, and not in server mode.
+        """
+        if not self.session_path or self.remote is not None or not self.range_set or self.pair_index is None:
+            return
+        current = None
+        if 0 <= self.current_index < len(self.image_names):
+            current = self.image_names[self.current_index]
+        session = {
+            "folder_a": self.folder_a,
+            "folder_b": self.folder_b,
+            "recursive": self.recursive,
+            "pair_key": self.pair_rule_a.spec,
+            "pair_key_b": self.pair_rule_b.spec,
+            "source_a": source_state(self.get_folder_index(self.folder_a)),
+            "source_b": source_state(self.get_folder_index(self.folder_b)),
+            "pairs": self.pair_index.state(),
+            "ranges": self.ranges,
+            "excluded": sorted(self.excluded),
+            "similar_pairs": self.similar_pairs,
+            "current": current,
+            "prompts_file": self.prompts_file,
+            "prompts_fingerprint": file_fingerprint(self.prompts_file) if self.prompts_file else None,
+            "prompts": self.prompts,
+            "annotations_file": self.annotations_file,
+        }
+        try:
+            with self.latency.time("save_session"):
+                save_session(self.session_path, session)
+        except OSError as e:
+            print(f"Failed to save the session snapshot: {e}")
+
     def select_folder_b(self):
         folder = QFileDialog.getExistingDirectory(self, "Select Folder B")
         if folder:
@@ -184,50 +541,204 @@ class ImageComparer(QWidget):
 
     def check_folders_selected(self):
         if self.folder_a and self.folder_b:
-            # Get image files from both folders (case-insensitive)
-            a_images = set(
-                f.lower()
-                for f in os.listdir(self.folder_a)
-                if f.lower().endswith((".png", ".jpg", ".jpeg", ".bmp", ".gif", ".tiff", ".webp"))
-            )
-            b_images = set(
-                f.lower()
-                for f in os.listdir(self.folder_b)
-                if f.lower().endswith((".png", ".jpg", ".jpeg", ".bmp", ".gif", ".tiff", ".webp"))
-            )
+            # Get image files from both folders (case-insensitive), one scan per folder
+            try:
+                index_a = self.get_folder_index(self.folder_a)
+                index_b = self.get_folder_index(self.folder_b)
+            except (OSError, ValueError) as e:
+                QMessageBox.critical(
+                    self,
+                    "Error",
+                    f"Failed to read the image folders: {e}",
+                )
+                return
 
-            # Find common images (case-insensitive)
-            common_images_lower = a_images.intersection(b_images)
+            # Find common images (case-insensitive, by the pairing rules' join keys)
+            common_images_lower = find_pairs(index_a, index_b)
 
+            report = format_pairing_report(pairing_report(index_a, index_b, common_images_lower))
+            for line in report:
+                print(line)
             if not common_images_lower:
                 QMessageBox.warning(
                     self,
                     "No Matching Images",
-                    "There are no common image files in the selected folders.",
+                    "There are no common image files in the selected folders.\n\n" + "\n".join(report[1:]),
                 )
                 return
 
-            # Map lowercase filenames to actual filenames to preserve original casing
-            a_mapping = {f.lower(): f for f in os.listdir(self.folder_a) if f.lower() in common_images_lower}
-            b_mapping = {f.lower(): f for f in os.listdir(self.folder_b) if f.lower() in common_images_lower}
-
-            # Assuming filenames are identical in both folders except for case
-            self.image_names = sorted(a_mapping.keys(), key=lambda x: int(os.path.splitext(a_mapping[x])[0]))
+            self.pair_index = PairIndex(common_images_lower, index_a)
+            self.image_names = self.pair_index.select()
+            self.watch_folders()
 
             # Enable range selection
             self.btn_set_range.setEnabled(True)
+            self.btn_rescan.setEnabled(True)
+
+    def get_folder_index(self, folder):
+        index = self.folder_indexes.get(folder)
+        if index is None:
+            # A plain folder, or a tar/zip archive or directory of shards read in place
+            index = self.set_folder_index(folder, open_image_source(folder, self.recursive, self.scan_workers))
+        return index
+
+    def set_folder_index(self, folder, index):
+        # Seen through its side's pairing rule, so by_lower maps join keys;
+        # server mode saves both sides under the Folder A name
+        if self.remote is None:
+            rule = self.pair_rule_b if folder == self.folder_b and folder != self.folder_a else self.pair_rule_a
+            index = keyed_source(index, rule)
+        self.folder_indexes[folder] = index
+        return index
+
+    def watch_folders(self):
+        if self.watcher is None:
+            return
+        directories = []
+        for folder in (self.folder_a, self.folder_b):
+            if folder:
+                directories.extend(self.get_folder_index(folder).directories())
+        watched = set(self.watcher.directories())
+        new_directories = [d for d in directories if d not in watched]
+        if new_directories:
+            self.watcher.addPaths(new_directories)
+
+    def pick_up_new_images(self):
+        """
+        Add pairs whose files appeared in both folders since the last scan,
+        listing only the directories that changed.
+        """
+        if self.pair_index is None:
+            return
+        index_a = self.get_folder_index(self.folder_a)
+        index_b = self.get_folder_index(self.folder_b)
+        index_a.update()
+        index_b.update()
+
+        # A pair is complete once the file exists in both folders
+        candidates = set(index_a.take_added()) | set(index_b.take_added())
+        new_pairs = []
+        for img_lower in candidates:
+            if img_lower in index_a and img_lower in index_b and self.pair_index.add(img_lower):
+                image_id = self.pair_index.image_id(img_lower)
+                # Pairs without an id are only in the session when no range is set
+                if self.ranges is None or (image_id is not None and in_ranges(image_id, self.ranges)):
+                    new_pairs.append(img_lower)
+        self.watch_folders()
+        if not new_pairs:
+            return
+
+        new_names = sorted(new_pairs, key=lambda name: pair_order(name, index_a.by_lower.get(name, name)))
+        self.image_names.extend(new_names)
+        annotated = {index_a.key_of(key) for key in self.annotations}
+        self.image_names.hide(name for name in new_names if name in annotated)
+        print(f"Added {len(new_names)} new image pairs.")
+
+        if self.btn_choose_a.isEnabled():
+            self.btn_next.setEnabled(self.current_index < len(self.image_names) - 1)
+            self.update_title()
+
+    def start_remote(self):
+        self.remote_dir = tempfile.mkdtemp(prefix="image_comparer_")
+        self.folder_a = os.path.join(self.remote_dir, "A")
+        self.folder_b = os.path.join(self.remote_dir, "B")
+        os.makedirs(self.folder_a)
+        os.makedirs(self.folder_b)
+        try:
+            fetched = self.fetch_remote_pairs()
+        except (OSError, ServerError) as e:
+            QMessageBox.critical(self, "Error", f"Failed to reach the annotation server: {e}")
+            return
+        if not fetched:
+            QMessageBox.information(self, "All Annotated", "The server has no image pairs left to annotate.")
+            return
+
+        self.check_folders_selected()
+        self.btn_set_range.setEnabled(False)
+        self.btn_rescan.setEnabled(False)
+        # Everything the server hands out is in range
+        self.range_set = True
+        self.btn_choose_a.setEnabled(True)
+        self.btn_no_preference.setEnabled(True)
+        self.btn_choose_b.setEnabled(True)
+        self.current_index = 0
+        self.show_image_pair()
+
+    def fetch_remote_pairs(self):
+        """
+        Lease a batch of pairs and download both images at the display size.
+        Returns the number of pairs fetched.
+        """
+        width, height = self.prefetcher.size
+        leases = self.remote.lease(REMOTE_BATCH, width, height)
+        for lease in leases:
+            name = lease["image"]
+            for folder, url in ((self.folder_a, lease["a"]), (self.folder_b, lease["b"])):
+                path = os.path.join(folder, name)
+                os.makedirs(os.path.dirname(path), exist_ok=True)
+                with open(path, "wb") as f:
+                    f.write(self.remote.fetch(url))
+            self.leases[name.lower()] = lease["lease"]
+            if lease.get("prompt"):
+                self.prompts[name] = lease["prompt"]
+        return len(leases)
+
+    def send_remote_vote(self, image_key, preference):
+        lease = self.leases.pop(image_key, None)
+        if lease is None:
+            # A changed vote on a pair already sent is kept locally only
+            return
+        try:
+            self.remote.vote(lease, preference)
+        except (OSError, ServerError) as e:
+            print(f"Vote for {image_key} was not accepted by the server: {e}")
+
+        # Keep a few leased pairs ahead of the current one
+        if len(self.image_names) - self.current_index - 1 < REMOTE_LOW_WATER:
+            try:
+                if self.fetch_remote_pairs():
+                    self.pick_up_new_images()
+            except (OSError, ServerError) as e:
+                print(f"Failed to lease more pairs: {e}")
+
+    def rescan_folders(self):
+        timings = []
+        for folder in (self.folder_a, self.folder_b):
+            if not folder:
+                continue
+            index = self.get_folder_index(folder)
+            index.refresh()
+            timings.append(f"{os.path.basename(folder)}: {len(index)} images in {index.scan_seconds:.3f}s")
+
+        # Rebuild the pair list only while the range has not been applied yet
+        if not self.range_set:
+            self.check_folders_selected()
+
+        QMessageBox.information(
+            self,
+            "Folders Rescanned",
+            "\n".join(timings),
+        )
 
     def set_range(self):
-        dialog = RangeDialog(self)
+        dialog = RangeDialog(self, self.pair_index.unnumbered if self.pair_index is not None else ())
         if dialog.exec_() == QDialog.Accepted:
-            start_text, end_text = dialog.get_values()
+            start_text, end_text, ranges_text = dialog.get_values()
             try:
-                start = int(start_text)
-                end = int(end_text)
-                if start > end:
-                    raise ValueError("Start index cannot be greater than end index.")
-                self.start_index = start
-                self.end_index = end
+                if not (start_text.strip() or end_text.strip() or ranges_text.strip()):
+                    # Every pair, including those without a numeric id
+                    ranges = None
+                elif ranges_text.strip():
+                    ranges = parse_ranges(ranges_text)
+                else:
+                    start = int(start_text)
+                    end = int(end_text)
+                    if start > end:
+                        raise ValueError("Start index cannot be greater than end index.")
+                    ranges = [(start, end)]
+                self.ranges = ranges
+                self.start_index = ranges[0][0] if ranges else None
+                self.end_index = ranges[-1][1] if ranges else None
                 self.range_set = True
                 self.filter_images_by_range()
             except ValueError as ve:
@@ -238,25 +749,23 @@ class ImageComparer(QWidget):
                 )
 
     def filter_images_by_range(self):
-        # Filter image_names based on the selected range
-        filtered_image_names = []
-        for img_lower in self.image_names:
-            img_num_str = os.path.splitext(os.path.basename(self.get_actual_filename(self.folder_a, img_lower)))[0]
-            try:
-                img_num = int(img_num_str)
-                if self.start_index <= img_num <= self.end_index:
-                    filtered_image_names.append(img_lower)
-            except ValueError:
-                # Skip files that do not start with a number
-                continue
+        # Select image_names by bisecting the sorted numeric ids
+        self.image_names = self.pair_index.select(self.ranges)
+        self.scheduler = None
+        self.prefetcher.reset()
 
-        self.image_names = sorted(filtered_image_names, key=lambda x: int(os.path.splitext(self.get_actual_filename(self.folder_a, x))[0]))
+        # Keep only the prompts of the images in range
+        if self.prompts_file:
+            try:
+                self.read_prompts(self.prompts_file)
+            except Exception as e:
+                print(f"Failed to load prompts: {e}")
 
         if not self.image_names:
             QMessageBox.warning(
                 self,
                 "No Images in Range",
-                f"No images found in the range {self.start_index}-{self.end_index}.",
+                f"No images found in the range {format_ranges(self.ranges)}." if self.ranges else "No image pairs found.",
             )
             return
 
@@ -277,6 +786,7 @@ class ImageComparer(QWidget):
             # Initialize annotations as empty
             self.annotations = {}
             self.annotations_file = ""
+            self.set_journal(None)
             # Enable choice and navigation buttons
             self.btn_choose_a.setEnabled(True)
             self.btn_no_preference.setEnabled(True)
@@ -284,8 +794,12 @@ class ImageComparer(QWidget):
             self.btn_next.setEnabled(True)
             self.btn_previous.setEnabled(False)
             # Show the first image pair
+            self.preflight_pairs()
+            self.dedupe_pairs()
+            self.apply_schedule()
             self.current_index = 0
             self.show_image_pair()
+            self.save_session()
 
     def load_annotations(self):
         options = QFileDialog.Options()
@@ -293,33 +807,18 @@ class ImageComparer(QWidget):
             self,
             "Load Annotations",
             "",
-            "JSON Files (*.json);;All Files (*)",
+            ANNOTATION_FILTER,
             options=options,
         )
         if file_path:
             try:
-                with open(file_path, 'r', encoding='utf-8') as f:
-                    loaded_annotations = json.load(f)
-                if not isinstance(loaded_annotations, dict):
-                    raise ValueError("Annotations file must contain a dictionary.")
-
-                # Ensure all keys and values are strings
-                for key, value in loaded_annotations.items():
-                    if not isinstance(key, str) or not isinstance(value, str):
-                        raise ValueError("All keys and values in annotations must be strings.")
-
-                # Normalize annotations to lowercase keys for matching
-                normalized_annotations = {k.lower(): v for k, v in loaded_annotations.items()}
-
-                # Update annotations by preserving original casing
-                actual_annotations = {}
-                for img_lower, pref in normalized_annotations.items():
-                    a_actual = self.get_actual_filename(self.folder_a, img_lower)
-                    b_actual = self.get_actual_filename(self.folder_b, img_lower)
-                    if a_actual and b_actual:
-                        # Ensure preference is one of "A", "B", or "T"
-                        if pref in ["A", "B", "T"]:
-                            actual_annotations[a_actual] = pref
+                # Snapshot plus any journal records a crashed session left behind
+                loaded_annotations = read_annotations(file_path)
+
+                # Match keys case-insensitively, preserving the original casing
+                actual_annotations = normalize_annotations(
+                    loaded_annotations, self.get_folder_index(self.folder_a)
+                )
 
                 self.annotations.update(actual_annotations)
                 QMessageBox.information(
@@ -327,6 +826,7 @@ class ImageComparer(QWidget):
                     "Success",
                     f"Loaded {len(actual_annotations)} annotations from {file_path}",
                 )
+                self.set_journal(open_annotation_log(file_path, self.annotator))
                 self.annotations_file = file_path
                 self.update_image_display()
             except Exception as e:
@@ -340,6 +840,7 @@ class ImageComparer(QWidget):
             if not self.annotations:
                 self.annotations = {}
                 self.annotations_file = ""
+                self.set_journal(None)
                 self.show_image_pair()
 
     def load_prompts(self):
@@ -348,31 +849,19 @@ class ImageComparer(QWidget):
             self,
             "Load Prompt File",
             "",
-            "JSON Files (*.json);;All Files (*)",
+            "Prompt Files (*.json *.jsonl);;All Files (*)",
             options=options,
         )
         if file_path:
             try:
-                with open(file_path, 'r', encoding='utf-8') as f:
-                    loaded_prompts = json.load(f)
-                if not isinstance(loaded_prompts, dict):
-                    raise ValueError("Prompt file must contain a dictionary.")
-
-                # Ensure all keys and values are strings
-                for key, value in loaded_prompts.items():
-                    if not isinstance(key, str) or not isinstance(value, str):
-                        raise ValueError("All keys and values in prompts must be strings.")
-
-                # Normalize prompts to lowercase keys for matching
-                normalized_prompts = {k.lower(): v for k, v in loaded_prompts.items()}
-
-                # Update prompts by preserving original casing
-                for img_lower, prompt in normalized_prompts.items():
-                    a_actual = self.get_actual_filename(self.folder_a, img_lower)
-                    b_actual = self.get_actual_filename(self.folder_b, img_lower)
-                    if a_actual and b_actual:
-                        self.prompts[a_actual] = prompt
-
+                self.read_prompts(file_path)
+                self.prompts_file = file_path
+                if self.scheduler is not None:
+                    # Re-cluster the pairs not shown yet by their prompts
+                    self.image_names.replan(self.current_index + 1)
+                    self.scheduler.regroup(self.stratum_of)
+                    self.prefetcher.reset()
+                self.save_session()
                 QMessageBox.information(
                     self,
                     "Success",
@@ -386,13 +875,154 @@ class ImageComparer(QWidget):
                     f"Failed to load prompts: {e}",
                 )
 
+    def read_prompts(self, file_path):
+        """
+        Load the prompts for the images in image_names only. Uses the SQLite
+        index built by prompt_store.py when it is up to date, otherwise streams
+        the file (validating every entry) and keeps just the matching prompts.
+        """
+        matched = read_pair_prompts(file_path, self.image_names, self.get_folder_index(self.folder_a))
+
+        # Key prompts by the actual filename to preserve original casing
+        self.prompts = {
+            self.get_actual_filename(self.folder_a, img_lower): prompt
+            for img_lower, prompt in matched.items()
+        }
+
+    def preflight_pairs(self):
+        """
+        Check every pair left to annotate for missing, empty, unreadable or
+        truncated images (cached next to the thumbnails) and leave the bad
+        ones out of image_names. Not used in server mode.
+        """
+        if not self.preflight or self.remote is not None or not self.image_names:
+            return
+        names = list(self.image_names)
+        print(f"Checking {len(names)} image pairs...")
+        QApplication.setOverrideCursor(Qt.WaitCursor)
+        try:
+            bad, warnings = check_pairs(
+                self.get_folder_index(self.folder_a),
+                self.get_folder_index(self.folder_b),
+                names,
+                self.thumbnail_dir,
+            )
+        finally:
+            QApplication.restoreOverrideCursor()
+        index_a = self.get_folder_index(self.folder_a)
+        excluded = [index_a.key_of(record["image"]) for record in bad]
+        self.excluded.update(excluded)
+        self.image_names.hide(excluded)
+
+        for record in bad + warnings:
+            print(f"{record['image']}: {'; '.join(record['problems'])}")
+        if self.preflight_report:
+            with open(self.preflight_report, 'w', encoding='utf-8') as f:
+                for record in bad:
+                    f.write(json.dumps({**record, "excluded": True}, ensure_ascii=False) + "\n")
+                for record in warnings:
+                    f.write(json.dumps({**record, "excluded": False}, ensure_ascii=False) + "\n")
+        summary = (f"Checked {len(names)} pairs: {len(bad)} left out as broken, "
+                   f"{len(warnings)} with A and B of different sizes.")
+        print(summary)
+        if bad or warnings:
+            details = [f"{record['image']}: {'; '.join(record['problems'])}" for record in (bad + warnings)[:10]]
+            if len(bad) + len(warnings) > 10:
+                details.append("...")
+            if self.preflight_report:
+                details.append(f"Full report: {self.preflight_report}")
+            QMessageBox.warning(self, "Pre-flight Check", summary + "\n\n" + "\n".join(details))
+
+    def dedupe_pairs(self):
+        """
+        Hash both images of every pair left to annotate (cached next to the
+        thumbnails) and record or flag the pairs whose images are identical
+        or nearly so. Not used in server mode.
+        """
+        self.similar_pairs = {}
+        if self.dedupe is None or self.remote is not None or not self.image_names:
+            return
+        try:
+            # Imported here so the annotator itself does not need NumPy
+            from image_hash import find_similar_pairs
+        except ImportError as e:
+            QMessageBox.warning(self, "Duplicate Check Skipped", f"The hash pre-pass needs NumPy: {e}")
+            return
+
+        names = list(self.image_names)
+        print(f"Hashing {len(names)} image pairs...")
+        QApplication.setOverrideCursor(Qt.WaitCursor)
+        try:
+            similar = find_similar_pairs(
+                self.get_folder_index(self.folder_a),
+                self.get_folder_index(self.folder_b),
+                names,
+                self.dedupe_threshold,
+                self.thumbnail_dir,
+            )
+        finally:
+            QApplication.restoreOverrideCursor()
+        identical = sum(1 for _, _, same, _ in similar if same)
+        found = (f"{identical} identical and {len(similar) - identical} near-identical pairs "
+                 f"(hash distance <= {self.dedupe_threshold}) among {len(names)}")
+
+        if self.dedupe == "flag":
+            self.similar_pairs = {name: (distance, same) for name, distance, same, _ in similar}
+            print(f"Flagged {found}")
+            QMessageBox.information(self, "Near-Identical Pairs", f"Flagged {found}.")
+            return
+
+        # Similar structure but different colours or brightness is left to the annotator
+        ties = [name for name, _, _, tie in similar if tie]
+        self.similar_pairs = {name: (distance, same) for name, distance, same, tie in similar if not tie}
+        journal = self.get_journal()
+        for name in ties:
+            a_actual = self.get_actual_filename(self.folder_a, name)
+            self.annotations[a_actual] = "T"
+            journal.append(a_actual, "T", "dedupe")
+        journal.sync()
+        self.image_names.hide(ties)
+        message = f"Found {found}. Recorded {len(ties)} as no preference, saving {len(ties)} clicks."
+        if self.similar_pairs:
+            message += f" {len(self.similar_pairs)} differ in colour or brightness and are flagged instead."
+        print(message)
+        QMessageBox.information(self, "Near-Identical Pairs", message)
+
+    def apply_schedule(self):
+        """
+        Wrap image_names in a ScheduledView unless pairs go in id order. Not
+        used in server mode, where the server decides the order.
+        """
+        self.scheduler = None
+        self.target_reached = False
+        if self.schedule == "sequential" or self.remote is not None:
+            return
+        view = self.image_names
+        index_a = self.get_folder_index(self.folder_a)
+        outcomes = {}
+        for key, preference in self.annotations.items():
+            img_lower = index_a.key_of(key)
+            if view.position(img_lower) is not None:
+                outcomes[img_lower] = preference
+        # Seeded by annotator, so annotators sharing a range see different orders
+        self.scheduler = make_scheduler(self.schedule, view, self.stratum_of, outcomes, seed=self.annotator)
+        self.image_names = ScheduledView(view, self.scheduler)
+        self.prefetcher.reset()
+        print(f"Scheduling {len(view)} pairs in {len(self.scheduler.strata)} prompt clusters ({self.schedule})")
+
+    def stratum_of(self, img_lower):
+        return prompt_cluster(self.prompts.get(self.get_actual_filename(self.folder_a, img_lower)))
+
     def update_image_display(self):
-        # Filter image_names to exclude already annotated images
-        annotated = set(self.annotations.keys())
-        original_image_names = self.image_names.copy()
-        self.image_names = [img for img in self.image_names if img not in annotated]
+        if self.scheduler is not None:
+            # Start over from the pairs in id order
+            self.image_names = self.image_names.view
+            self.scheduler = None
+        # Hide already annotated images (keys are matched case-insensitively)
+        index_a = self.get_folder_index(self.folder_a)
+        skipped = self.image_names.hide(index_a.key_of(key) for key in self.annotations)
+        self.prefetcher.reset()
 
-        skipped = len(original_image_names) - len(self.image_names)
         if skipped > 0:
             print(f"Skipped {skipped} already annotated images.")
 
@@ -413,9 +1043,14 @@ class ImageComparer(QWidget):
         self.btn_previous.setEnabled(False)
 
         # Show the first unannotated image pair
+        self.preflight_pairs()
+        self.dedupe_pairs()
+        self.apply_schedule()
         self.current_index = 0
         self.show_image_pair()
+        self.save_session()
 
+    @timed("show_image_pair")
     def show_image_pair(self):
         if not self.image_names:
             QMessageBox.information(
@@ -432,52 +1067,113 @@ class ImageComparer(QWidget):
 
         # Retrieve actual filenames with original casing
         a_actual = self.get_actual_filename(self.folder_a, image_key)
-        b_actual = self.get_actual_filename(self.folder_b, image_key)
+        a_image_path, b_image_path = self.pair_paths(self.current_index)
 
-        a_image_path = os.path.join(self.folder_a, a_actual)
-        b_image_path = os.path.join(self.folder_b, b_actual)
-
-        # Load and display Folder A image
+        # Load and display Folder A image (already scaled to the display size)
         pixmap_a = self.load_image(a_image_path)
         if pixmap_a:
-            self.label_a.setPixmap(pixmap_a.scaled(400, 400, Qt.KeepAspectRatio))
+            self.label_a.setPixmap(pixmap_a)
         else:
             self.label_a.setText("Failed to load image")
 
         # Load and display Folder B image
         pixmap_b = self.load_image(b_image_path)
         if pixmap_b:
-            self.label_b.setPixmap(pixmap_b.scaled(400, 400, Qt.KeepAspectRatio))
+            self.label_b.setPixmap(pixmap_b)
         else:
             self.label_b.setText("Failed to load image")
 
         # Display prompt if available
-        prompt = self.prompts.get(a_actual, "No prompt available.")
+        with self.latency.time("prompt_lookup"):
+            prompt = self.prompts.get(a_actual, "No prompt available.")
         self.text_prompt.setText(prompt)
 
+        similar = self.similar_pairs.get(image_key)
+        if similar is not None:
+            distance, identical = similar
+            self.label_similar.setText("Identical images" if identical else
+                                       f"Near-identical images (hash distance {distance})")
+        self.label_similar.setVisible(similar is not None)
+
         # Update navigation buttons
         self.btn_previous.setEnabled(self.current_index > 0)
         self.btn_next.setEnabled(self.current_index < len(self.image_names) - 1)
+        # Server mode only has display-size copies, nothing to zoom into
+        self.btn_zoom.setEnabled(self.remote is None)
+        self.update_title()
+        if self.zoom_window is not None and self.zoom_window.isVisible():
+            self.update_zoom(a_image_path, b_image_path)
+
+        # Decode the neighbouring pairs in the background
+        self.prefetcher.schedule(self.prefetcher.window(self.pair_paths, self.current_index))
+
+    def open_zoom(self):
+        """
+        Show the current pair at full resolution in the zoom window.
+        """
+        if not self.btn_zoom.isEnabled():
+            return
+        if self.zoom_window is None:
+            self.zoom_window = ZoomWindow(self.tile_source, self)
+        self.update_zoom(*self.pair_paths(self.current_index))
+        self.zoom_window.show()
+        self.zoom_window.raise_()
+        self.zoom_window.activateWindow()
+
+    def update_zoom(self, a_image_path, b_image_path):
+        # The display-size images stand in until the tiles are read
+        self.zoom_window.show_pair(a_image_path, b_image_path,
+                                   self.prefetcher.take(a_image_path), self.prefetcher.take(b_image_path))
+
+    def update_title(self):
+        title = (f"Image Comparer - {self.current_index + 1}/{len(self.image_names)} "
+                 f"({self.image_names.remaining} left to annotate)")
+        if self.scheduler is not None:
+            mean, half_width = self.scheduler.estimate()
+            title += f" - A wins {mean:.1%} \u00b1 {half_width:.1%}"
+        self.setWindowTitle(title)
+
+    def pair_paths(self, index):
+        """
+        Return the (Folder A path, Folder B path) of the pair at index, or None if out of range.
+        """
+        if index < 0 or index >= len(self.image_names):
+            return None
+        image_key = self.image_names[index]
+        a_actual = self.get_actual_filename(self.folder_a, image_key)
+        b_actual = self.get_actual_filename(self.folder_b, image_key)
+        return (
+            self.get_folder_index(self.folder_a).path_of(a_actual),
+            self.get_folder_index(self.folder_b).path_of(b_actual),
+        )
 
     def get_actual_filename(self, folder, lowercase_filename):
         """
         Given a folder and a lowercase filename, return the actual filename with original casing.
+        Uses the cached folder index instead of listing the folder on every call.
         """
-        for f in os.listdir(folder):
-            if f.lower() == lowercase_filename:
-                return f
-        return lowercase_filename  # Fallback, should not happen
+        actual = self.get_folder_index(folder).actual_name(lowercase_filename)
+        if actual is None:
+            return lowercase_filename  # Fallback, should not happen
+        return actual
 
+    @timed("load_image")
     def load_image(self, path):
         try:
-            pixmap = QPixmap(path)
-            if pixmap.isNull():
-                raise ValueError("Pixmap is null")
-            return pixmap
+            # Use the cached image if it is ready, otherwise decode it now
+            image = self.prefetcher.take(path)
+            if image is None:
+                width, height = self.prefetcher.size
+                image = decode_image(path, width, height, self.thumbnail_store)
+                if image.isNull():
+                    raise ValueError("Image is null")
+                self.prefetcher.put(path, image)
+            return QPixmap.fromImage(image)
         except Exception as e:
             print(f"Failed to load image: {path}, Error: {e}")
             return None
 
+    @timed("record_preference")
     def record_preference(self, choice):
         if not self.image_names:
             return
@@ -495,9 +1191,21 @@ class ImageComparer(QWidget):
         else:
             preference = "T"
 
-        # Record the annotation
+        # Record the annotation and append it to the journal
         self.annotations[a_actual] = preference
+        self.image_names.mark_annotated(image_key)
+        journal = self.get_journal()
+        journal.append(a_actual, preference)
+        if journal.needs_compaction():
+            journal.compact(self.annotations)
         print(f"Annotated {a_actual}: {preference}")
+        if self.remote is not None:
+            self.send_remote_vote(image_key, preference)
+        if self.scheduler is not None:
+            # Pick the pairs after this one with the updated estimates
+            self.scheduler.record(image_key, preference)
+            self.image_names.replan(self.current_index + 1)
+            self.check_target_ci()
 
         # Move to the next image
         if self.current_index < len(self.image_names) - 1:
@@ -510,6 +1218,49 @@ class ImageComparer(QWidget):
                 "All image pairs have been annotated.",
             )
             self.save_annotations()
+            self.show_summary()
+
+    def check_target_ci(self):
+        if self.target_ci is None or self.target_reached:
+            return
+        mean, half_width = self.scheduler.estimate()
+        if half_width <= self.target_ci:
+            self.target_reached = True
+            QMessageBox.information(
+                self,
+                "Target Reached",
+                f"Folder A wins {mean:.1%} \u00b1 {half_width:.1%} (95% interval) of the selected pairs "
+                f"after {len(self.scheduler.outcomes)} annotations. You can stop here or continue.",
+            )
+
+    def show_summary(self):
+        try:
+            from preference_stats import build_comparisons, summarize, format_summary
+        except ImportError:
+            # The summary needs NumPy, which the annotator itself does not
+            return
+
+        # Folder names, unless they are equal (e.g. run1/samples and run2/samples),
+        # since build_comparisons counts both sides under one name then
+        model_a = os.path.basename(os.path.normpath(self.folder_a))
+        model_b = os.path.basename(os.path.normpath(self.folder_b))
+        if model_a == model_b:
+            model_a, model_b = os.path.abspath(self.folder_a), os.path.abspath(self.folder_b)
+        if not model_a or not model_b or model_a == model_b:
+            model_a, model_b = "Folder A", "Folder B"
+        comparisons = build_comparisons([(model_a, model_b, self.annotations)])
+        results = summarize(comparisons, bootstrap=200, elo=False)
+
+        summary = QMessageBox(self)
+        summary.setWindowTitle("Summary")
+        summary.setText(f"{len(comparisons)} comparisons of {model_a} vs {model_b}")
+        summary.setInformativeText("\n".join(
+            f"{r['model']}: win {r['win_rate']:.1%} "
+            f"(95% CI {r['win_rate_ci'][0]:.1%}-{r['win_rate_ci'][1]:.1%}), tie {r['tie_rate']:.1%}"
+            for r in results if "win_rate_ci" in r
+        ))
+        summary.setDetailedText(format_summary(results))
+        summary.exec_()
 
     def go_previous(self):
         if self.current_index > 0:
@@ -521,6 +1272,7 @@ class ImageComparer(QWidget):
             self.current_index += 1
             self.show_image_pair()
 
+    @timed("save_annotations")
     def save_annotations(self):
         # Prepare data to save: only image names and preferences
         data = self.annotations
@@ -533,15 +1285,20 @@ class ImageComparer(QWidget):
                 self,
                 "Save Annotations",
                 "annotations.json",
-                "JSON Files (*.json);;All Files (*)",
+                ANNOTATION_FILTER,
                 options=options,
             )
             if not save_path:
                 return
 
         try:
-            with open(save_path, 'w', encoding='utf-8') as f:
-                json.dump(data, f, ensure_ascii=False, indent=4)
+            if self.journal is not None and os.path.abspath(save_path) == os.path.abspath(self.journal.snapshot_path):
+                # Folds the journal into the snapshot
+                self.journal.compact(data)
+            else:
+                journal = open_annotation_log(save_path, self.annotator)
+                journal.compact(data)
+                self.set_journal(journal)
             QMessageBox.information(
                 self,
                 "Success",
@@ -555,6 +1312,57 @@ class ImageComparer(QWidget):
                 f"Failed to save annotations: {e}",
             )
 
+    def toggle_hud(self):
+        self.hud.setVisible(not self.hud.isVisible())
+        self.update_hud()
+
+    def update_hud(self):
+        if not self.hud.isVisible():
+            return
+        self.hud.setText(self.latency.format_table())
+        self.hud.adjustSize()
+        self.hud.move(8, 8)
+        self.hud.raise_()
+
+    def resizeEvent(self, event):
+        super().resizeEvent(event)
+        self.resize_timer.start()
+
+    def update_display_size(self):
+        # Round down to DISPLAY_STEP so small resizes reuse cached images
+        width = max(MIN_DISPLAY_SIZE[0], self.label_a.width() // DISPLAY_STEP * DISPLAY_STEP)
+        height = max(MIN_DISPLAY_SIZE[1], self.label_a.height() // DISPLAY_STEP * DISPLAY_STEP)
+        if (width, height) == self.prefetcher.size:
+            return
+        self.prefetcher.set_size((width, height))
+        if self.image_names and self.btn_choose_a.isEnabled():
+            self.show_image_pair()
+
+    def get_journal(self):
+        if self.journal is None:
+            if not self.annotations_file:
+                self.annotations_file = self.default_annotations_path()
+                print(f"Saving annotations to {self.annotations_file}")
+            self.journal = open_annotation_log(self.annotations_file, self.annotator)
+        return self.journal
+
+    def set_journal(self, journal):
+        if self.journal is not None:
+            self.journal.close()
+        self.journal = journal
+
+    def default_annotations_path(self):
+        """
+        Return annotations.json in the working directory, or annotations_<n>.json
+        if that is already taken by another session.
+        """
+        path = "annotations.json"
+        n = 1
+        while os.path.exists(path) or os.path.exists(path + ".journal"):
+            path = f"annotations_{n}.json"
+            n += 1
+        return os.path.abspath(path)
+
     def closeEvent(self, event):
         # Prompt to save if there are annotations to save
         if self.annotations:
@@ -575,11 +1383,143 @@ class ImageComparer(QWidget):
         else:
             event.accept()
 
+        if event.isAccepted():
+            self.save_session()
+            if self.journal is not None:
+                self.journal.close()
+            self.prefetcher.shutdown()
+            if self.zoom_window is not None:
+                self.zoom_window.close()
+            self.tile_source.shutdown()
+            print(f"Image cache: {self.image_cache.stats()}")
+            print(self.latency.format_table())
+            if self.metrics_file:
+                self.latency.write(self.metrics_file)
+            if self.metrics_server is not None:
+                self.metrics_server.close()
+            if self.profiler is not None:
+                self.profiler.stop()
+            if self.remote is not None:
+                # Hand unannotated pairs back to other annotators
+                for lease in self.leases.values():
+                    try:
+                        self.remote.release(lease)
+                    except (OSError, ServerError):
+                        break
+                self.remote.close()
+                if self.remote_dir:
+                    shutil.rmtree(self.remote_dir, ignore_errors=True)
+
+
+def parse_args(argv):
+    parser = argparse.ArgumentParser(description="Annotate preferences between image pairs.")
+    parser.add_argument("--prefetch-ahead", type=int, default=4,
+                        help="Number of upcoming pairs to decode in the background.")
+    parser.add_argument("--prefetch-behind", type=int, default=2,
+                        help="Number of previous pairs to keep decoded.")
+    parser.add_argument("--prefetch-workers", type=int, default=2,
+                        help="Number of background decoding threads.")
+    parser.add_argument("--cache-mb", type=int, default=256,
+                        help="Memory budget in MB for cached display-size images.")
+    parser.add_argument("--thumbnail-dir", default=None,
+                        help="Shared thumbnail directory (default: a .thumbnails folder inside each image folder).")
+    parser.add_argument("--no-thumbnails", action="store_true",
+                        help="Do not read or write the on-disk thumbnail store.")
+    parser.add_argument("--tile-cache-mb", type=int, default=128,
+                        help="Memory budget in MB for the tiles of the zoom window (Z).")
+    parser.add_argument("--recursive", action="store_true",
+                        help="Also pair images in nested subdirectories (matched by relative path).")
+    parser.add_argument("--scan-workers", type=int, default=1,
+                        help="Threads listing subdirectories in parallel (helps on network filesystems).")
+    parser.add_argument("--watch", action="store_true",
+                        help="Add pairs written into the folders while annotating.")
+    parser.add_argument("--folder-a", default=None,
+                        help="Folder A: an image folder, a tar/zip archive or a directory of shards.")
+    parser.add_argument("--folder-b", default=None,
+                        help="Folder B, used together with --folder-a.")
+    parser.add_argument("--pair-key", default="name",
+                        help=f"How files are matched into pairs: {', '.join(PAIR_KEYS)} or a regular expression "
+                             "whose 'key' group (or first group) is the join key, e.g. '^0*(\\d+)'.")
+    parser.add_argument("--pair-key-b", default=None,
+                        help="Pairing rule for Folder B when it differs from --pair-key.")
+    parser.add_argument("--session", default=DEFAULT_SESSION_PATH,
+                        help="Session snapshot to resume from on launch and to save to (default: %(default)s).")
+    parser.add_argument("--fresh", action="store_true",
+                        help="Start a new session instead of resuming the saved one.")
+    parser.add_argument("--server", default=None,
+                        help="Annotate pairs handed out by annotation_server.py at this URL, e.g. http://127.0.0.1:8765.")
+    parser.add_argument("--annotator", default=None,
+                        help="Name recorded with each vote in a SQLite store and reported to the server "
+                             "(default: the login name).")
+    parser.add_argument("--schedule", choices=SCHEDULES, default="sequential",
+                        help="Order of the pairs: id order, or picked across prompt clusters (stratified) or "
+                             "where the A vs B win rate is least settled (uncertainty).")
+    parser.add_argument("--target-ci", type=float, default=None,
+                        help="With --schedule, say when the 95%% interval of the win rate is this narrow, e.g. 0.03.")
+    parser.add_argument("--preflight", action="store_true",
+                        help="Check every pair for broken, empty or truncated images first and leave those out.")
+    parser.add_argument("--preflight-report", default=None, metavar="REPORT",
+                        help="Write the problems found by --preflight to this JSONL file.")
+    parser.add_argument("--dedupe", choices=("tie", "flag"), default=None,
+                        help="Hash all pairs first and record near-identical ones as no preference (tie) "
+                             "or mark them while annotating (flag).")
+    parser.add_argument("--dedupe-threshold", type=int, default=6,
+                        help="Largest pHash/dHash distance (of 64 bits) counted as near-identical.")
+    parser.add_argument("--hud", action="store_true",
+                        help="Show the latency overlay (toggle with F3).")
+    parser.add_argument("--metrics-file", default=None,
+                        help="Write latency percentiles on exit (.csv, .prom or JSON).")
+    parser.add_argument("--metrics-port", type=int, default=None,
+                        help="Serve latency metrics on http://127.0.0.1:PORT/metrics (Prometheus), /metrics.json and /metrics.csv.")
+    parser.add_argument("--profile", default=None, metavar="REPORT",
+                        help="Run cProfile and tracemalloc for the session and write the report here on exit.")
+    # Leave Qt's own options (e.g. -style) to QApplication
+    args, _ = parser.parse_known_args(argv[1:])
+    for spec in (args.pair_key, args.pair_key_b):
+        try:
+            PairingRule(spec)
+        except ValueError as e:
+            parser.error(str(e))
+    return args
+
 
 def main():
+    args = parse_args(sys.argv)
     app = QApplication(sys.argv)
-    comparer = ImageComparer()
+    comparer = ImageComparer(
+        prefetch_ahead=args.prefetch_ahead,
+        prefetch_behind=args.prefetch_behind,
+        prefetch_workers=args.prefetch_workers,
+        cache_mb=args.cache_mb,
+        thumbnails=not args.no_thumbnails,
+        thumbnail_dir=args.thumbnail_dir,
+        recursive=args.recursive,
+        scan_workers=args.scan_workers,
+        watch=args.watch,
+        hud=args.hud,
+        metrics_file=args.metrics_file,
+        metrics_port=args.metrics_port,
+        profile=args.profile,
+        server=args.server,
+        annotator=args.annotator,
+        schedule=args.schedule,
+        target_ci=args.target_ci,
+        dedupe=args.dedupe,
+        dedupe_threshold=args.dedupe_threshold,
+        preflight=args.preflight,
+        preflight_report=args.preflight_report,
+        pair_key=args.pair_key,
+        pair_key_b=args.pair_key_b,
+        session=os.path.abspath(args.session),
+        tile_cache_mb=args.tile_cache_mb,
+    )
     comparer.show()
+    folder_a = os.path.abspath(args.folder_a) if args.folder_a else None
+    folder_b = os.path.abspath(args.folder_b) if args.folder_b else None
+    # Resume the saved session unless it is for other folders
+    resumed = not args.fresh and args.server is None and comparer.resume_session(folder_a, folder_b)
+    if not resumed and folder_a and folder_b:
+        comparer.open_folders(folder_a, folder_b)
     sys.exit(app.exec_())
 
 
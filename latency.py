@@ -0,0 +1,274 @@
+"""
+Latency histograms for the annotation loop, a localhost metrics endpoint and
+a session profiler. Qt-free.
+
+Timings are recorded into fixed log-spaced buckets (about 12% wide), so
+memory stays constant however long a session runs and p50/p95/p99 can be
+read at any time. Everything is thread-safe so decode workers can record too.
+
+    with recorder.time("load_image"):
+        ...
+"""
+import io
+import csv
+import json
+import math
+import functools
+import time
+import threading
+from contextlib import contextmanager
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+
+# Bucket upper bounds in seconds: 50us * 1.125^k up to about two minutes
+BUCKET_BOUNDS = tuple(50e-6 * 1.125 ** k for k in range(125))
+QUANTILES = (0.5, 0.95, 0.99)
+# Bucket bounds exported to Prometheus (a subset keeps the exposition small)
+PROMETHEUS_BOUNDS = (0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+
+
+class LatencyHistogram:
+    """
+    Counts of observations per log-spaced bucket, plus count, sum and max.
+    """
+
+    def __init__(self):
+        self.buckets = [0] * (len(BUCKET_BOUNDS) + 1)
+        self.count = 0
+        self.total = 0.0
+        self.max = 0.0
+
+    def observe(self, seconds):
+        if seconds <= BUCKET_BOUNDS[0]:
+            i = 0
+        else:
+            i = min(len(BUCKET_BOUNDS), math.ceil(math.log(seconds / BUCKET_BOUNDS[0], 1.125)))
+        self.buckets[i] += 1
+        self.count += 1
+        self.total += seconds
+        self.max = max(self.max, seconds)
+
+    def quantile(self, q):
+        """
+        Estimate the q-quantile by interpolating inside its bucket.
+        """
+        if not self.count:
+            return 0.0
+        rank = q * self.count
+        seen = 0
+        for i, n in enumerate(self.buckets):
+            if n and seen + n >= rank:
+                lower = BUCKET_BOUNDS[i - 1] if i else 0.0
+                upper = BUCKET_BOUNDS[i] if i < len(BUCKET_BOUNDS) else self.max
+                return min(self.max, lower + (upper - lower) * (rank - seen) / n)
+            seen += n
+        return self.max
+
+    def count_at_most(self, bound):
+        """
+        Cumulative count for a Prometheus "le" bucket, to bucket precision.
+        """
+        return sum(n for n, upper in zip(self.buckets, BUCKET_BOUNDS) if upper <= bound)
+
+    def summary(self):
+        result = {
+            "count": self.count,
+            "mean_ms": 1000 * self.total / self.count if self.count else 0.0,
+            "max_ms": 1000 * self.max,
+        }
+        for q in QUANTILES:
+            result[f"p{round(q * 100)}_ms"] = 1000 * self.quantile(q)
+        return result
+
+
+class LatencyRecorder:
+    """
+    Named latency histograms, e.g. "show_image_pair" or "record_preference".
+    """
+
+    def __init__(self, enabled=True):
+        self.enabled = enabled
+        self.histograms = {}
+        self.lock = threading.Lock()
+        self.started = time.time()
+
+    def observe(self, name, seconds):
+        if not self.enabled:
+            return
+        with self.lock:
+            histogram = self.histograms.get(name)
+            if histogram is None:
+                histogram = self.histograms[name] = LatencyHistogram()
+            histogram.observe(seconds)
+
+    @contextmanager
+    def time(self, name):
+        started = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.observe(name, time.perf_counter() - started)
+
+    def reset(self):
+        with self.lock:
+            self.histograms = {}
+            self.started = time.time()
+
+    def summary(self):
+        """
+        Return { name: {"count", "mean_ms", "max_ms", "p50_ms", "p95_ms", "p99_ms"} }.
+        """
+        with self.lock:
+            return {name: histogram.summary() for name, histogram in sorted(self.histograms.items())}
+
+    def format_table(self):
+        lines = [f"{'':<20} {'n':>6} {'p50':>7} {'p95':>7} {'p99':>7}  ms"]
+        for name, s in self.summary().items():
+            lines.append(f"{name[:20]:<20} {s['count']:>6} {s['p50_ms']:>7.1f} {s['p95_ms']:>7.1f} {s['p99_ms']:>7.1f}")
+        return "\n".join(lines)
+
+    def to_json(self):
+        return json.dumps({"started": self.started, "timings": self.summary()}, indent=4)
+
+    def to_csv(self):
+        out = io.StringIO()
+        writer = csv.writer(out)
+        fields = ["count", "mean_ms", "p50_ms", "p95_ms", "p99_ms", "max_ms"]
+        writer.writerow(["name"] + fields)
+        for name, s in self.summary().items():
+            writer.writerow([name] + [s[field] if field == "count" else f"{s[field]:.3f}" for field in fields])
+        return out.getvalue()
+
+    def to_prometheus(self, prefix="annotator"):
+        """
+        Render the histograms in the Prometheus text exposition format.
+        """
+        metric = f"{prefix}_latency_seconds"
+        lines = [
+            f"# HELP {metric} Latency of annotation loop operations.",
+            f"# TYPE {metric} histogram",
+        ]
+        with self.lock:
+            for name, histogram in sorted(self.histograms.items()):
+                for bound in PROMETHEUS_BOUNDS:
+                    lines.append(f'{metric}_bucket{{op="{name}",le="{bound}"}} {histogram.count_at_most(bound)}')
+                lines.append(f'{metric}_bucket{{op="{name}",le="+Inf"}} {histogram.count}')
+                lines.append(f'{metric}_sum{{op="{name}"}} {histogram.total}')
+                lines.append(f'{metric}_count{{op="{name}"}} {histogram.count}')
+        return "\n".join(lines) + "\n"
+
+    def write(self, path):
+        """
+        Write the summary to path as CSV if it ends in .csv, Prometheus text
+        if it ends in .prom, and JSON otherwise.
+        """
+        if path.endswith(".csv"):
+            text = self.to_csv()
+        elif path.endswith(".prom"):
+            text = self.to_prometheus()
+        else:
+            text = self.to_json()
+        with open(path, 'w', encoding='utf-8', newline='') as f:
+            f.write(text)
+
+
+# Shared by the GUI and the decode workers
+recorder = LatencyRecorder()
+
+
+def timed(name):
+    """
+    Decorator recording each call of a function into the shared recorder.
+    """
+    def decorate(func):
+        @functools.wraps(func)
+        def wrapper(*args, **kwargs):
+            with recorder.time(name):
+                return func(*args, **kwargs)
+        return wrapper
+    return decorate
+
+
+class MetricsServer:
+    """
+    Serve a recorder on localhost in a daemon thread: /metrics in the
+    Prometheus text format, /metrics.json and /metrics.csv.
+    """
+
+    def __init__(self, recorder, port, host="127.0.0.1"):
+        metrics = recorder
+
+        class Handler(BaseHTTPRequestHandler):
+            def do_GET(self):
+                path = self.path.split("?")[0]
+                if path == "/metrics":
+                    body, content_type = metrics.to_prometheus(), "text/plain; version=0.0.4"
+                elif path == "/metrics.json":
+                    body, content_type = metrics.to_json(), "application/json"
+                elif path == "/metrics.csv":
+                    body, content_type = metrics.to_csv(), "text/csv"
+                else:
+                    self.send_error(404)
+                    return
+                data = body.encode("utf-8")
+                self.send_response(200)
+                self.send_header("Content-Type", content_type)
+                self.send_header("Content-Length", str(len(data)))
+                self.end_headers()
+                self.wfile.write(data)
+
+            def log_message(self, format, *args):
+                # Keep scrapes out of the annotator's console
+                pass
+
+        self.server = ThreadingHTTPServer((host, port), Handler)
+        self.server.daemon_threads = True
+        self.port = self.server.server_address[1]
+        self.thread = threading.Thread(target=self.server.serve_forever, daemon=True)
+        self.thread.start()
+
+    def close(self):
+        self.server.shutdown()
+        self.server.server_close()
+
+
+class SessionProfiler:
+    """
+    cProfile plus tracemalloc for a whole session. `stop()` writes a report
+    with the slowest functions by cumulative time and the top allocation sites.
+    """
+
+    def __init__(self, report_path, top=40):
+        self.report_path = report_path
+        self.top = top
+        self.profile = None
+
+    def start(self):
+        import cProfile
+        import tracemalloc
+
+        tracemalloc.start(10)
+        self.profile = cProfile.Profile()
+        self.profile.enable()
+
+    def stop(self):
+        import pstats
+        import tracemalloc
+
+        if self.profile is None:
+            return
+        self.profile.disable()
+        snapshot = tracemalloc.take_snapshot()
+        current, peak = tracemalloc.get_traced_memory()
+        tracemalloc.stop()
+
+        out = io.StringIO()
+        out.write("== cProfile (by cumulative time) ==\n")
+        pstats.Stats(self.profile, stream=out).sort_stats("cumulative").print_stats(self.top)
+        out.write(f"== tracemalloc: current {current / 1e6:.1f} MB, peak {peak / 1e6:.1f} MB ==\n")
+        for stat in snapshot.statistics("lineno")[:self.top]:
+            out.write(f"{stat}\n")
+        with open(self.report_path, 'w', encoding='utf-8') as f:
+            f.write(out.getvalue())
+        self.profile = None
+        print(f"Profile written to {self.report_path}")
@@ -0,0 +1,299 @@
+"""
+Sorted numeric-id index of image pairs with bisect range queries.
+
+PairIndex is built once per folder pair; selecting ranges such as
+"0-999,5000-5999" is a bisect plus slice per range. The resulting PairView
+behaves like the old image_names list but can hide already annotated pairs
+and track what is left to annotate without rebuilding anything.
+"""
+from array import array
+from bisect import bisect_left, bisect_right
+
+from pairing import image_id_of, natural_key
+
+
+def parse_ranges(text):
+    """
+    Parse "0-999,5000-5999" (or "42", or "0-999 5000-5999") into a sorted
+    list of inclusive (start, end) tuples with overlaps merged.
+    """
+    ranges = []
+    for part in text.replace(",", " ").split():
+        start_text, sep, end_text = part.partition("-")
+        start = int(start_text)
+        end = int(end_text) if sep else start
+        if start > end:
+            raise ValueError(f"Start index cannot be greater than end index in {part}.")
+        ranges.append((start, end))
+    if not ranges:
+        raise ValueError("No range given.")
+
+    merged = []
+    for start, end in sorted(ranges):
+        if merged and start <= merged[-1][1] + 1:
+            merged[-1] = (merged[-1][0], max(merged[-1][1], end))
+        else:
+            merged.append((start, end))
+    return merged
+
+
+def format_ranges(ranges):
+    return ",".join(f"{start}-{end}" if start != end else str(start) for start, end in ranges)
+
+
+class PairIndex:
+    """
+    Numeric ids of all pairs in ascending order, in an array, with the
+    lowercase name of each pair alongside. Pairs whose join key and Folder A
+    filename are both not a number are kept apart in `unnumbered`, in
+    natural order of the Folder A filename: they come after the numbered
+    pairs when all pairs are selected, but cannot be selected by range.
+    """
+
+    def __init__(self, image_names, index_a):
+        self.index_a = index_a
+        keyed = []
+        unnumbered = []
+        for img_lower in image_names:
+            image_id = self.image_id(img_lower)
+            if image_id is not None:
+                keyed.append((image_id, img_lower))
+            else:
+                unnumbered.append(img_lower)
+        keyed.sort()
+        self.ids = array("q", (image_id for image_id, _ in keyed))
+        self.names = [img_lower for _, img_lower in keyed]
+        self.unnumbered = sorted(unnumbered, key=self.natural_order)
+        self.members = set(self.names)
+        self.members.update(self.unnumbered)
+
+    def state(self):
+        """
+        JSON-serializable ids and names, for from_state().
+        """
+        return {"ids": self.ids.tolist(), "names": self.names, "unnumbered": self.unnumbered}
+
+    @classmethod
+    def from_state(cls, state, index_a):
+        """
+        Rebuild a PairIndex from state() without sorting or parsing ids again.
+        """
+        pair_index = cls([], index_a)
+        pair_index.ids = array("q", state["ids"])
+        pair_index.names = list(state["names"])
+        pair_index.unnumbered = list(state.get("unnumbered", ()))
+        pair_index.members = set(pair_index.names)
+        pair_index.members.update(pair_index.unnumbered)
+        return pair_index
+
+    def image_id(self, img_lower):
+        # A numeric join key, else a numeric Folder A filename, else None
+        return image_id_of(img_lower, self.index_a.by_lower.get(img_lower, img_lower))
+
+    def natural_order(self, img_lower):
+        return natural_key(self.index_a.by_lower.get(img_lower, img_lower))
+
+    def add(self, img_lower):
+        """
+        Insert a new pair in id order, or in natural order among the pairs
+        without an id. Returns False if it is already indexed.
+        """
+        if img_lower in self.members:
+            return False
+        self.members.add(img_lower)
+        image_id = self.image_id(img_lower)
+        if image_id is None:
+            keys = [self.natural_order(name) for name in self.unnumbered]
+            self.unnumbered.insert(bisect_right(keys, self.natural_order(img_lower)), img_lower)
+            return True
+        # Keep (id, name) order so duplicate ids stay deterministic
+        pos = bisect_left(self.ids, image_id)
+        end = bisect_right(self.ids, image_id)
+        pos += bisect_left(self.names[pos:end], img_lower)
+        self.ids.insert(pos, image_id)
+        self.names.insert(pos, img_lower)
+        return True
+
+    def __len__(self):
+        return len(self.names) + len(self.unnumbered)
+
+    def select(self, ranges=None):
+        """
+        Return a PairView of the pairs whose id lies in any of the inclusive
+        (start, end) ranges, or of all pairs when ranges is None (numbered
+        pairs first, then those without an id).
+        """
+        if ranges is None:
+            return PairView(self.names + self.unnumbered)
+        if self.unnumbered:
+            print(f"{len(self.unnumbered)} pairs without a numeric id (e.g. {self.unnumbered[0]}) "
+                  f"are not in any range")
+        names = []
+        for start, end in ranges:
+            names.extend(self.names[bisect_left(self.ids, start):bisect_right(self.ids, end)])
+        return PairView(names)
+
+
+def in_ranges(image_id, ranges):
+    """
+    Whether image_id lies in any of the inclusive (start, end) ranges, or True when ranges is None.
+    """
+    if ranges is None:
+        return True
+    return any(start <= image_id <= end for start, end in ranges)
+
+
+class _Fenwick:
+    """
+    Binary indexed tree over 0/1 flags: prefix counts and k-th set flag in O(log n).
+    """
+
+    def __init__(self, flags):
+        n = len(flags)
+        tree = array("i", [0]) * (n + 1)
+        for i, flag in enumerate(flags, 1):
+            tree[i] += flag
+            parent = i + (i & -i)
+            if parent <= n:
+                tree[parent] += tree[i]
+        self.tree = tree
+        self.n = n
+
+    def add(self, i, delta):
+        i += 1
+        while i <= self.n:
+            self.tree[i] += delta
+            i += i & -i
+
+    def prefix(self, i):
+        """
+        Number of set flags before position i.
+        """
+        total = 0
+        while i > 0:
+            total += self.tree[i]
+            i -= i & -i
+        return total
+
+    def kth(self, k):
+        """
+        Position of the (k+1)-th set flag.
+        """
+        pos = 0
+        step = 1 << self.n.bit_length()
+        while step:
+            nxt = pos + step
+            if nxt <= self.n and self.tree[nxt] <= k:
+                pos = nxt
+                k -= self.tree[nxt]
+            step >>= 1
+        return pos
+
+
+class PairView:
+    """
+    List-like view of the selected pairs in id order.
+
+    `hide()` removes pairs from indexing and iteration (e.g. those annotated
+    in a loaded file) in O(log n) per lookup instead of rebuilding a list.
+    `mark_annotated()` keeps `remaining` current as preferences are recorded,
+    without hiding the pair so it can still be revisited.
+    """
+
+    def __init__(self, names):
+        self.names = names
+        self.visible = None  # _Fenwick over visible flags, None while nothing is hidden
+        self.flags = None
+        self.visible_count = len(names)
+        self.positions = None  # { name: position }, built on first use
+        self.annotated = bytearray(len(names))
+        self.remaining = len(names)
+
+    def position(self, name):
+        if self.positions is None:
+            self.positions = {img_lower: i for i, img_lower in enumerate(self.names)}
+        return self.positions.get(name)
+
+    def hide(self, names):
+        """
+        Hide the given lowercase names. Returns how many were newly hidden.
+        """
+        if self.flags is None:
+            self.flags = bytearray(b"\x01") * len(self.names)
+        newly_hidden = []
+        for name in names:
+            i = self.position(name)
+            if i is not None and self.flags[i]:
+                self.flags[i] = 0
+                newly_hidden.append(i)
+                if not self.annotated[i]:
+                    self.annotated[i] = 1
+                    self.remaining -= 1
+        if newly_hidden:
+            if self.visible is None:
+                self.visible = _Fenwick(self.flags)
+            else:
+                for i in newly_hidden:
+                    self.visible.add(i, -1)
+            self.visible_count -= len(newly_hidden)
+        return len(newly_hidden)
+
+    def extend(self, names):
+        """
+        Append pairs found after the view was created (e.g. by a folder
+        watcher). They go at the end so the current positions stay valid.
+        """
+        names = [name for name in names if self.position(name) is None]
+        if not names:
+            return 0
+        for name in names:
+            self.positions[name] = len(self.names)
+            self.names.append(name)
+        self.annotated.extend(bytes(len(names)))
+        self.remaining += len(names)
+        self.visible_count += len(names)
+        if self.flags is not None:
+            self.flags.extend(b"\x01" * len(names))
+            if self.visible is not None:
+                self.visible = _Fenwick(self.flags)
+        return len(names)
+
+    def index(self, name):
+        """
+        Position of name among the visible pairs, or None if it is hidden or
+        not in the view.
+        """
+        i = self.position(name)
+        if i is None or self.flags is None:
+            return i
+        if not self.flags[i]:
+            return None
+        return i if self.visible is None else self.visible.prefix(i)
+
+    def mark_annotated(self, name):
+        i = self.position(name)
+        if i is not None and not self.annotated[i]:
+            self.annotated[i] = 1
+            self.remaining -= 1
+
+    def __len__(self):
+        return self.visible_count
+
+    def __getitem__(self, index):
+        if isinstance(index, slice):
+            return [self[i] for i in range(*index.indices(self.visible_count))]
+        if index < 0:
+            index += self.visible_count
+        if index < 0 or index >= self.visible_count:
+            raise IndexError("PairView index out of range")
+        if self.visible is None:
+            return self.names[index]
+        return self.names[self.visible.kth(index)]
+
+    def __iter__(self):
+        if self.flags is None:
+            return iter(self.names)
+        return (name for name, flag in zip(self.names, self.flags) if flag)
+
+    def __bool__(self):
+        return self.visible_count > 0
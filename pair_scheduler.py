@@ -0,0 +1,366 @@
+"""
+Order in which pairs are shown. By default the annotator walks the selected
+pairs in id order; a scheduler instead picks each next pair so the Folder A
+vs Folder B result becomes confident with fewer annotations. Qt-free.
+
+Pairs are grouped into strata, by default clusters of similar prompts
+(prompt_cluster). Each stratum keeps a running estimate of how often A wins
+(A = 1, B = 0, tie = 0.5), and the overall win rate is the stratified
+estimate sum(W_h * mean_h) with W_h the stratum's share of the pairs.
+
+    stratified   proportional allocation: the next pair comes from the
+                 stratum that has had the smallest share of its pairs shown
+    uncertainty  the next pair comes from the stratum where one more vote
+                 shrinks the variance of the overall estimate the most
+                 (W_h^2 * s_h^2 * (1/m_h - 1/(m_h + 1)), Neyman-style), so
+                 unsettled strata get more votes and settled ones fewer
+
+Strata sit in a heap keyed by priority; picking a pair and recording a
+preference each touch one stratum, so they cost O(log strata) (lazily
+invalidated heap entries), and a pair within a stratum is drawn in O(1)
+from a pre-shuffled list.
+
+ScheduledView wraps a PairView so the GUI indexes pairs in the order they
+are picked, picking more as it moves forward.
+"""
+import math
+import heapq
+import random
+import zlib
+
+
+SCHEDULES = ("sequential", "stratified", "uncertainty")
+
+# Outcome of a vote for the Folder A win rate
+SCORES = {"A": 1.0, "B": 0.0, "T": 0.5}
+
+# Words ignored when clustering prompts
+STOPWORDS = frozenset(
+    "a an the of and or in on at to with by for from is are was were be as it its this that "
+    "into over under very photo image picture style high quality detailed".split()
+)
+
+
+def prompt_cluster(prompt, clusters=32):
+    """
+    Cheap similarity cluster of a prompt: the content word with the smallest
+    crc32 (a one-hash MinHash, so prompts that share most words usually
+    agree), folded into `clusters` buckets. Pairs without a prompt share one
+    stratum.
+    """
+    if not prompt:
+        return -1
+    words = [w for w in "".join(c if c.isalnum() else " " for c in prompt.lower()).split()
+             if len(w) > 2 and w not in STOPWORDS]
+    if not words:
+        return -1
+    return min(zlib.crc32(w.encode("utf-8")) for w in words) % clusters
+
+
+class Stratum:
+    def __init__(self, key):
+        self.key = key
+        self.candidates = []  # names not picked yet, drawn from the end
+        self.size = 0  # all pairs in the stratum, including annotated ones
+        self.drawn = 0  # pairs picked or annotated
+        self.pending = 0  # picked but not voted on yet
+        # Votes: count, sum and sum of squares of the scores
+        self.n = 0
+        self.total = 0.0
+        self.total_sq = 0.0
+        self.version = 0
+
+    def variance(self):
+        """
+        Score variance, shrunk towards 0.25 by two pseudo-votes (one A, one B).
+        """
+        n = self.n + 2
+        mean = (self.total + 1) / n
+        return max((self.total_sq + 1) / n - mean * mean, 1e-6)
+
+    def mean(self):
+        return (self.total + 1) / (self.n + 2)
+
+
+class PairScheduler:
+    """
+    Picks pairs from strata; subclasses define a stratum's priority (lower
+    is picked first).
+
+    names are the pairs that may be picked, outcomes { name: preference } the
+    already annotated pairs of the selection (they count towards the
+    estimates and stratum sizes but are never picked), and stratum_of maps a
+    lowercase name to its stratum key.
+    """
+
+    def __init__(self, names, stratum_of, outcomes=None, seed=0):
+        self.stratum_of = stratum_of
+        self.rng = random.Random(seed)
+        self.counter = 0  # heap tie-breaker
+        self.build(list(names), dict(outcomes or {}), set())
+
+    def build(self, names, outcomes, picked):
+        self.strata = {}
+        self.where = {}  # { name: Stratum }
+        self.outcomes = {}  # { name: score }
+        self.picked = set()
+        self.removed = set()
+        self.heap = []
+        for name in names:
+            self._stratum(name).candidates.append(name)
+        for name in picked:
+            stratum = self._stratum(name)
+            stratum.drawn += 1
+            stratum.pending += 1
+            self.picked.add(name)
+        for name, preference in outcomes.items():
+            stratum = self._stratum(name)
+            if name not in self.picked:
+                stratum.drawn += 1
+            self._score(name, preference)
+        for stratum in self.strata.values():
+            self.rng.shuffle(stratum.candidates)
+            self._push(stratum)
+
+    def regroup(self, stratum_of):
+        """
+        Re-stratify (e.g. once prompts are loaded), keeping what was picked
+        and recorded so far.
+        """
+        self.stratum_of = stratum_of
+        names = [name for stratum in self.strata.values() for name in stratum.candidates
+                 if name not in self.removed]
+        outcomes = self._preferences()
+        self.build(names, outcomes, self.picked - set(outcomes))
+
+    def _preferences(self):
+        by_score = {score: preference for preference, score in SCORES.items()}
+        return {name: by_score[score] for name, score in self.outcomes.items()}
+
+    def _stratum(self, name):
+        stratum = self.where.get(name)
+        if stratum is not None:
+            return stratum
+        key = self.stratum_of(name)
+        stratum = self.strata.get(key)
+        if stratum is None:
+            stratum = self.strata[key] = Stratum(key)
+        self.where[name] = stratum
+        stratum.size += 1
+        return stratum
+
+    def _push(self, stratum):
+        stratum.version += 1
+        if stratum.candidates:
+            self.counter += 1
+            heapq.heappush(self.heap, (self.priority(stratum), self.counter, stratum.version, stratum.key))
+
+    def _score(self, name, preference):
+        stratum = self.where[name]
+        old = self.outcomes.get(name)
+        if old is not None:
+            stratum.n -= 1
+            stratum.total -= old
+            stratum.total_sq -= old * old
+        score = SCORES[preference]
+        self.outcomes[name] = score
+        stratum.n += 1
+        stratum.total += score
+        stratum.total_sq += score * score
+
+    def priority(self, stratum):
+        raise NotImplementedError
+
+    def pick(self):
+        """
+        Return the next pair to show, or None when every pair was picked.
+        """
+        while self.heap:
+            _, _, version, key = self.heap[0]
+            stratum = self.strata[key]
+            if version != stratum.version or not stratum.candidates:
+                heapq.heappop(self.heap)
+                continue
+            name = stratum.candidates.pop()
+            if name in self.removed:
+                self.removed.discard(name)
+                self._push(stratum)
+                continue
+            heapq.heappop(self.heap)
+            stratum.drawn += 1
+            stratum.pending += 1
+            self.picked.add(name)
+            self._push(stratum)
+            return name
+        return None
+
+    def unpick(self, name):
+        """
+        Give back a pair that was picked but not shown, so it is picked next
+        from its stratum.
+        """
+        if name not in self.picked or name in self.outcomes:
+            return
+        self.picked.discard(name)
+        stratum = self.where[name]
+        stratum.candidates.append(name)
+        stratum.drawn -= 1
+        stratum.pending -= 1
+        self._push(stratum)
+
+    def record(self, name, preference):
+        """
+        Update the estimates with a vote (a repeated vote replaces the old one).
+        """
+        stratum = self.where.get(name)
+        if stratum is None or preference not in SCORES:
+            return
+        if name in self.picked and name not in self.outcomes:
+            stratum.pending -= 1
+        self._score(name, preference)
+        self._push(stratum)
+
+    def add(self, names):
+        """
+        Make new pairs (e.g. found by the folder watcher) available.
+        """
+        touched = {}
+        for name in names:
+            if name in self.where:
+                continue
+            stratum = self._stratum(name)
+            stratum.candidates.insert(self.rng.randint(0, len(stratum.candidates)), name)
+            touched[stratum.key] = stratum
+        for stratum in touched.values():
+            self._push(stratum)
+
+    def remove(self, names):
+        """
+        Never pick these pairs (e.g. annotated elsewhere); dropped lazily.
+        """
+        for name in names:
+            if name in self.where and name not in self.picked:
+                self.removed.add(name)
+
+    def estimate(self, z=1.96):
+        """
+        Return (Folder A win rate, half-width of its confidence interval)
+        from the stratified estimator with finite population correction.
+        """
+        total = sum(stratum.size for stratum in self.strata.values())
+        if not total:
+            return 0.5, 0.5
+        mean = 0.0
+        variance = 0.0
+        for stratum in self.strata.values():
+            weight = stratum.size / total
+            mean += weight * stratum.mean()
+            fpc = max(0.0, 1 - stratum.n / stratum.size)
+            variance += weight * weight * stratum.variance() / (stratum.n + 2) * fpc
+        return mean, z * math.sqrt(variance)
+
+
+class StratifiedScheduler(PairScheduler):
+    """
+    Proportional allocation across strata, larger strata first on ties.
+    """
+
+    def priority(self, stratum):
+        return (stratum.drawn / stratum.size, -stratum.size)
+
+
+class UncertaintyScheduler(PairScheduler):
+    """
+    Picks from the stratum whose next vote reduces the variance of the
+    overall win-rate estimate the most; strata without votes go first.
+    """
+
+    def priority(self, stratum):
+        # Picked pairs count as votes to come, so look-ahead picks spread out
+        m = stratum.n + stratum.pending
+        gain = 2.0 if m == 0 else 1 / m - 1 / (m + 1)
+        return (-(stratum.size * stratum.size) * stratum.variance() * gain, -stratum.size)
+
+
+def make_scheduler(schedule, names, stratum_of, outcomes=None, seed=0):
+    """
+    Return the scheduler for a --schedule value, or None for "sequential".
+    """
+    if schedule == "stratified":
+        return StratifiedScheduler(names, stratum_of, outcomes, seed)
+    if schedule == "uncertainty":
+        return UncertaintyScheduler(names, stratum_of, outcomes, seed)
+    if schedule != "sequential":
+        raise ValueError(f"Unknown schedule {schedule}; choose from {', '.join(SCHEDULES)}.")
+    return None
+
+
+class ScheduledView:
+    """
+    PairView in the order a scheduler picks the pairs. Position i is the
+    i-th pair picked; positions past the last pick are picked on first
+    access (e.g. by the prefetcher). replan() hands back picks beyond the
+    current pair so they are re-picked with the latest votes.
+    """
+
+    def __init__(self, view, scheduler):
+        self.view = view
+        self.scheduler = scheduler
+        self.shown = []
+
+    @property
+    def remaining(self):
+        return self.view.remaining
+
+    def mark_annotated(self, name):
+        self.view.mark_annotated(name)
+
+    def replan(self, keep):
+        # Pairs already voted on (when going back and forth) keep their place
+        voted = [name for name in self.shown[keep:] if name in self.scheduler.outcomes]
+        for name in reversed(self.shown[keep:]):
+            self.scheduler.unpick(name)
+        self.shown[keep:] = voted
+
+    def extend(self, names):
+        names = list(names)
+        added = self.view.extend(names)
+        self.scheduler.add(names)
+        return added
+
+    def hide(self, names):
+        names = list(names)
+        hidden = set(names)
+        # Pairs already handed out leave the pick order too, so it stays as
+        # long as the view; unvoted ones go back to the scheduler to be dropped
+        shown = [name for name in self.shown if name in hidden]
+        for name in shown:
+            self.scheduler.unpick(name)
+        self.scheduler.remove(names)
+        if shown:
+            self.shown = [name for name in self.shown if name not in hidden]
+        return self.view.hide(names)
+
+    def __len__(self):
+        return len(self.view)
+
+    def __getitem__(self, index):
+        if isinstance(index, slice):
+            return [self[i] for i in range(*index.indices(len(self)))]
+        if index < 0:
+            index += len(self)
+        if index < 0 or index >= len(self):
+            raise IndexError("ScheduledView index out of range")
+        while len(self.shown) <= index:
+            name = self.scheduler.pick()
+            if name is None:
+                raise IndexError("ScheduledView index out of range")
+            self.shown.append(name)
+        return self.shown[index]
+
+    def __iter__(self):
+        # Order does not matter to callers that iterate (e.g. prompt lookup)
+        return iter(self.view)
+
+    def __bool__(self):
+        return bool(self.view)
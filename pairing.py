@@ -0,0 +1,330 @@
+"""
+Pairing of Folder A and Folder B files by a join key. Qt-free.
+
+By default a pair is two files with the same name up to case ("name"). A
+pairing rule derives the key differently, so datasets whose two sides are
+named differently still pair up:
+
+    name     lowercase filename, extension included (the default)
+    stem     filename without its extension
+    number   the first run of digits in the stem, e.g. 12 for "00012_modelA.webp"
+    REGEX    any other value is a regular expression searched in the filename
+             (case-insensitively); the key is its "key" group, else its first
+             group, else the whole match. Files it does not match are unpaired.
+
+Except for "name", keys are lowercased, lose a trailing image extension and
+have the zero padding of every number removed, so "00012.PNG", "12.webp" and
+"12" all give "12". Folder A and Folder B may use different rules.
+
+KeyedIndex wraps a FolderIndex or ArchiveIndex so its by_lower map goes from
+join keys to filenames; everything that looks pairs up by name then works on
+keys unchanged. Building it is one pass over the index, and find_pairs joins
+two indexes with one set intersection, so pairing stays linear in the number
+of files (plus sorting the pairs). When several files of one side share a
+key, the first in natural order is used and the others are reported.
+"""
+import os
+import re
+import time
+
+from folder_index import IMAGE_EXTENSIONS
+
+
+PAIR_KEYS = ("name", "stem", "number")
+
+_DIGITS = re.compile(r"(\d+)")
+_NUMBER = re.compile(r"\d+")
+# Leading zeros of a number, except the last digit
+_PADDING = re.compile(r"(?<!\d)0+(?=\d)")
+
+
+def natural_key(text):
+    """
+    Sort key that orders embedded numbers by value: "img2" < "img10".
+    """
+    parts = _DIGITS.split(text.lower())
+    parts[1::2] = [int(part) for part in parts[1::2]]
+    return parts
+
+
+def image_id_of(key, actual=None):
+    """
+    Numeric id of a pair: the stem of its join key if it is a number, else
+    the stem of the Folder A filename, else None.
+    """
+    for name in (key, actual):
+        if name is None:
+            continue
+        stem = os.path.splitext(os.path.basename(name))[0]
+        if stem.isdecimal():
+            return int(stem)
+    return None
+
+
+def pair_order(key, actual):
+    """
+    Sort key of a pair: numeric ids first in numeric order, then the rest
+    in natural order of the Folder A filename.
+    """
+    image_id = image_id_of(key, actual)
+    if image_id is None:
+        return (1, 0, natural_key(actual))
+    return (0, image_id, key)
+
+
+class PairingRule:
+    """
+    A --pair-key value: "name", "stem", "number" or a regular expression.
+    key() returns the join key of a filename, or None if the file cannot be
+    paired. Keys never depend on case, so the key of a lowercased filename
+    is the key of the file.
+    """
+
+    def __init__(self, spec="name"):
+        self.spec = spec or "name"
+        self.regex = None
+        if self.spec not in PAIR_KEYS:
+            try:
+                self.regex = re.compile(self.spec, re.IGNORECASE)
+            except re.error as e:
+                raise ValueError(f"Invalid pairing rule {self.spec!r}: {e}") from None
+
+    @property
+    def is_name(self):
+        return self.spec == "name"
+
+    def key(self, name):
+        name = name.lower()
+        if self.spec == "name":
+            return name
+        stem = os.path.splitext(name)[0]
+        if self.spec == "stem":
+            key = stem
+        elif self.spec == "number":
+            match = _NUMBER.search(os.path.basename(stem))
+            if match is None:
+                return None
+            key = match.group()
+        else:
+            match = self.regex.search(name)
+            if match is None:
+                return None
+            if "key" in self.regex.groupindex:
+                key = match.group("key")
+            elif self.regex.groups:
+                key = match.group(1)
+            else:
+                key = match.group()
+            if key is None:
+                return None
+            if key.endswith(IMAGE_EXTENSIONS):
+                key = os.path.splitext(key)[0]
+        key = _PADDING.sub("", key)
+        return key or None
+
+    def __repr__(self):
+        return f"PairingRule({self.spec!r})"
+
+
+class KeyedIndex:
+    """
+    An image source seen through a pairing rule: by_lower maps join keys to
+    filenames, by_id numeric keys to filenames. Updates of the wrapped index
+    are applied key by key.
+    """
+
+    def __init__(self, index, rule):
+        self.index = index
+        self.rule = rule
+        self.folder = index.folder
+        self.last_checked = time.monotonic()
+        self.pending_added = []
+        self.build()
+
+    @property
+    def scan_seconds(self):
+        return self.index.scan_seconds
+
+    def build(self):
+        # { join key: filename }
+        self.by_lower = {}
+        self.by_id = {}
+        # { join key: [other filenames with that key] }
+        self.duplicates = {}
+        # Filenames the rule gives no key
+        self.unkeyed = []
+        for actual in self.index.by_lower.values():
+            self._add(actual)
+
+    def _add(self, actual):
+        key = self.rule.key(actual)
+        if key is None:
+            self.unkeyed.append(actual)
+            return None
+        current = self.by_lower.get(key)
+        if current is not None and current != actual:
+            # The first file in natural order keeps the key, whatever the scan order
+            if natural_key(actual) < natural_key(current):
+                actual, current = current, actual
+                self._set(key, current)
+            self.duplicates.setdefault(key, []).append(actual)
+            return None
+        self._set(key, actual)
+        return key
+
+    def _set(self, key, actual):
+        self.by_lower[key] = actual
+        image_id = image_id_of(key)
+        if image_id is not None:
+            self.by_id[image_id] = actual
+
+    def _remove(self, name_lower):
+        key = self.rule.key(name_lower)
+        if key is None:
+            self.unkeyed = [actual for actual in self.unkeyed if actual.lower() != name_lower]
+            return
+        others = self.duplicates.get(key, [])
+        current = self.by_lower.get(key)
+        if current is not None and current.lower() == name_lower:
+            if others:
+                others.sort(key=natural_key)
+                self._set(key, others.pop(0))
+            else:
+                del self.by_lower[key]
+                image_id = image_id_of(key)
+                if self.by_id.get(image_id) == current:
+                    del self.by_id[image_id]
+        else:
+            others[:] = [actual for actual in others if actual.lower() != name_lower]
+        if key in self.duplicates and not others:
+            del self.duplicates[key]
+
+    def refresh(self):
+        seconds = self.index.refresh()
+        self.pending_added = []
+        self.build()
+        return seconds
+
+    def update(self):
+        """
+        Update the wrapped index. Returns (added, removed) lists of join keys.
+        """
+        added_names, removed_names = self.index.update()
+        # Reported as keys below instead
+        self.index.take_added()
+        for name_lower in removed_names:
+            self._remove(name_lower)
+        removed = [self.rule.key(name_lower) for name_lower in removed_names]
+        removed = [key for key in removed if key is not None and key not in self.by_lower]
+        added = []
+        for name_lower in added_names:
+            actual = self.index.by_lower.get(name_lower)
+            if actual is not None:
+                key = self._add(actual)
+                if key is not None:
+                    added.append(key)
+        self.pending_added.extend(added)
+        self.last_checked = time.monotonic()
+        return added, removed
+
+    def take_added(self):
+        added, self.pending_added = self.pending_added, []
+        return added
+
+    def is_stale(self):
+        return self.index.is_stale()
+
+    def ensure_fresh(self, force=False):
+        """
+        FolderIndex.ensure_fresh, updating through this wrapper so the keys
+        follow. Archives only update on request.
+        """
+        interval = getattr(self.index, "check_interval", None)
+        if interval is None:
+            return False
+        now = time.monotonic()
+        if not force and now - self.last_checked < interval:
+            return False
+        self.last_checked = now
+        added, removed = self.update()
+        return bool(added or removed)
+
+    def actual_name(self, key):
+        self.ensure_fresh()
+        return self.by_lower.get(key)
+
+    def name_for_id(self, image_id):
+        self.ensure_fresh()
+        return self.by_id.get(image_id)
+
+    def key_of(self, name):
+        """
+        Join key of a filename (e.g. an annotation key), or its lowercase
+        name if the rule gives it none.
+        """
+        return self.rule.key(name) or name.lower()
+
+    def lower_names(self):
+        return set(self.by_lower)
+
+    def path_of(self, actual_name):
+        return self.index.path_of(actual_name)
+
+    def directories(self):
+        return self.index.directories()
+
+    def __len__(self):
+        return len(self.by_lower)
+
+    def __contains__(self, key):
+        return key in self.by_lower
+
+
+def keyed_source(index, spec=None):
+    """
+    Return index as seen through the pairing rule spec; the "name" rule
+    (or None) keeps the index itself.
+    """
+    rule = spec if isinstance(spec, PairingRule) else PairingRule(spec)
+    if rule.is_name:
+        return index
+    return KeyedIndex(index, rule)
+
+
+def pairing_report(index_a, index_b, names=None):
+    """
+    Return { "pairs", "unmatched_a", "unmatched_b", "duplicates_a",
+    "duplicates_b" }: the number of pairs, the filenames of each side
+    without a partner (or without a key) in natural order, and the
+    filenames left out because another file of their side has the same key.
+    """
+    if names is None:
+        names = index_a.lower_names().intersection(index_b.lower_names())
+    report = {"pairs": len(names)}
+    for side, index, other in (("a", index_a, index_b), ("b", index_b, index_a)):
+        unmatched = [actual for key, actual in index.by_lower.items() if key not in other.by_lower]
+        unmatched.extend(getattr(index, "unkeyed", ()))
+        unmatched.sort(key=natural_key)
+        report[f"unmatched_{side}"] = unmatched
+        report[f"duplicates_{side}"] = sorted(
+            (actual for others in getattr(index, "duplicates", {}).values() for actual in others),
+            key=natural_key,
+        )
+    return report
+
+
+def format_pairing_report(report, limit=10):
+    """
+    Human-readable lines summarising a pairing_report, listing at most
+    limit filenames per group.
+    """
+    lines = [f"{report['pairs']} pairs; "
+             f"{len(report['unmatched_a'])} files only in Folder A, {len(report['unmatched_b'])} only in Folder B; "
+             f"{len(report['duplicates_a']) + len(report['duplicates_b'])} left out with a duplicate key"]
+    for field, label in (("unmatched_a", "Only in Folder A"), ("unmatched_b", "Only in Folder B"),
+                         ("duplicates_a", "Duplicate key in Folder A"), ("duplicates_b", "Duplicate key in Folder B")):
+        names = report[field]
+        if names:
+            shown = ", ".join(names[:limit]) + (", ..." if len(names) > limit else "")
+            lines.append(f"{label}: {shown}")
+    return lines
@@ -0,0 +1,200 @@
+"""
+Turn A/B/T annotations into model-level scores: win/tie rates, Bradley-Terry
+ratings and online Elo, with bootstrap confidence intervals. Qt-free; needs
+NumPy.
+
+All comparisons are reduced to a count tensor C[i, j, o] (model i shown as A,
+model j shown as B, outcome o in A/B/T), so fitting and bootstrapping cost
+O(models^2) regardless of the number of comparisons.
+"""
+import numpy as np
+
+from annotation_core import PREFERENCES
+
+
+# Elo-style scale used for Bradley-Terry ratings: 400 points = 10x odds
+RATING_SCALE = 400 / np.log(10)
+RATING_BASE = 1000
+# Comparisons online Elo runs over at most; see online_elo
+ELO_MAX_COMPARISONS = 200000
+
+
+class Comparisons:
+    """
+    Pairwise comparisons between named models, stored as parallel arrays.
+    """
+
+    def __init__(self, models, first, second, outcome):
+        self.models = list(models)
+        # Model index shown as A, model index shown as B, outcome index into PREFERENCES
+        self.first = np.asarray(first, dtype=np.int32)
+        self.second = np.asarray(second, dtype=np.int32)
+        self.outcome = np.asarray(outcome, dtype=np.int8)
+
+    def __len__(self):
+        return len(self.outcome)
+
+    def counts(self):
+        """
+        Return the count tensor C with shape (models, models, 3).
+        """
+        k = len(self.models)
+        flat = (self.first.astype(np.int64) * k + self.second) * 3 + self.outcome
+        return np.bincount(flat, minlength=k * k * 3).reshape(k, k, 3)
+
+
+def build_comparisons(sources):
+    """
+    Build Comparisons from (model_a, model_b, annotations) triples, where
+    annotations is the { image: "A"/"B"/"T" } dict of one annotations.json.
+    Invalid preferences are ignored.
+    """
+    models = []
+    firsts, seconds, outcomes = [], [], []
+    code = {pref: i for i, pref in enumerate(PREFERENCES)}
+    for model_a, model_b, annotations in sources:
+        for model in (model_a, model_b):
+            if model not in models:
+                models.append(model)
+        codes = np.fromiter((code.get(pref, -1) for pref in annotations.values()), dtype=np.int8,
+                            count=len(annotations))
+        codes = codes[codes >= 0]
+        firsts.append(np.full(len(codes), models.index(model_a), dtype=np.int32))
+        seconds.append(np.full(len(codes), models.index(model_b), dtype=np.int32))
+        outcomes.append(codes)
+    if not outcomes:
+        return Comparisons(models, [], [], [])
+    return Comparisons(models, np.concatenate(firsts), np.concatenate(seconds), np.concatenate(outcomes))
+
+
+def _scores(counts):
+    """
+    From counts (..., k, k, 3) return per-model (wins, ties, losses, games)
+    and the pairwise score matrix W[x, y] (ties count half) and games N[x, y].
+    """
+    a_wins, b_wins, ties = counts[..., 0], counts[..., 1], counts[..., 2]
+    swap = np.swapaxes
+    wins = a_wins.sum(-1) + b_wins.sum(-2)
+    losses = b_wins.sum(-1) + a_wins.sum(-2)
+    tie_count = ties.sum(-1) + ties.sum(-2)
+    games = wins + losses + tie_count
+    pair_scores = a_wins + swap(b_wins, -1, -2) + 0.5 * (ties + swap(ties, -1, -2))
+    total = counts.sum(-1)
+    pair_games = total + swap(total, -1, -2)
+    return wins, tie_count, losses, games, pair_scores, pair_games
+
+
+def fit_bradley_terry(pair_scores, pair_games, prior=0.5, iterations=1000, tol=1e-9):
+    """
+    Fit Bradley-Terry strengths with the MM algorithm (Hunter, 2004).
+
+    pair_scores[x, y] is x's score against y (ties count half) and
+    pair_games[x, y] the number of games between them. `prior` adds that
+    many virtual ties to every pair that played, so undefeated or winless
+    models still get finite ratings. Returns ratings on the Elo scale.
+    """
+    if len(pair_scores) == 0:
+        return np.zeros(0)
+    played = pair_games > 0
+    scores = pair_scores + prior / 2 * played
+    games = pair_games + prior * played
+    total_scores = scores.sum(1)
+
+    p = np.ones(len(scores))
+    for _ in range(iterations):
+        denom = (games / (p[:, None] + p[None, :])).sum(1)
+        new_p = np.where(denom > 0, total_scores / np.where(denom > 0, denom, 1), p)
+        # Fix the scale: geometric mean strength of 1
+        new_p /= np.exp(np.log(new_p).mean())
+        if np.max(np.abs(new_p - p)) < tol:
+            p = new_p
+            break
+        p = new_p
+    return RATING_BASE + RATING_SCALE * np.log(p)
+
+
+def online_elo(comparisons, k_factor=4.0, seed=0, max_comparisons=ELO_MAX_COMPARISONS):
+    """
+    Sequential Elo over the comparisons in a random (seeded) order, since the
+    annotation order carries no meaning. Ties count as half a win.
+
+    Elo is defined by its update order, so this stays a loop and runs once,
+    never per bootstrap resample (the intervals come from Bradley-Terry). The
+    weight of an update decays geometrically with every later game of the
+    same model, so the ratings only depend on the last few thousand games of
+    each model; the loop runs over at most max_comparisons of them (a random
+    subset, as the order is random anyway), which bounds its cost at any log
+    size.
+    """
+    ratings = [float(RATING_BASE)] * len(comparisons.models)
+    order = np.random.default_rng(seed).permutation(len(comparisons))[:max_comparisons]
+    scores_for_a = np.array([1.0, 0.0, 0.5])[comparisons.outcome[order]]
+    for a, b, score in zip(comparisons.first[order].tolist(), comparisons.second[order].tolist(),
+                           scores_for_a.tolist()):
+        expected = 1 / (1 + 10 ** ((ratings[b] - ratings[a]) / 400))
+        delta = k_factor * (score - expected)
+        ratings[a] += delta
+        ratings[b] -= delta
+    return np.array(ratings)
+
+
+def summarize(comparisons, bootstrap=1000, confidence=0.95, seed=0, elo=True):
+    """
+    Return one dict per model with game counts, win/tie rates, Bradley-Terry
+    rating, online Elo and bootstrap confidence intervals, best first.
+    """
+    counts = comparisons.counts()
+    wins, ties, losses, games, pair_scores, pair_games = _scores(counts)
+    ratings = fit_bradley_terry(pair_scores, pair_games)
+    elo_ratings = online_elo(comparisons, seed=seed) if elo and len(comparisons) else None
+
+    win_ci = bt_ci = None
+    n = int(counts.sum())
+    if bootstrap and n:
+        # Resampling comparisons with replacement == a multinomial over the cells
+        rng = np.random.default_rng(seed)
+        samples = rng.multinomial(n, counts.ravel() / n, size=bootstrap).reshape((bootstrap,) + counts.shape)
+        b_wins, _, _, b_games, b_pair_scores, b_pair_games = _scores(samples)
+        b_win_rates = b_wins / np.maximum(b_games, 1)
+        b_ratings = np.array([fit_bradley_terry(s, g) for s, g in zip(b_pair_scores, b_pair_games)])
+        tail = (1 - confidence) / 2 * 100
+        win_ci = np.percentile(b_win_rates, [tail, 100 - tail], axis=0)
+        bt_ci = np.percentile(b_ratings, [tail, 100 - tail], axis=0)
+
+    results = []
+    for i, model in enumerate(comparisons.models):
+        safe_games = max(int(games[i]), 1)
+        result = {
+            "model": model,
+            "games": int(games[i]),
+            "wins": int(wins[i]),
+            "ties": int(ties[i]),
+            "losses": int(losses[i]),
+            "win_rate": float(wins[i] / safe_games),
+            "tie_rate": float(ties[i] / safe_games),
+            "bt_rating": float(ratings[i]),
+        }
+        if elo_ratings is not None:
+            result["elo"] = float(elo_ratings[i])
+        if win_ci is not None:
+            result["win_rate_ci"] = [float(win_ci[0][i]), float(win_ci[1][i])]
+            result["bt_rating_ci"] = [float(bt_ci[0][i]), float(bt_ci[1][i])]
+        results.append(result)
+    results.sort(key=lambda r: r["bt_rating"], reverse=True)
+    return results
+
+
+def format_summary(results):
+    """
+    Render summarize() output as a plain-text table.
+    """
+    lines = [f"{'model':<24} {'games':>8} {'win':>7} {'tie':>7} {'Elo':>6} {'BT rating':>10}  CI"]
+    for r in results:
+        ci = r.get("bt_rating_ci")
+        ci_text = f"[{ci[0]:.0f}, {ci[1]:.0f}]" if ci else ""
+        elo_text = f"{r['elo']:.0f}" if "elo" in r else "-"
+        lines.append(
+            f"{r['model'][:24]:<24} {r['games']:>8} {r['win_rate']:>7.1%} {r['tie_rate']:>7.1%} "
+            f"{elo_text:>6} {r['bt_rating']:>10.0f}  {ci_text}"
+        )
+    return "\n".join(lines)
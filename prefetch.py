@@ -0,0 +1,286 @@
+import io
+
+from PyQt5.QtGui import QImage, QImageReader, QImageIOHandler
+from PyQt5.QtCore import Qt, QObject, QRunnable, QThreadPool, QBuffer, QByteArray, QIODevice, pyqtSignal
+
+import archive_source
+from image_cache import ImageCache
+from latency import recorder
+
+
+def open_reader(path):
+    """
+    Return a QImageReader for path, reading archive members from memory.
+    The reader keeps its QBuffer alive as reader.buffer.
+    """
+    if archive_source.split_member(path) is None:
+        return QImageReader(path)
+    buffer = QBuffer()
+    buffer.setData(QByteArray(archive_source.read_member(path)))
+    buffer.open(QIODevice.ReadOnly)
+    # Qt picks the handler from the content; the extension is a hint
+    reader = QImageReader(buffer, path.rsplit(".", 1)[-1].lower().encode("ascii"))
+    reader.setDecideFormatFromContent(True)
+    reader.buffer = buffer
+    return reader
+
+
+def read_scaled(path, width, height):
+    """
+    Decode path at (close to) the size that fits in width x height.
+
+    Formats whose Qt handler supports ScaledSize (JPEG) are decoded at reduced
+    resolution via DCT scaling, so full-size pixels are never materialised.
+    Other formats are decoded fully and then smoothly downscaled. Files Qt
+    cannot read are tried with Pillow. Returns a null QImage on failure.
+    """
+    try:
+        reader = open_reader(path)
+    except (OSError, KeyError, ValueError) as e:
+        print(f"Failed to load image: {path}, Error: {e}")
+        return QImage()
+    source_size = reader.size()
+    if not source_size.isValid() or (source_size.width() <= width and source_size.height() <= height):
+        image = reader.read()
+        return image if not image.isNull() else read_scaled_pillow(path, width, height)
+
+    target = source_size.scaled(width, height, Qt.KeepAspectRatio)
+    if reader.supportsOption(QImageIOHandler.ScaledSize):
+        reader.setScaledSize(target)
+        image = reader.read()
+        if not image.isNull():
+            return image
+        reader = open_reader(path)
+
+    image = reader.read()
+    if image.isNull():
+        return read_scaled_pillow(path, width, height)
+    with recorder.time("scale"):
+        return image.scaled(target, Qt.IgnoreAspectRatio, Qt.SmoothTransformation)
+
+
+def read_scaled_pillow(path, width, height):
+    """
+    Fallback decoder using Pillow's draft mode (JPEG) and thumbnail().
+    """
+    try:
+        from PIL import Image
+    except ImportError:
+        return QImage()
+    try:
+        source = path
+        if archive_source.split_member(path) is not None:
+            source = io.BytesIO(archive_source.read_member(path))
+        with Image.open(source) as im:
+            im.draft("RGB", (width, height))
+            im = im.convert("RGBA")
+            im.thumbnail((width, height), Image.LANCZOS)
+            data = im.tobytes("raw", "RGBA")
+            # Copy so the QImage owns its pixels after data is released
+            return QImage(data, im.width, im.height, im.width * 4, QImage.Format_RGBA8888).copy()
+    except Exception as e:
+        print(f"Failed to load image: {path}, Error: {e}")
+        return QImage()
+
+
+def decode_image(path, width, height, thumbnails=None):
+    """
+    Decode an image file and downscale it to fit in width x height.
+    Reads from the ThumbnailStore first when one is given, and stores the
+    result there on a miss. Returns a null QImage on failure. Safe to call
+    from worker threads.
+    """
+    size = (width, height)
+    if thumbnails is not None:
+        thumb_path = thumbnails.find(path, size)
+        if thumb_path:
+            with recorder.time("thumbnail_read"):
+                image = QImage(thumb_path)
+            if not image.isNull():
+                return image
+
+    with recorder.time("decode"):
+        image = read_scaled(path, width, height)
+    if image.isNull():
+        return image
+
+    if thumbnails is not None:
+        has_alpha = image.hasAlphaChannel()
+        thumbnails.write(
+            path,
+            size,
+            has_alpha,
+            lambda tmp_path: image.save(tmp_path, "PNG" if has_alpha else "JPG", -1 if has_alpha else 90),
+        )
+    return image
+
+
+class _DecodeSignals(QObject):
+    # task, decoded image
+    finished = pyqtSignal(object, QImage)
+
+
+class DecodeTask(QRunnable):
+    def __init__(self, engine, path, generation):
+        super().__init__()
+        self.setAutoDelete(False)
+        self.engine = engine
+        self.path = path
+        self.generation = generation
+        self.size = engine.size
+        self.key = None
+        self.signals = _DecodeSignals()
+
+    def run(self):
+        # Skip work that was cancelled while waiting in the queue
+        if self.generation != self.engine.generation:
+            image = QImage()
+        else:
+            self.key = ImageCache.make_key(self.path, self.size)
+            width, height = self.size
+            image = decode_image(self.path, width, height, self.engine.thumbnails)
+        self.signals.finished.emit(self, image)
+
+
+class PrefetchEngine(QObject):
+    """
+    Decodes and downscales upcoming image pairs on a QThreadPool.
+
+    `schedule()` is given the paths around the current pair in priority order;
+    decoded QImages go into an ImageCache, and queued work for paths that left
+    the window is cancelled. `reset()` cancels all queued work, e.g. when the
+    image list or display size changes. All bookkeeping happens on the GUI
+    thread; workers only decode.
+    """
+
+    image_ready = pyqtSignal(str)
+
+    def __init__(self, lookahead=4, lookbehind=2, workers=2, size=(400, 400), cache=None, thumbnails=None,
+                 parent=None):
+        super().__init__(parent)
+        self.lookahead = lookahead
+        self.lookbehind = lookbehind
+        self.size = tuple(size)
+        self.cache = cache if cache is not None else ImageCache()
+        # Optional ThumbnailStore read before decoding the source image
+        self.thumbnails = thumbnails
+
+        self.pool = QThreadPool(self)
+        self.pool.setMaxThreadCount(max(1, workers))
+
+        # Bumped on reset so results of cancelled tasks are ignored
+        self.generation = 0
+
+        # { path: cache key } of the last image decoded for each path, pruned
+        # to the keys still in the cache (see _remember)
+        self.latest = {}
+        # { path: DecodeTask } queued or running for the current window
+        self.pending = {}
+        # Every task not yet finished, so running ones stay referenced after a reset
+        self.tasks = set()
+        # Paths that failed to decode, not retried until the next reset
+        self.failed = set()
+
+    def window(self, paths_by_index, current_index):
+        """
+        Return the paths to prefetch around current_index, nearest first,
+        looking ahead before looking back. paths_by_index(i) returns the
+        paths for pair i.
+        """
+        indexes = [current_index]
+        indexes += [current_index + i for i in range(1, self.lookahead + 1)]
+        indexes += [current_index - i for i in range(1, self.lookbehind + 1)]
+
+        paths = []
+        for i in indexes:
+            for path in paths_by_index(i) or ():
+                if path not in paths:
+                    paths.append(path)
+        return paths
+
+    def schedule(self, paths):
+        wanted = set(paths)
+
+        # Cancel queued work for paths that left the window
+        for path in list(self.pending):
+            if path not in wanted:
+                self._cancel(self.pending.pop(path))
+
+        for path in paths:
+            if path in self.pending or path in self.failed:
+                continue
+            key = self.latest.get(path)
+            if key is not None:
+                if key in self.cache:
+                    continue
+                # Evicted since
+                del self.latest[path]
+            task = DecodeTask(self, path, self.generation)
+            task.signals.finished.connect(self._on_finished)
+            self.pending[path] = task
+            self.tasks.add(task)
+            self.pool.start(task)
+
+    def take(self, path):
+        """
+        Return the decoded QImage for path if it is cached, otherwise None.
+        """
+        key = ImageCache.make_key(path, self.size)
+        if key is None:
+            return None
+        return self.cache.get(key)
+
+    def put(self, path, image):
+        """
+        Cache an image decoded outside the pool, e.g. by a synchronous fallback.
+        """
+        key = ImageCache.make_key(path, self.size)
+        if key is not None and not image.isNull():
+            self.cache.put(key, image, image.sizeInBytes())
+            self._remember(path, key)
+
+    def set_size(self, size):
+        if tuple(size) != tuple(self.size):
+            self.size = tuple(size)
+            self.latest.clear()
+            self.reset()
+
+    def reset(self):
+        self.generation += 1
+        for task in self.pending.values():
+            self._cancel(task)
+        self.pending.clear()
+        self.failed = set()
+
+    def shutdown(self):
+        self.reset()
+        self.pool.waitForDone()
+
+    def _remember(self, path, key):
+        self.latest[path] = key
+        # The cache evicts without telling us; drop the evicted keys once they
+        # outnumber the cached ones, so this stays proportional to the cache
+        if len(self.latest) > 2 * len(self.cache) + self.lookahead + self.lookbehind:
+            self.latest = {path: key for path, key in self.latest.items() if key in self.cache}
+
+    def _cancel(self, task):
+        # Tasks still in the queue are removed; running ones finish and are ignored
+        if self.pool.tryTake(task):
+            self.tasks.discard(task)
+
+    def _on_finished(self, task, image):
+        self.tasks.discard(task)
+        path = task.path
+        if self.pending.get(path) is task:
+            del self.pending[path]
+        if task.generation != self.generation:
+            return
+        if image.isNull():
+            print(f"Failed to load image: {path}")
+            self.failed.add(path)
+            return
+        # Keep results even if the path left the window, the cache bounds memory
+        if task.key is not None and task.size == self.size:
+            self.cache.put(task.key, image, image.sizeInBytes())
+            self._remember(path, task.key)
+        self.image_ready.emit(path)
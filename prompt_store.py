@@ -0,0 +1,260 @@
+import os
+import sys
+import json
+import time
+import sqlite3
+import argparse
+
+
+# Bytes read per chunk when streaming a prompt file
+CHUNK_SIZE = 1 << 20
+
+
+def _check_pair(key, value):
+    if not isinstance(key, str) or not isinstance(value, str):
+        raise ValueError("All keys and values in prompts must be strings.")
+
+
+def _iter_json_object(f):
+    """
+    Stream (key, value) pairs from a flat JSON object without loading the
+    whole file. Uses ijson when it is installed, otherwise a small chunked
+    parser built on json.JSONDecoder.raw_decode.
+    """
+    try:
+        import ijson
+    except ImportError:
+        ijson = None
+
+    if ijson is not None:
+        try:
+            for key, value in ijson.kvitems(f, ""):
+                yield key, value
+        except ijson.JSONError as e:
+            raise ValueError(f"Invalid prompt file: {e}")
+        return
+
+    decoder = json.JSONDecoder()
+    buf = ""
+    pos = 0
+    eof = False
+
+    def fill():
+        # Drop consumed text and append the next chunk; False at end of file
+        nonlocal buf, pos, eof
+        chunk = f.read(CHUNK_SIZE)
+        buf = buf[pos:] + chunk
+        pos = 0
+        eof = not chunk
+        return bool(chunk)
+
+    def skip_ws():
+        nonlocal pos
+        while True:
+            while pos < len(buf) and buf[pos] in " \t\r\n":
+                pos += 1
+            if pos < len(buf) or not fill():
+                return
+
+    def expect(chars):
+        nonlocal pos
+        skip_ws()
+        if pos >= len(buf) or buf[pos] not in chars:
+            raise ValueError("Prompt file must contain a dictionary.")
+        pos += 1
+        return buf[pos - 1]
+
+    def decode():
+        nonlocal pos
+        skip_ws()
+        while True:
+            try:
+                value, end = decoder.raw_decode(buf, pos)
+            except json.JSONDecodeError as e:
+                # The token may continue in the next chunk
+                if not eof and fill():
+                    continue
+                raise ValueError(f"Invalid prompt file: {e}")
+            # A number or literal may also continue in the next chunk
+            if end == len(buf) and not eof and fill():
+                continue
+            pos = end
+            return value
+
+    def finish():
+        # Like json.load, nothing but whitespace may follow the object
+        skip_ws()
+        if pos < len(buf):
+            raise ValueError(f"Invalid prompt file: extra data after the object: {buf[pos:pos + 20]!r}")
+
+    expect("{")
+    skip_ws()
+    if pos < len(buf) and buf[pos] == "}":
+        pos += 1
+        finish()
+        return
+    while True:
+        key = decode()
+        expect(":")
+        value = decode()
+        yield key, value
+        if expect(",}") == "}":
+            finish()
+            return
+
+
+def iter_prompts(path):
+    """
+    Yield (image name, prompt) pairs from a prompt file, validating as it goes.
+
+    Supports the imgName2prompt.json layout ({"0.png": "prompt", ...}) and a
+    JSONL variant with one {"image": ..., "prompt": ...} or {"0.png": "prompt"}
+    object per line.
+    """
+    with open(path, 'r', encoding='utf-8') as f:
+        if path.lower().endswith(".jsonl"):
+            for line in f:
+                line = line.strip()
+                if not line:
+                    continue
+                record = json.loads(line)
+                if not isinstance(record, dict):
+                    raise ValueError("Each line of a JSONL prompt file must contain a dictionary.")
+                if "image" in record and "prompt" in record:
+                    record = {record["image"]: record["prompt"]}
+                for key, value in record.items():
+                    _check_pair(key, value)
+                    yield key, value
+        else:
+            for key, value in _iter_json_object(f):
+                _check_pair(key, value)
+                yield key, value
+
+
+def load_prompts_for(path, wanted):
+    """
+    Stream a prompt file and keep only the prompts for the lowercase image
+    names in wanted. Returns { lowercase name: prompt }.
+    """
+    prompts = {}
+    for key, value in iter_prompts(path):
+        key_lower = key.lower()
+        if key_lower in wanted:
+            prompts[key_lower] = value
+    return prompts
+
+
+def index_path_for(path):
+    return path + ".sqlite"
+
+
+class PromptIndex:
+    """
+    SQLite index of a prompt file for random access by lowercase image name.
+    Build it once with build_prompt_index (or `python prompt_store.py FILE`);
+    it records the source file's size and mtime so a stale index is detected.
+    """
+
+    def __init__(self, index_path):
+        self.index_path = index_path
+        self.conn = sqlite3.connect(index_path)
+
+    def is_fresh(self, source_path):
+        try:
+            row = self.conn.execute("SELECT size, mtime_ns FROM meta").fetchone()
+            st = os.stat(source_path)
+        except (sqlite3.Error, OSError):
+            return False
+        return row is not None and tuple(row) == (st.st_size, st.st_mtime_ns)
+
+    def get(self, name_lower):
+        row = self.conn.execute("SELECT prompt FROM prompts WHERE name = ?", (name_lower,)).fetchone()
+        return row[0] if row else None
+
+    def get_many(self, names_lower):
+        """
+        Return { lowercase name: prompt } for the names that have a prompt.
+        """
+        prompts = {}
+        names = list(names_lower)
+        # Stay under SQLite's bound-parameter limit
+        for start in range(0, len(names), 500):
+            batch = names[start:start + 500]
+            placeholders = ",".join("?" * len(batch))
+            for name, prompt in self.conn.execute(
+                f"SELECT name, prompt FROM prompts WHERE name IN ({placeholders})", batch
+            ):
+                prompts[name] = prompt
+        return prompts
+
+    def __len__(self):
+        return self.conn.execute("SELECT COUNT(*) FROM prompts").fetchone()[0]
+
+    def close(self):
+        self.conn.close()
+
+
+def build_prompt_index(source_path, index_path=None):
+    """
+    Stream source_path into a SQLite index and return its path. The index is
+    built under a temporary name and renamed into place when complete.
+    """
+    index_path = index_path or index_path_for(source_path)
+    tmp_path = f"{index_path}.{os.getpid()}.tmp"
+    if os.path.exists(tmp_path):
+        os.remove(tmp_path)
+
+    st = os.stat(source_path)
+    conn = sqlite3.connect(tmp_path)
+    try:
+        conn.execute("PRAGMA journal_mode = OFF")
+        conn.execute("PRAGMA synchronous = OFF")
+        conn.execute("CREATE TABLE meta (source TEXT, size INTEGER, mtime_ns INTEGER)")
+        conn.execute("CREATE TABLE prompts (name TEXT PRIMARY KEY, prompt TEXT NOT NULL)")
+        conn.execute("INSERT INTO meta VALUES (?, ?, ?)", (os.path.abspath(source_path), st.st_size, st.st_mtime_ns))
+
+        batch = []
+        for key, value in iter_prompts(source_path):
+            batch.append((key.lower(), value))
+            if len(batch) >= 10000:
+                conn.executemany("INSERT OR REPLACE INTO prompts VALUES (?, ?)", batch)
+                batch = []
+        conn.executemany("INSERT OR REPLACE INTO prompts VALUES (?, ?)", batch)
+        conn.commit()
+    finally:
+        conn.close()
+
+    os.replace(tmp_path, index_path)
+    return index_path
+
+
+def open_fresh_index(source_path):
+    """
+    Return a PromptIndex for source_path if an up-to-date one exists, otherwise None.
+    """
+    index_path = index_path_for(source_path)
+    if not os.path.exists(index_path):
+        return None
+    index = PromptIndex(index_path)
+    if index.is_fresh(source_path):
+        return index
+    index.close()
+    return None
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Build a SQLite index of a prompt file for fast lookup.")
+    parser.add_argument("prompt_file", help="Prompt JSON or JSONL file (e.g. imgName2prompt.json).")
+    parser.add_argument("--output", default=None, help="Index path (default: <prompt_file>.sqlite).")
+    args = parser.parse_args(argv)
+
+    started = time.perf_counter()
+    index_path = build_prompt_index(args.prompt_file, args.output)
+    index = PromptIndex(index_path)
+    print(f"Indexed {len(index)} prompts into {index_path} ({time.perf_counter() - started:.1f}s)")
+    index.close()
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
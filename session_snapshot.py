@@ -0,0 +1,100 @@
+"""
+Session snapshots, so the annotator reopens where it left off without the
+folder and range dialogs, folder scans or prompt and annotation passes.
+Qt-free.
+
+A snapshot (image_comparer_session.json in the working directory by
+default) is one compact JSON file with:
+
+    folder_a, folder_b       the image sources, with the scan options and
+                             pairing rules they were indexed with
+    source_a, source_b       the listing of each source (FolderIndex.state()
+                             or ArchiveIndex.state()); directory mtimes, or
+                             archive sizes and mtimes, are its fingerprint
+    pairs, ranges            the pair index and the selected ranges
+    excluded, similar_pairs  pairs left out by the pre-flight check and
+                             pairs flagged by the hash pre-pass
+    current                  the pair on screen
+    prompts_file, prompts    the prompt file, its size and mtime, and the
+                             prompts of the selected pairs
+    annotations_file         re-read on restore: it is the source of truth
+                             and other sessions may have added to it
+
+Restoring a source costs one stat per indexed directory (or archive). Only
+a source whose fingerprint changed is scanned again, and then the pair list
+is rebuilt from the indexes.
+"""
+import os
+import json
+
+from folder_index import FolderIndex
+from archive_source import ArchiveIndex, open_image_source
+from annotation_journal import atomic_write_json
+from pairing import KeyedIndex
+
+
+SESSION_VERSION = 1
+DEFAULT_SESSION_PATH = "image_comparer_session.json"
+
+
+def file_fingerprint(path):
+    """
+    [size, mtime_ns] of a file, or None if it cannot be stat'ed.
+    """
+    try:
+        st = os.stat(path)
+    except (OSError, TypeError, ValueError):
+        return None
+    return [st.st_size, st.st_mtime_ns]
+
+
+def source_state(index):
+    """
+    Saved listing of an image source; a pairing rule's KeyedIndex is saved
+    as the index it wraps, since keys are cheap to derive again.
+    """
+    if isinstance(index, KeyedIndex):
+        index = index.index
+    if isinstance(index, ArchiveIndex):
+        return {"kind": "archive", **index.state()}
+    return {"kind": "folder", **index.state()}
+
+
+def restore_source(state, recursive=False, workers=1, verbose=True):
+    """
+    Return (index, unchanged): the index rebuilt from source_state() when its
+    fingerprint still matches, otherwise a fresh scan of the same location.
+    """
+    if state["kind"] == "archive":
+        index = ArchiveIndex.from_state(state, verbose=verbose)
+    elif state.get("recursive") == recursive:
+        index = FolderIndex.from_state(state, verbose=verbose, workers=workers)
+    else:
+        index = None
+    if index is not None:
+        return index, True
+    if verbose:
+        print(f"{state['folder']} changed since the session was saved; scanning it again")
+    return open_image_source(state["folder"], recursive, workers, verbose=verbose), False
+
+
+def save_session(path, session):
+    atomic_write_json(path, {"version": SESSION_VERSION, **session}, indent=None)
+
+
+def load_session(path):
+    """
+    Return the saved session, or None if there is none or it cannot be used.
+    """
+    try:
+        with open(path, "r", encoding="utf-8") as f:
+            session = json.load(f)
+    except FileNotFoundError:
+        return None
+    except (OSError, ValueError) as e:
+        print(f"Ignoring the session snapshot {path}: {e}")
+        return None
+    if not isinstance(session, dict) or session.get("version") != SESSION_VERSION:
+        print(f"Ignoring the session snapshot {path}: unsupported version")
+        return None
+    return session
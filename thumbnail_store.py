@@ -0,0 +1,331 @@
+import io
+import os
+import sys
+import json
+import time
+import sqlite3
+import hashlib
+import argparse
+from concurrent.futures import ProcessPoolExecutor
+
+import archive_source
+
+
+# Name of the sidecar directory created next to the source images
+SIDECAR_DIR = ".thumbnails"
+
+
+class ThumbnailStore:
+    """
+    On-disk cache of display-size copies of source images.
+
+    Thumbnails are keyed by source filename, file size and mtime, so several
+    annotators can share one store and an edited source is never served
+    stale. Opaque images are stored as JPEG and images with an alpha channel
+    as PNG. With root=None each source folder gets a `.thumbnails` sidecar;
+    otherwise every folder gets a subdirectory of root, named after the
+    folder and a hash of its absolute path (e.g. `samples-3f2a9c0d1e4b`), so
+    run1/samples and run2/samples do not share one.
+    """
+
+    def __init__(self, root=None):
+        self.root = root
+
+    def base_dir(self, folder):
+        if self.root:
+            folder = os.path.abspath(folder)
+            digest = hashlib.sha1(folder.encode("utf-8", "surrogateescape")).hexdigest()[:12]
+            return os.path.join(self.root, f"{os.path.basename(folder)}-{digest}")
+        return os.path.join(folder, SIDECAR_DIR)
+
+    def sidecar_path(self, location, filename):
+        """
+        Path of a per-folder cache file (e.g. hashes.sqlite) for an image
+        folder, archive or shard directory; a single archive uses the folder
+        holding it.
+        """
+        if not os.path.isdir(location):
+            location = os.path.dirname(os.path.abspath(location))
+        return os.path.join(self.base_dir(location), filename)
+
+    def _locate(self, source_path, st=None):
+        """
+        Return (base directory, digest of name, size and mtime) for the
+        cached copies of source_path, or None if it cannot be stat'ed.
+        """
+        if st is None:
+            try:
+                st = archive_source.stat(source_path)
+            except OSError:
+                return None
+        folder, name = os.path.split(source_path)
+        member = archive_source.split_member(source_path)
+        if member is not None:
+            # Archive members get the thumbnails of the directory holding the archive
+            archive_path, member_name = member
+            folder = os.path.dirname(archive_path)
+            name = f"{os.path.basename(archive_path)}/{member_name}"
+        digest = hashlib.sha1(f"{name}\0{st.st_size}\0{st.st_mtime_ns}".encode("utf-8")).hexdigest()
+        return self.base_dir(folder), digest
+
+    def thumb_path(self, source_path, size, has_alpha=False, st=None):
+        """
+        Return where the thumbnail of source_path at size (width, height) lives,
+        or None if the source cannot be stat'ed.
+        """
+        location = self._locate(source_path, st)
+        if location is None:
+            return None
+        base, digest = location
+        ext = ".png" if has_alpha else ".jpg"
+        width, height = size
+        return os.path.join(base, f"{width}x{height}", digest[:2], digest + ext)
+
+    def tile_dir(self, source_path, st=None):
+        """
+        Return the directory of the tile pyramid of source_path (see
+        tile_pyramid.py), or None if the source cannot be stat'ed.
+        """
+        location = self._locate(source_path, st)
+        if location is None:
+            return None
+        base, digest = location
+        return os.path.join(base, "tiles", digest[:2], digest)
+
+    def find(self, source_path, size):
+        """
+        Return the path of an existing thumbnail for source_path, otherwise None.
+        """
+        try:
+            st = archive_source.stat(source_path)
+        except OSError:
+            return None
+        for has_alpha in (False, True):
+            path = self.thumb_path(source_path, size, has_alpha, st)
+            if os.path.exists(path):
+                return path
+        return None
+
+    def write(self, source_path, size, has_alpha, writer):
+        """
+        Store a thumbnail atomically. writer(tmp_path) must write the image to
+        tmp_path and return True on success. Returns the thumbnail path or None.
+        Failures (e.g. a read-only dataset folder) are reported and ignored.
+        """
+        path = self.thumb_path(source_path, size, has_alpha)
+        if path is None:
+            return None
+        root, ext = os.path.splitext(path)
+        tmp_path = f"{root}.{os.getpid()}.{id(writer)}.tmp{ext}"
+        try:
+            os.makedirs(os.path.dirname(path), exist_ok=True)
+            if not writer(tmp_path):
+                raise OSError("writer failed")
+            os.replace(tmp_path, path)
+            return path
+        except OSError as e:
+            print(f"Failed to write thumbnail for {source_path}: {e}")
+            try:
+                os.remove(tmp_path)
+            except OSError:
+                pass
+            return None
+
+
+class SidecarCache:
+    """
+    SQLite cache of per-image results (e.g. perceptual hashes) in a sidecar
+    file, keyed by path, size and mtime; values are stored as JSON. Falls
+    back to memory when the file cannot be written (e.g. a read-only dataset).
+    """
+
+    def __init__(self, path):
+        self.path = path
+        self.conn = None
+        self.memory = {}
+        try:
+            os.makedirs(os.path.dirname(path), exist_ok=True)
+            self.conn = sqlite3.connect(path)
+            self.conn.execute(
+                "CREATE TABLE IF NOT EXISTS results (path TEXT PRIMARY KEY, size INTEGER, mtime_ns INTEGER, value TEXT)"
+            )
+        except (OSError, sqlite3.Error) as e:
+            print(f"Not caching results in {path}: {e}")
+            self.conn = None
+
+    def get_many(self, stats):
+        """
+        Return { path: value } for the { path: (size, mtime_ns) } entries whose
+        cached value is current.
+        """
+        if self.conn is None:
+            return {path: self.memory[path][1] for path, signature in stats.items()
+                    if path in self.memory and self.memory[path][0] == signature}
+        found = {}
+        paths = list(stats)
+        for start in range(0, len(paths), 500):
+            batch = paths[start:start + 500]
+            placeholders = ",".join("?" * len(batch))
+            for path, size, mtime_ns, value in self.conn.execute(
+                f"SELECT path, size, mtime_ns, value FROM results WHERE path IN ({placeholders})", batch
+            ):
+                if stats[path] == (size, mtime_ns):
+                    found[path] = json.loads(value)
+        return found
+
+    def put_many(self, rows):
+        """
+        Store (path, (size, mtime_ns), value) rows.
+        """
+        if self.conn is None:
+            for path, signature, value in rows:
+                self.memory[path] = (signature, value)
+            return
+        try:
+            with self.conn:
+                self.conn.executemany(
+                    "INSERT OR REPLACE INTO results VALUES (?, ?, ?, ?)",
+                    ((path, size, mtime_ns, json.dumps(value)) for path, (size, mtime_ns), value in rows),
+                )
+        except sqlite3.Error as e:
+            print(f"Failed to cache results in {self.path}: {e}")
+
+    def close(self):
+        if self.conn is not None:
+            self.conn.close()
+
+
+def map_cached(index, names, filename, batch_worker, thumbnail_dir=None, workers=None, batch_size=128):
+    """
+    Return { lowercase name: result } of batch_worker for the images of an
+    image source, computing only what the sidecar cache `filename` does not
+    have for the file's current size and mtime. batch_worker runs in a
+    process pool on lists of (path, archive path or None) and returns one
+    JSON-serializable result per job, or None for no result (not cached).
+    Images that cannot be stat'ed are left out.
+    """
+    stats = {}
+    path_of = {}
+    for img_lower in names:
+        path = index.path_of(index.by_lower[img_lower])
+        try:
+            st = archive_source.stat(path)
+        except OSError:
+            continue
+        stats[path] = (st.st_size, st.st_mtime_ns)
+        path_of[img_lower] = path
+
+    cache = SidecarCache(ThumbnailStore(thumbnail_dir).sidecar_path(index.folder, filename))
+    try:
+        results = cache.get_many(stats)
+        jobs = []
+        for path in stats:
+            if path not in results:
+                member = archive_source.split_member(path)
+                jobs.append((path, member[0] if member else None))
+        if jobs:
+            batches = [jobs[i:i + batch_size] for i in range(0, len(jobs), batch_size)]
+            rows = []
+            with ProcessPoolExecutor(max_workers=workers or os.cpu_count()) as executor:
+                for batch, batch_results in zip(batches, executor.map(batch_worker, batches)):
+                    for (path, _), result in zip(batch, batch_results):
+                        if result is not None:
+                            results[path] = result
+                            rows.append((path, stats[path], result))
+            cache.put_many(rows)
+    finally:
+        cache.close()
+    return {img_lower: results[path] for img_lower, path in path_of.items() if path in results}
+
+
+def read_source(path, archive_path):
+    """
+    Bytes of an image file or archive member (in a worker process).
+    """
+    if archive_path is not None:
+        # Opened once per worker process, then shared through the registry
+        archive_source.open_archive(archive_path)
+        return archive_source.read_member(path)
+    with open(path, "rb") as f:
+        return f.read()
+
+
+def _build_one(job):
+    """
+    Worker for build_thumbnails: create one thumbnail with Pillow if missing.
+    Returns "built", "cached" or "failed".
+    """
+    root, source_path, archive_path, size = job
+    from PIL import Image
+
+    source = source_path
+    if archive_path is not None:
+        # Opened once per worker process, then shared through the registry
+        archive_source.open_archive(archive_path)
+        source = io.BytesIO(archive_source.read_member(source_path))
+
+    store = ThumbnailStore(root)
+    if store.find(source_path, size):
+        return "cached"
+    try:
+        with Image.open(source) as im:
+            # Let JPEG decode at reduced resolution before the final resample
+            im.draft("RGB", size)
+            has_alpha = im.mode in ("RGBA", "LA", "PA") or (im.mode == "P" and "transparency" in im.info)
+            im = im.convert("RGBA" if has_alpha else "RGB")
+            im.thumbnail(size, Image.LANCZOS)
+
+            def writer(tmp_path):
+                if has_alpha:
+                    im.save(tmp_path, "PNG")
+                else:
+                    im.save(tmp_path, "JPEG", quality=90)
+                return True
+
+            return "built" if store.write(source_path, size, has_alpha, writer) else "failed"
+    except Exception as e:
+        print(f"Failed to load image: {source_path}, Error: {e}")
+        return "failed"
+
+
+def build_thumbnails(folders, size, root=None, workers=None):
+    """
+    Fill the thumbnail store for every image in folders using a process pool.
+    Returns { "built": n, "cached": n, "failed": n }.
+    """
+    jobs = []
+    for folder in folders:
+        index = archive_source.open_image_source(folder, verbose=False)
+        for name in index.by_lower.values():
+            path = index.path_of(name)
+            member = archive_source.split_member(path)
+            jobs.append((root, path, member[0] if member else None, tuple(size)))
+
+    counts = {"built": 0, "cached": 0, "failed": 0}
+    with ProcessPoolExecutor(max_workers=workers or os.cpu_count()) as executor:
+        for result in executor.map(_build_one, jobs, chunksize=64):
+            counts[result] += 1
+    return counts
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Pre-build display-size thumbnails for image folders.")
+    parser.add_argument("folders", nargs="+",
+                        help="Image folders, archives or shard directories (e.g. Folder A and Folder B).")
+    parser.add_argument("--size", type=int, nargs=2, default=(400, 400), metavar=("WIDTH", "HEIGHT"),
+                        help="Thumbnail size; must match the display size used by the annotator.")
+    parser.add_argument("--thumbnail-dir", default=None,
+                        help="Shared thumbnail directory (default: a .thumbnails folder inside each image folder).")
+    parser.add_argument("--workers", type=int, default=None,
+                        help="Number of worker processes (default: all cores).")
+    args = parser.parse_args(argv)
+
+    started = time.perf_counter()
+    counts = build_thumbnails(args.folders, args.size, args.thumbnail_dir, args.workers)
+    elapsed = time.perf_counter() - started
+    print(f"Built {counts['built']}, already cached {counts['cached']}, failed {counts['failed']} ({elapsed:.1f}s)")
+    return 1 if counts["failed"] else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,280 @@
+"""
+Tile pyramids of large images, so a zoomed view only decodes the tiles it
+shows. Qt-free; needs Pillow.
+
+Level 0 is the full-resolution image and each level above halves it, up to
+a level that fits in one tile. Every level is cut into TILE_SIZE square
+tiles (JPEG, or PNG for images with an alpha channel) stored with the
+thumbnails (ThumbnailStore.tile_dir), and keyed like them by filename, size
+and mtime:
+
+    <tile dir>/pyramid.json             width, height, tile size, alpha
+    <tile dir>/<level>/<col>_<row>.jpg
+    <tile dir>/<level>/done             written once the level is complete
+
+Levels are built on first use. Building a level decodes the image at that
+level's resolution (JPEG decodes at 1/2, 1/4 or 1/8 scale directly) and
+writes it and every coarser level still missing, coarsest first. The
+overview of a 16k x 16k JPEG is thus a 2k decode. Other formats are decoded
+at full size once and give all levels at the same time. Builds run in
+worker processes, so the memory of a full-size decode is returned to the
+system as soon as the tiles are written.
+"""
+import io
+import os
+import sys
+import json
+import math
+import time
+import argparse
+from concurrent.futures import ProcessPoolExecutor
+
+import archive_source
+from annotation_journal import atomic_write_json
+from thumbnail_store import ThumbnailStore
+
+
+# Edge length of a tile in pixels
+TILE_SIZE = 512
+META_FILE = "pyramid.json"
+DONE_FILE = "done"
+
+
+class TilePyramid:
+    """
+    Geometry and file layout of the tile pyramid of one image.
+    """
+
+    def __init__(self, directory, width, height, has_alpha=False, tile_size=TILE_SIZE):
+        self.directory = directory
+        self.width = width
+        self.height = height
+        self.has_alpha = has_alpha
+        self.tile_size = tile_size
+        self.levels = 1
+        while max(self.level_size(self.levels - 1)) > tile_size:
+            self.levels += 1
+
+    def level_size(self, level):
+        """
+        (width, height) of a level; odd sizes round up, like Image.reduce().
+        """
+        factor = 1 << level
+        return (-(-self.width // factor), -(-self.height // factor))
+
+    def level_for_scale(self, scale):
+        """
+        Coarsest level with at least `scale` pixels per source pixel.
+        """
+        if scale >= 1:
+            return 0
+        return min(int(math.floor(-math.log2(scale))), self.levels - 1)
+
+    def grid(self, level):
+        """
+        (columns, rows) of tiles of a level.
+        """
+        width, height = self.level_size(level)
+        return (-(-width // self.tile_size), -(-height // self.tile_size))
+
+    def tile_path(self, level, col, row):
+        ext = ".png" if self.has_alpha else ".jpg"
+        return os.path.join(self.directory, str(level), f"{col}_{row}{ext}")
+
+    def is_built(self, level):
+        return os.path.exists(os.path.join(self.directory, str(level), DONE_FILE))
+
+    def meta(self):
+        return {"width": self.width, "height": self.height, "has_alpha": self.has_alpha,
+                "tile_size": self.tile_size}
+
+
+def _open_source(source_path):
+    # Archive members are read from the archive's memory map
+    if archive_source.split_member(source_path) is not None:
+        return io.BytesIO(archive_source.read_member(source_path))
+    return source_path
+
+
+def open_pyramid(store, source_path):
+    """
+    Return the TilePyramid of source_path in a ThumbnailStore, reading the
+    image header the first time. Returns None if the image cannot be
+    stat'ed or read. Nothing is decoded.
+    """
+    directory = store.tile_dir(source_path)
+    if directory is None:
+        return None
+    meta_path = os.path.join(directory, META_FILE)
+    try:
+        with open(meta_path, "r", encoding="utf-8") as f:
+            meta = json.load(f)
+        return TilePyramid(directory, meta["width"], meta["height"], meta["has_alpha"], meta["tile_size"])
+    except (OSError, ValueError, KeyError, TypeError):
+        pass
+
+    from PIL import Image
+
+    # Very large images are the point here
+    Image.MAX_IMAGE_PIXELS = None
+    try:
+        with Image.open(_open_source(source_path)) as im:
+            width, height = im.size
+            has_alpha = im.mode in ("RGBA", "LA", "PA") or (im.mode == "P" and "transparency" in im.info)
+    except Exception as e:
+        print(f"Failed to load image: {source_path}, Error: {e}")
+        return None
+    pyramid = TilePyramid(directory, width, height, has_alpha)
+    try:
+        os.makedirs(directory, exist_ok=True)
+        atomic_write_json(meta_path, pyramid.meta(), indent=None)
+    except OSError as e:
+        # The builds will report it too; the size is still known
+        print(f"Failed to write tiles for {source_path}: {e}")
+    return pyramid
+
+
+def _write_level(pyramid, level, im):
+    """
+    Cut a level image into tiles and mark the level done.
+    """
+    directory = os.path.join(pyramid.directory, str(level))
+    os.makedirs(directory, exist_ok=True)
+    tile = pyramid.tile_size
+    cols, rows = pyramid.grid(level)
+    for row in range(rows):
+        for col in range(cols):
+            box = (col * tile, row * tile, min((col + 1) * tile, im.width), min((row + 1) * tile, im.height))
+            path = pyramid.tile_path(level, col, row)
+            root, ext = os.path.splitext(path)
+            tmp_path = f"{root}.{os.getpid()}.tmp{ext}"
+            try:
+                if pyramid.has_alpha:
+                    im.crop(box).save(tmp_path, "PNG")
+                else:
+                    im.crop(box).save(tmp_path, "JPEG", quality=90)
+                os.replace(tmp_path, path)
+            except Exception:
+                # No partial tile left behind; the level is not marked done
+                try:
+                    os.remove(tmp_path)
+                except OSError:
+                    pass
+                raise
+    with open(os.path.join(directory, DONE_FILE), "w"):
+        pass
+
+
+def build_levels(pyramid, source_path, level):
+    """
+    Build `level` of a pyramid and every coarser level that is missing, plus
+    the finer levels the decode gives anyway (all of them unless the image
+    is a JPEG). Returns the levels written. Archive members need their
+    archive opened in this process.
+    """
+    if pyramid.is_built(level):
+        return []
+    from PIL import Image
+
+    Image.MAX_IMAGE_PIXELS = None
+    mode = "RGBA" if pyramid.has_alpha else "RGB"
+    with Image.open(_open_source(source_path)) as im:
+        # JPEG decodes at the smallest DCT scale that still covers the level
+        im.draft("RGB", pyramid.level_size(level))
+        # Decoded before the file is closed; leaving the block only closes the
+        # file, so the pixels are kept without a copy of a full-size image
+        im.load()
+        if im.mode != mode:
+            im = im.convert(mode)
+
+    # Finest level the decoded image covers
+    first = 0
+    while first < level and (im.width < pyramid.level_size(first)[0] or im.height < pyramid.level_size(first)[1]):
+        first += 1
+    if im.size != pyramid.level_size(first):
+        im = im.resize(pyramid.level_size(first), Image.LANCZOS)
+
+    # Halve down to the top first, then write the coarse levels before the
+    # fine ones so a viewer can show them while the rest is written
+    images = [im]
+    for _ in range(first + 1, pyramid.levels):
+        images.append(images[-1].reduce(2))
+    written = []
+    for offset in range(len(images) - 1, -1, -1):
+        if not pyramid.is_built(first + offset):
+            _write_level(pyramid, first + offset, images[offset])
+            written.append(first + offset)
+        images.pop()
+    return written
+
+
+def build_job(job):
+    """
+    Worker for process pools: build_levels for (pyramid, source path,
+    archive path or None, level). Returns the levels written.
+    """
+    pyramid, source_path, archive_path, level = job
+    if archive_path is not None:
+        # Opened once per worker process, then shared through the registry
+        archive_source.open_archive(archive_path)
+    return build_levels(pyramid, source_path, level)
+
+
+def _build_one(job):
+    """
+    Worker for build_pyramids: every level of one image. Returns "built",
+    "cached" or "failed".
+    """
+    root, source_path, archive_path = job
+    if archive_path is not None:
+        archive_source.open_archive(archive_path)
+    try:
+        pyramid = open_pyramid(ThumbnailStore(root), source_path)
+        if pyramid is None:
+            return "failed"
+        return "built" if build_levels(pyramid, source_path, 0) else "cached"
+    except Exception as e:
+        print(f"Failed to build tiles for {source_path}: {e}")
+        return "failed"
+
+
+def build_pyramids(folders, root=None, workers=None):
+    """
+    Build the whole tile pyramid of every image in folders using a process
+    pool. Returns { "built": n, "cached": n, "failed": n }.
+    """
+    jobs = []
+    for folder in folders:
+        index = archive_source.open_image_source(folder, verbose=False)
+        for name in index.by_lower.values():
+            path = index.path_of(name)
+            member = archive_source.split_member(path)
+            jobs.append((root, path, member[0] if member else None))
+
+    counts = {"built": 0, "cached": 0, "failed": 0}
+    with ProcessPoolExecutor(max_workers=workers or os.cpu_count()) as executor:
+        for result in executor.map(_build_one, jobs):
+            counts[result] += 1
+    return counts
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Pre-build the zoom tiles of very large images.")
+    parser.add_argument("folders", nargs="+",
+                        help="Image folders, archives or shard directories (e.g. Folder A and Folder B).")
+    parser.add_argument("--thumbnail-dir", default=None,
+                        help="Shared thumbnail directory (default: a .thumbnails folder inside each image folder).")
+    parser.add_argument("--workers", type=int, default=None,
+                        help="Number of worker processes (default: all cores). Each one may hold a full-size "
+                             "decode in memory.")
+    args = parser.parse_args(argv)
+
+    started = time.perf_counter()
+    counts = build_pyramids(args.folders, args.thumbnail_dir, args.workers)
+    elapsed = time.perf_counter() - started
+    print(f"Built {counts['built']}, already cached {counts['cached']}, failed {counts['failed']} ({elapsed:.1f}s)")
+    return 1 if counts["failed"] else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,506 @@
+"""
+Synchronized zoom and pan over an image pair, drawn from tile pyramids
+(tile_pyramid.py) instead of full-size QPixmaps.
+
+Each view draws only the tiles of the level that matches its scale and that
+intersect the view. Missing tiles are read on a QThreadPool, levels not built
+yet are built in worker processes, and meanwhile the view shows the next
+coarser tile it has (or the display-size image) stretched over the gap.
+Tiles are kept in an ImageCache, so memory stays bounded by the tile budget
+whatever the image size. Both views share one ZoomState and show the same
+region, as fractions of the image size, at the same magnification.
+"""
+from concurrent.futures import ProcessPoolExecutor
+
+from PyQt5.QtWidgets import QWidget, QHBoxLayout
+from PyQt5.QtGui import QImage, QPainter, QColor
+from PyQt5.QtCore import Qt, QObject, QRunnable, QThreadPool, QTimer, QRect, QRectF, pyqtSignal
+
+import archive_source
+from image_cache import ImageCache
+from tile_pyramid import open_pyramid, build_job
+from latency import recorder
+
+
+# Largest magnification: view pixels per image pixel
+MAX_ZOOM = 8.0
+# Zoom step of one mouse wheel notch or +/- key
+ZOOM_STEP = 1.25
+# How often views repaint while levels are being built, in ms
+BUILD_POLL_MS = 300
+
+
+class _TileSignals(QObject):
+    # task, tile image
+    finished = pyqtSignal(object, QImage)
+
+
+class TileReadTask(QRunnable):
+    def __init__(self, source, path):
+        super().__init__()
+        self.setAutoDelete(False)
+        self.source = source
+        self.path = path
+        self.signals = _TileSignals()
+
+    def run(self):
+        # Skip tiles that were panned out of view while waiting in the queue
+        if self.path not in self.source.wanted:
+            image = QImage()
+        else:
+            with recorder.time("tile_read"):
+                image = QImage(self.path)
+                # The formats the raster paint engine draws fastest
+                if image.hasAlphaChannel():
+                    image = image.convertToFormat(QImage.Format_ARGB32_Premultiplied)
+                elif image.format() != QImage.Format_RGB32:
+                    image = image.convertToFormat(QImage.Format_RGB32)
+        self.signals.finished.emit(self, image)
+
+
+class TileSource(QObject):
+    """
+    Tiles of the pyramids on screen, kept in an ImageCache bounded by
+    max_bytes. Views call tile() for what they draw and request() for what
+    they need; tiles_changed asks them to repaint. Pyramid levels are built
+    in a process pool of build_workers. All bookkeeping happens on the GUI
+    thread; workers only read or build.
+    """
+
+    tiles_changed = pyqtSignal()
+    # (pyramid directory, level), finished future; emitted from the executor's thread
+    _build_done = pyqtSignal(object, object)
+
+    def __init__(self, store, max_bytes=128 * 1024 * 1024, read_workers=2, build_workers=2, parent=None):
+        super().__init__(parent)
+        # ThumbnailStore holding the tiles
+        self.store = store
+        self.cache = ImageCache(max_bytes)
+        self.pool = QThreadPool(self)
+        self.pool.setMaxThreadCount(max(1, read_workers))
+        self.build_workers = build_workers
+        self.executor = None
+
+        # { source path: TilePyramid or None }
+        self.pyramids = {}
+        # { view: set of tile paths }, and their union read by the workers
+        self.wanted_by = {}
+        self.wanted = frozenset()
+        # { tile path: TileReadTask } queued or running
+        self.pending = {}
+        # Tiles that failed to read
+        self.failed = set()
+        # { (pyramid directory, level): future } of running builds, and builds that failed
+        self.builds = {}
+        self.failed_builds = set()
+        # Levels known to be built, so views do not stat for them on every paint
+        self.built = set()
+
+        self._build_done.connect(self._on_build_done)
+        self.poll_timer = QTimer(self)
+        self.poll_timer.setInterval(BUILD_POLL_MS)
+        self.poll_timer.timeout.connect(self.tiles_changed.emit)
+
+    def pyramid(self, path):
+        """
+        Return the TilePyramid of an image, or None if it cannot be read.
+        """
+        if path not in self.pyramids:
+            with recorder.time("tile_pyramid_open"):
+                self.pyramids[path] = open_pyramid(self.store, path)
+        return self.pyramids[path]
+
+    def is_built(self, pyramid, level):
+        key = (pyramid.directory, level)
+        if key in self.built:
+            return True
+        if pyramid.is_built(level):
+            self.built.add(key)
+            return True
+        return False
+
+    def tile(self, pyramid, level, col, row):
+        """
+        Return the cached QImage of a tile, or None.
+        """
+        entry = self.cache.entries.get(pyramid.tile_path(level, col, row))
+        return entry[0] if entry is not None else None
+
+    def ensure_built(self, path, pyramid, level):
+        """
+        Return True if a level of the pyramid is built, otherwise start
+        building it (unless a build of it failed) and return False.
+        """
+        if self.is_built(pyramid, level):
+            return True
+        key = (pyramid.directory, level)
+        if key in self.builds or key in self.failed_builds:
+            return False
+        if self.executor is None:
+            self.executor = ProcessPoolExecutor(max_workers=max(1, self.build_workers))
+        member = archive_source.split_member(path)
+        future = self.executor.submit(build_job, (pyramid, path, member[0] if member else None, level))
+        self.builds[key] = future
+        # Coarse levels are written first; repaint so they show up while the rest is built
+        self.poll_timer.start()
+        future.add_done_callback(lambda done, key=key: self._build_done.emit(key, done))
+        return False
+
+    def request(self, view, pyramid, tiles):
+        """
+        Make the (level, col, row) tiles of built levels the ones view needs:
+        start reading those not cached, in the given order, and drop queued
+        reads no view needs any more.
+        """
+        paths = [pyramid.tile_path(level, col, row) for level, col, row in tiles]
+        self.wanted_by[view] = set(paths)
+        self.wanted = frozenset().union(*self.wanted_by.values())
+        for tile_path in list(self.pending):
+            if tile_path not in self.wanted and self.pool.tryTake(self.pending[tile_path]):
+                del self.pending[tile_path]
+
+        for tile_path in paths:
+            if tile_path in self.pending or tile_path in self.failed or tile_path in self.cache:
+                continue
+            task = TileReadTask(self, tile_path)
+            task.signals.finished.connect(self._on_read)
+            self.pending[tile_path] = task
+            self.pool.start(task)
+
+    def forget(self, view):
+        """
+        A view no longer needs its tiles, e.g. when it is hidden.
+        """
+        self.wanted_by.pop(view, None)
+        self.wanted = frozenset().union(*self.wanted_by.values())
+
+    def _on_build_done(self, key, future):
+        self.builds.pop(key, None)
+        if not self.builds:
+            self.poll_timer.stop()
+        try:
+            future.result()
+        except Exception as e:
+            print(f"Failed to build tiles in {key[0]} (level {key[1]}): {e}")
+            self.failed_builds.add(key)
+        self.tiles_changed.emit()
+
+    def _on_read(self, task, image):
+        if self.pending.get(task.path) is task:
+            del self.pending[task.path]
+        if image.isNull():
+            if task.path in self.wanted:
+                print(f"Failed to load tile: {task.path}")
+                self.failed.add(task.path)
+            return
+        self.cache.put(task.path, image, image.sizeInBytes())
+        self.tiles_changed.emit()
+
+    def shutdown(self):
+        self.wanted_by.clear()
+        self.wanted = frozenset()
+        for task in self.pending.values():
+            self.pool.tryTake(task)
+        # Running tasks stay referenced until they finish
+        self.pool.waitForDone()
+        self.pending.clear()
+        self.poll_timer.stop()
+        if self.executor is not None:
+            self.executor.shutdown(wait=True, cancel_futures=True)
+            self.executor = None
+
+
+class ZoomState(QObject):
+    """
+    Zoom and pan shared by the views of a pair. scale is in view pixels per
+    pixel of the reference (Folder A) image, or None to fit each image in
+    its view; center is the point in the middle of the views, as fractions
+    of the image width and height.
+    """
+
+    changed = pyqtSignal()
+
+    def __init__(self, parent=None):
+        super().__init__(parent)
+        self.scale = None
+        self.center = (0.5, 0.5)
+        self.reference_width = 1
+
+    def set(self, scale, center):
+        cx, cy = center
+        self.scale = scale
+        self.center = (min(1.0, max(0.0, cx)), min(1.0, max(0.0, cy)))
+        self.changed.emit()
+
+    def fit(self):
+        self.set(None, (0.5, 0.5))
+
+
+class TileView(QWidget):
+    """
+    One image of the pair, drawn from its tile pyramid at the shared zoom.
+    Wheel zooms about the cursor, dragging pans, double-click fits.
+    """
+
+    def __init__(self, source, state, parent=None):
+        super().__init__(parent)
+        self.source = source
+        self.state = state
+        self.path = None
+        self.pyramid = None
+        # Display-size image drawn where no tile is available yet
+        self.preview = None
+        self.drag_pos = None
+        self.setMinimumSize(200, 200)
+        self.setAttribute(Qt.WA_OpaquePaintEvent)
+        self.setFocusPolicy(Qt.NoFocus)
+        state.changed.connect(self.update)
+        source.tiles_changed.connect(self.update)
+
+    def set_image(self, path, preview=None):
+        self.path = path
+        self.pyramid = self.source.pyramid(path) if path else None
+        self.preview = preview if preview is not None and not preview.isNull() else None
+        self.update()
+
+    def fit_scale(self):
+        return min(self.width() / self.pyramid.width, self.height() / self.pyramid.height)
+
+    def image_scale(self):
+        """
+        View pixels per pixel of this image.
+        """
+        if self.state.scale is None:
+            return self.fit_scale()
+        return self.state.scale * self.state.reference_width / self.pyramid.width
+
+    def image_rect(self, scale):
+        """
+        Where the whole image lies in view coordinates, as a QRectF.
+        """
+        cx, cy = self.state.center
+        if self.state.scale is None:
+            cx = cy = 0.5
+        left = self.width() / 2 - cx * self.pyramid.width * scale
+        top = self.height() / 2 - cy * self.pyramid.height * scale
+        return QRectF(left, top, self.pyramid.width * scale, self.pyramid.height * scale)
+
+    def paintEvent(self, event):
+        painter = QPainter(self)
+        painter.fillRect(self.rect(), QColor(40, 40, 40))
+        if self.pyramid is None:
+            painter.setPen(QColor(220, 220, 220))
+            painter.drawText(self.rect(), Qt.AlignCenter, "Failed to load image" if self.path else "")
+            return
+        with recorder.time("zoom_paint"):
+            self.paint_tiles(painter)
+
+    def paint_tiles(self, painter):
+        pyramid = self.pyramid
+        scale = self.image_scale()
+        level = pyramid.level_for_scale(scale)
+        level_width, level_height = pyramid.level_size(level)
+        image_rect = self.image_rect(scale)
+        # View pixels per pixel of the level
+        sx = image_rect.width() / level_width
+        sy = image_rect.height() / level_height
+        tile = pyramid.tile_size
+        visible = image_rect.intersected(QRectF(self.rect()))
+        if visible.isEmpty():
+            return
+        cols, rows = pyramid.grid(level)
+        col0 = max(0, int((visible.left() - image_rect.left()) / sx) // tile)
+        col1 = min(cols - 1, int((visible.right() - image_rect.left()) / sx) // tile)
+        row0 = max(0, int((visible.top() - image_rect.top()) / sy) // tile)
+        row1 = min(rows - 1, int((visible.bottom() - image_rect.top()) / sy) // tile)
+
+        def edge_x(x):
+            # Tile edges in whole view pixels, shared by neighbours, so no seams show
+            return round(image_rect.left() + min(x, level_width) * sx)
+
+        def edge_y(y):
+            return round(image_rect.top() + min(y, level_height) * sy)
+
+        built = self.source.ensure_built(self.path, pyramid, level)
+        painter.setRenderHint(QPainter.SmoothPixmapTransform, self.drag_pos is None)
+        missing = []
+        for row in range(row0, row1 + 1):
+            for col in range(col0, col1 + 1):
+                target = QRect(edge_x(col * tile), edge_y(row * tile), 0, 0)
+                target.setRight(edge_x((col + 1) * tile) - 1)
+                target.setBottom(edge_y((row + 1) * tile) - 1)
+                image = self.source.tile(pyramid, level, col, row) if built else None
+                if image is not None:
+                    painter.drawImage(target, image)
+                    continue
+                missing.append((col, row))
+                self.paint_fallback(painter, target, level, col, row)
+
+        # Nearest to the middle of the view first
+        center_col = (col0 + col1) / 2
+        center_row = (row0 + row1) / 2
+        missing.sort(key=lambda t: (t[0] - center_col) ** 2 + (t[1] - center_row) ** 2)
+        wanted = []
+        if built:
+            wanted = [(level, col, row) for col, row in missing]
+        else:
+            # Until the level is built, read the tiles of the finest level that is
+            for coarser in range(level + 1, pyramid.levels):
+                if self.source.is_built(pyramid, coarser):
+                    shift = coarser - level
+                    for col, row in missing:
+                        parent = (coarser, col >> shift, row >> shift)
+                        if parent not in wanted:
+                            wanted.append(parent)
+                    break
+        self.source.request(self, pyramid, wanted)
+
+    def paint_fallback(self, painter, target, level, col, row):
+        """
+        Fill a missing tile from a cached tile of a coarser level, or from
+        the display-size image.
+        """
+        pyramid = self.pyramid
+        tile = pyramid.tile_size
+        level_width, level_height = pyramid.level_size(level)
+        # Level pixels covered by this tile (less than a tile at the right and bottom edges)
+        width = min(tile, level_width - col * tile)
+        height = min(tile, level_height - row * tile)
+        for coarser in range(level + 1, pyramid.levels):
+            shift = coarser - level
+            image = self.source.tile(pyramid, coarser, col >> shift, row >> shift)
+            if image is None:
+                continue
+            factor = 1 << shift
+            source = QRectF(col * tile / factor - (col >> shift) * tile,
+                            row * tile / factor - (row >> shift) * tile, width / factor, height / factor)
+            painter.drawImage(QRectF(target), image, source)
+            return
+        if self.preview is not None:
+            fx = self.preview.width() / level_width
+            fy = self.preview.height() / level_height
+            source = QRectF(col * tile * fx, row * tile * fy, width * fx, height * fy)
+            painter.drawImage(QRectF(target), self.preview, source)
+
+    def zoom_at(self, factor, pos=None):
+        """
+        Multiply the magnification by factor, keeping the image point under
+        pos (the view center by default) in place.
+        """
+        if self.pyramid is None:
+            return
+        scale = self.image_scale()
+        fit = self.fit_scale()
+        new_scale = min(MAX_ZOOM, scale * factor)
+        if new_scale <= fit:
+            self.state.fit()
+            return
+        image_rect = self.image_rect(scale)
+        if pos is None:
+            px, py = self.width() / 2, self.height() / 2
+        else:
+            px, py = pos.x(), pos.y()
+        # Image point under the cursor, as fractions of the image size
+        u = (px - image_rect.left()) / image_rect.width()
+        v = (py - image_rect.top()) / image_rect.height()
+        cx = u - (px - self.width() / 2) / (self.pyramid.width * new_scale)
+        cy = v - (py - self.height() / 2) / (self.pyramid.height * new_scale)
+        self.state.set(new_scale * self.pyramid.width / self.state.reference_width, (cx, cy))
+
+    def wheelEvent(self, event):
+        steps = event.angleDelta().y() / 120
+        if steps:
+            self.zoom_at(ZOOM_STEP ** steps, event.pos())
+
+    def mousePressEvent(self, event):
+        if event.button() == Qt.LeftButton:
+            self.drag_pos = event.pos()
+            self.setCursor(Qt.ClosedHandCursor)
+
+    def mouseMoveEvent(self, event):
+        if self.drag_pos is None or self.pyramid is None or self.state.scale is None:
+            return
+        delta = event.pos() - self.drag_pos
+        self.drag_pos = event.pos()
+        scale = self.image_scale()
+        cx, cy = self.state.center
+        self.state.set(self.state.scale, (cx - delta.x() / (self.pyramid.width * scale),
+                                          cy - delta.y() / (self.pyramid.height * scale)))
+
+    def mouseReleaseEvent(self, event):
+        if event.button() == Qt.LeftButton:
+            self.drag_pos = None
+            self.unsetCursor()
+            # Redraw smoothly now that panning stopped
+            self.update()
+
+    def mouseDoubleClickEvent(self, event):
+        self.state.fit()
+
+    def hideEvent(self, event):
+        self.source.forget(self)
+        super().hideEvent(event)
+
+
+class ZoomWindow(QWidget):
+    """
+    Folder A and Folder B images side by side at a shared zoom. Keys: + and -
+    zoom, 1 shows image pixels 1:1, 0 fits, Escape closes.
+    """
+
+    def __init__(self, source, parent=None):
+        super().__init__(parent, Qt.Window)
+        self.setWindowTitle("Zoom")
+        self.source = source
+        self.state = ZoomState(self)
+        self.view_a = TileView(source, self.state)
+        self.view_b = TileView(source, self.state)
+        layout = QHBoxLayout()
+        layout.setContentsMargins(0, 0, 0, 0)
+        layout.setSpacing(4)
+        layout.addWidget(self.view_a)
+        layout.addWidget(self.view_b)
+        self.setLayout(layout)
+        self.resize(1600, 900)
+        self.state.changed.connect(self.update_title)
+
+    def show_pair(self, path_a, path_b, preview_a=None, preview_b=None):
+        """
+        Show a pair, keeping the zoom and position if the Folder A image has
+        the same size as before.
+        """
+        old_width = self.view_a.pyramid.width if self.view_a.pyramid is not None else None
+        self.view_a.set_image(path_a, preview_a)
+        self.view_b.set_image(path_b, preview_b)
+        if self.view_a.pyramid is not None:
+            self.state.reference_width = self.view_a.pyramid.width
+            if self.view_a.pyramid.width != old_width:
+                self.state.fit()
+        self.update_title()
+
+    def update_title(self):
+        if self.view_a.pyramid is None:
+            self.setWindowTitle("Zoom")
+            return
+        pyramid = self.view_a.pyramid
+        self.setWindowTitle(f"Zoom - {self.view_a.image_scale():.0%} - {pyramid.width}x{pyramid.height}")
+
+    def keyPressEvent(self, event):
+        key = event.key()
+        if key in (Qt.Key_Plus, Qt.Key_Equal):
+            self.view_a.zoom_at(ZOOM_STEP)
+        elif key == Qt.Key_Minus:
+            self.view_a.zoom_at(1 / ZOOM_STEP)
+        elif key == Qt.Key_0:
+            self.state.fit()
+        elif key == Qt.Key_1 and self.view_a.pyramid is not None:
+            center = self.state.center if self.state.scale is not None else (0.5, 0.5)
+            self.state.set(1.0, center)
+        elif key == Qt.Key_Escape:
+            self.close()
+        else:
+            super().keyPressEvent(event)
+
+    def resizeEvent(self, event):
+        super().resizeEvent(event)
+        self.update_title()